@@ -1,13 +1,40 @@
+import asyncio
+import datetime
 from typing import Union, Tuple
 
 from .check import _permission_check, _guild_owner_check, ChannelInfo, init_blacklist
 from .data.db_control import db_control
 from .image.image import *
-from .image import image_to_bytes
+from .image.render_executor import shutdown_render_executor, run_in_render_executor
 from .config import plugin_config, driver, global_config, Config
-from .utils import dict_keyword_replace, multiple_replace
-from .data import reload_weapon_info, db_image, get_screenshot
-from .util import get_weapon_info_test, cron_job, push_job, send_msg
+from .utils import (
+    dict_keyword_replace,
+    multiple_replace,
+    close_http_client,
+    load_snapshot,
+    refresh_upstream_data,
+    get_upstream_stats,
+)
+from .data import (
+    reload_weapon_info,
+    db_image,
+    get_screenshot,
+    run_db,
+    get_weapon_catalogue,
+)
+from .util import (
+    get_weapon_info_test,
+    cron_job,
+    push_job,
+    send_msg,
+    prerender_job,
+    gc_blobs_job,
+    get_prerender_report,
+    get_push_report,
+    get_push_stats,
+    resume_push,
+    PUSH_MINUTE,
+)
 
 from .utils.bot import *
 
@@ -72,6 +99,8 @@ async def _(bot: Bot, event: Event):
         func = get_stages_image
         # 获取图片
         img = await get_save_temp_image(plain_text, func, num_list, contest_match, rule_match)
+        if img is None:
+            img = "没有找到符合条件的对战日程"
         # 发送消息
         await send_msg(bot, event, img)
 
@@ -107,10 +136,6 @@ async def _(bot: Bot, event: Event, re_tuple: Tuple = RegexGroup()):
         plain_text = plain_text + re_list[1]
     elif re_list[2]:
         plain_text = plain_text + re_list[2]
-    if re_list[3]:
-        plain_text = plain_text + re_list[3]
-    if re_list[4]:
-        plain_text = plain_text + re_list[4]
 
     num_list: list = []
     contest_match = None
@@ -164,10 +189,17 @@ async def _(bot: Bot, event: Event, re_tuple: Tuple = RegexGroup()):
 
     # 如果有匹配
     if flag_match:
+        # 触发词统一为 比赛+规则 的顺序，如 塔楼挑战 与 挑战塔楼 共用同一张缓存图片
+        if contest_match:
+            plain_text = plain_text + contest_match
+        if rule_match:
+            plain_text = plain_text + rule_match
         # 传递函数指针
         func = get_stages_image
         # 获取图片
         img = await get_save_temp_image(plain_text, func, num_list, contest_match, rule_match)
+        if img is None:
+            img = "没有找到符合条件的对战日程"
         # 发送消息
         await send_msg(bot, event, img)
 
@@ -238,7 +270,7 @@ async def _(bot: Bot, event: Event, re_tuple: Tuple = RegexGroup()):
         weapon_name = weapon_name.replace("贴牌", "")
 
     # 查询对应武器
-    build_info = db_image.get_build_info(weapon_name, is_deco)
+    build_info = await run_db(db_image.get_build_info, weapon_name, is_deco)
     if not build_info:
         msg = f"该关键词 {weapon_name} 未查询到对应武器，请试试使用官方中文武器名称或其他常用名称后再试，如:\n/配装 小绿\n指定模式查询:\n/配装 贴牌碳刷 塔楼"
         logger.warning(f"该关键词未匹配到武器 {weapon_name}")
@@ -291,7 +323,7 @@ async def _(bot: Bot, event: Event):
             msg = "请机器人管理员先发送 更新武器数据 更新本地武器数据库后，才能使用随机武器功能"
             await send_msg(bot, event, msg)
         else:
-            img = image_to_bytes(await get_random_weapon_image(plain_text))
+            img = await get_random_weapon_image(plain_text)
             # 发送消息
             await send_msg(bot, event, img)
     elif re.search("^祭典$", plain_text):
@@ -364,7 +396,8 @@ async def _(bot: Bot, event: Event, state: T_State, re_tuple: Tuple = RegexGroup
         elif re_list[0] == "关闭":
             status = 0
         if re_list[1] == "查询":
-            db_control.add_or_modify_MESSAGE_CONTROL(
+            await run_db(
+                db_control.add_or_modify_MESSAGE_CONTROL,
                 channel_info.bot_adapter,
                 channel_info.bot_id,
                 channel_info.source_type,
@@ -380,7 +413,8 @@ async def _(bot: Bot, event: Event, state: T_State, re_tuple: Tuple = RegexGroup
             if (not plugin_config.splatoon3_guild_owner_switch_push) & (user_level == "owner"):
                 logger.info(f"插件配置项未允许 频道服务器拥有者 修改主动推送开关")
                 return
-            db_control.add_or_modify_MESSAGE_CONTROL(
+            await run_db(
+                db_control.add_or_modify_MESSAGE_CONTROL,
                 channel_info.bot_adapter,
                 channel_info.bot_id,
                 channel_info.source_type,
@@ -393,7 +427,9 @@ async def _(bot: Bot, event: Event, state: T_State, re_tuple: Tuple = RegexGroup
         await send_msg(bot, event, f"已{re_list[0]}本频道 日程{re_list[1]} 功能")
 
 
-matcher_admin = on_regex("^[\\/.,，。]?(重载武器数据|更新武器数据|清空图片缓存)$", priority=8, block=True, permission=SUPERUSER)
+matcher_admin = on_regex(
+    "^[\\/.,，。]?(重载武器数据|更新武器数据|清空图片缓存|缓存统计|推送统计)$", priority=8, block=True, permission=SUPERUSER
+)
 
 
 # 重载武器数据，包括：武器图片，副武器图片，大招图片，武器配置信息
@@ -407,23 +443,47 @@ async def _(bot: Bot, event: Event):
     if re.search("^清空图片缓存$", plain_text):
         msg = "数据库合成图片缓存数据已清空！"
         try:
-            db_image.clean_image_temp()
+            # 清空时会遍历整个图片文件库，不能在事件循环中执行
+            await run_db(db_image.clean_image_temp)
         except Exception as e:
             msg = err_msg + str(e)
         # 发送消息
         await send_msg(bot, event, msg)
 
+    elif re.search("^缓存统计$", plain_text):
+        msg = "\n".join((get_temp_image_stats(), get_prerender_report(), get_push_report(), get_upstream_stats()))
+        await send_msg(bot, event, msg)
+
+    elif re.search("^推送统计$", plain_text):
+        msg = await run_db(get_push_stats)
+        await send_msg(bot, event, msg)
+
     elif re.search("^(重载武器数据|更新武器数据)$", plain_text):
-        msg_start = "将开始重新爬取武器数据，此过程可能需要10min左右,请稍等..."
-        msg = "武器数据更新完成"
+        # 更新武器数据 只处理变更的武器；重载武器数据 全部重新爬取
+        incremental = plain_text == "更新武器数据"
+        if incremental:
+            msg_start = "将开始增量更新武器数据，请稍等..."
+        else:
+            msg_start = "将开始重新爬取全部武器数据，此过程可能需要几分钟,请稍等..."
         await send_msg(bot, event, msg_start)
         try:
-            await reload_weapon_info()
+            report = await reload_weapon_info(incremental)
+            msg = "武器数据更新完成\n" + report
+            # 素材图片可能已被重新爬取，清空解码缓存
+            clean_asset_cache()
+            # 武器目录已重建，重新生成武器图集
+            await run_in_render_executor(build_weapon_atlas)
         except Exception as e:
             msg = err_msg + str(e) + "\n如果错误信息是timed out，不妨可以等会儿重新发送指令"
         await send_msg(bot, event, msg)
 
 
+# 启动时的上游数据后台刷新任务
+upstream_refresh_task = None
+# 启动时的武器图集生成任务
+weapon_atlas_task = None
+
+
 @driver.on_startup
 async def startup():
     """nb启动时事件"""
@@ -431,6 +491,18 @@ async def startup():
     # db_image.clean_image_temp()
     # 初始化黑名单字典
     init_blacklist()
+    # 预加载常用字体
+    preload_fonts()
+    # 载入内存武器目录
+    await run_db(get_weapon_catalogue)
+    # 后台生成武器图集，随机武器无需再解码缩放武器图片
+    global weapon_atlas_task
+    weapon_atlas_task = asyncio.create_task(run_in_render_executor(build_weapon_atlas))
+    # 从快照载入上游数据，重启后的首个请求无需等待网络
+    load_snapshot()
+    # 后台刷新已过期的上游数据
+    global upstream_refresh_task
+    upstream_refresh_task = asyncio.create_task(refresh_upstream_data())
 
 
 @driver.on_shutdown
@@ -439,6 +511,10 @@ async def shutdown():
     # 关闭数据库
     db_image.close()
     db_control.close()
+    # 关闭共享http连接池
+    await close_http_client()
+    # 关闭绘图线程池
+    shutdown_render_executor()
 
 
 @driver.on_bot_connect
@@ -460,7 +536,7 @@ async def _(bot: Bot):
         push_job,
         trigger="cron",
         hour="0,2,4,6,8,10,12,14,16,18,20,22",
-        minute=1,
+        minute=PUSH_MINUTE,
         id=job_id,
         args=[bot, bot_adapter, bot_id],
         misfire_grace_time=60,
@@ -468,3 +544,46 @@ async def _(bot: Bot):
         max_instances=1,
     )
     logger.info(f"add job {job_id}")
+
+    # bot重连后续推本轮换内因重启或断线未投递的消息，稍作等待确保bot已可正常发送
+    resume_job_id = f"sp3_schedule_push_resume_{bot_id}"
+    scheduler.add_job(
+        resume_push,
+        trigger="date",
+        run_date=datetime.datetime.now() + datetime.timedelta(seconds=10),
+        id=resume_job_id,
+        args=[bot],
+        replace_existing=True,
+        misfire_grace_time=60,
+    )
+
+    # 预渲染任务全部bot共用一个，在推送任务之前执行
+    prerender_job_id = "sp3_schedule_prerender_job"
+    if not scheduler.get_job(prerender_job_id):
+        scheduler.add_job(
+            prerender_job,
+            trigger="cron",
+            hour="0,2,4,6,8,10,12,14,16,18,20,22",
+            minute=0,
+            second=20,
+            id=prerender_job_id,
+            misfire_grace_time=60,
+            coalesce=True,
+            max_instances=1,
+        )
+        logger.info(f"add job {prerender_job_id}")
+
+    # 图片文件清理任务全部bot共用一个，在预渲染与推送之后执行
+    gc_job_id = "sp3_schedule_blob_gc_job"
+    if not scheduler.get_job(gc_job_id):
+        scheduler.add_job(
+            gc_blobs_job,
+            trigger="cron",
+            hour="0,2,4,6,8,10,12,14,16,18,20,22",
+            minute=5,
+            id=gc_job_id,
+            misfire_grace_time=60,
+            coalesce=True,
+            max_instances=1,
+        )
+        logger.info(f"add job {gc_job_id}")
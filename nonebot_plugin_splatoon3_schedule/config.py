@@ -30,6 +30,22 @@ class Config(BaseModel):
     splatoon3_is_official_bot: bool = False
     # 日程插件的帮助菜单优先模式(会影响帮助菜单由哪个插件提供，该配置项与nso查询插件公用)
     splatoon3_schedule_plugin_priority_mode: bool = False
+    # 是否在每次日程轮换时预渲染常用触发词的图片(如 图 工 活动 祭典 及全部比赛规则组合)
+    splatoon3_prerender_enable: bool = True
+    # 合成图片的内存缓存容量，单位MB，为0时不使用内存缓存
+    splatoon3_image_cache_size: int = 64
+    # 素材图片(地图、模式图标、背景等)解码后的内存缓存容量，单位MB，为0时不使用内存缓存
+    splatoon3_asset_cache_size: int = 32
+    # 绘图线程数，为0时根据cpu核数自动设置(至多4个)
+    splatoon3_render_workers: int = 0
+    # 主动推送时同时发送的频道数
+    splatoon3_push_concurrency: int = 8
+    # 主动推送时每个平台每秒最多发送的消息数，为0时不限速
+    splatoon3_push_rate: float = 5
+    # q群发图时的图片中转上传方式，kook 为经接入的kook bot上传，local 为本地测试用的文件库链接
+    splatoon3_image_relay: str = "kook"
+    # 上游数据(日程，祭典，翻译)过期后仍可继续使用的时限，单位小时，期间先返回旧数据并在后台刷新，上游故障时也继续使用旧数据
+    splatoon3_upstream_stale_cap: int = 6
 
 
 # 本地测试时由于不启动 driver，需要将下面三行注释并取消再下面两行的注释
@@ -2,3 +2,5 @@ from .data_source import *
 from .db_image import *
 from .static_data_getter import *
 from .db_control import *
+from .db_pool import run_db
+from .weapon_catalogue import weapon_catalogue, get_weapon_catalogue
@@ -0,0 +1,104 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from nonebot.log import logger
+
+# 回收宽限期，秒  写入(或复用)不足该时长的文件不会被回收，此时引用它的记录可能还未提交
+BLOB_GC_GRACE = 600
+
+
+class BlobStore:
+    """按内容寻址的图片文件库
+    文件以内容的sha256命名，按前两位分目录储存；相同内容只存一份，写入后不再修改"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        # put 判断文件是否存在与 gc 删除文件互斥
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_sha(data: bytes) -> str:
+        """取内容哈希"""
+        return hashlib.sha256(data).hexdigest()
+
+    def get_path(self, sha: str) -> Path:
+        """取文件路径  可直接交给支持本地文件的发送接口"""
+        return self.root / sha[:2] / sha
+
+    def has(self, sha: str) -> bool:
+        return self.get_path(sha).exists()
+
+    def put(self, data: bytes) -> str:
+        """写入内容并返回哈希  已存在时直接返回"""
+        sha = self.get_sha(data)
+        path = self.get_path(sha)
+        with self._lock:
+            if path.exists():
+                # 复用已有文件(可能是等待回收的文件)时刷新修改时间，使其进入回收宽限期
+                os.utime(path)
+                return sha
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 先写临时文件再改名，多线程同时写入同一内容时也不会读到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return sha
+
+    def get(self, sha: str) -> bytes:
+        """读取内容  文件不存在时返回None"""
+        path = self.get_path(sha)
+        try:
+            with open(path, "rb") as f:
+                # 空文件无法mmap
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b""
+                # 通过mmap直接从页缓存复制，不经过python的文件缓冲
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return mm[:]
+        except FileNotFoundError:
+            logger.warning(f"[BlobStore] 文件不存在 {sha}")
+            return None
+
+    def all_shas(self) -> set:
+        """取全部已储存文件的哈希"""
+        if not self.root.exists():
+            return set()
+        return {path.name for path in self.root.glob("??/*") if not path.name.endswith(".tmp")}
+
+    def gc(self, get_referenced, grace: float = BLOB_GC_GRACE) -> int:
+        """删除不再被任何记录引用的文件，返回删除数量
+        get_referenced 为返回被引用哈希集合的函数，需在列出文件后再调用，避免误删刚写入还未登记的文件
+        put 返回后到记录提交前，文件仍未被引用，因此只删除 grace 秒内没有写入或复用过的文件"""
+        shas = self.all_shas()
+        referenced = get_referenced()
+        cutoff = time.time() - grace
+        count = 0
+        for sha in shas - referenced:
+            path = self.get_path(sha)
+            with self._lock:
+                try:
+                    # 在锁内重新检查修改时间，列出文件后被 put 复用的文件不会被删除
+                    if path.stat().st_mtime >= cutoff:
+                        continue
+                    path.unlink()
+                    count += 1
+                except FileNotFoundError:
+                    pass
+        return count
+
+    def get_size(self) -> int:
+        """取文件库总大小(字节)"""
+        if not self.root.exists():
+            return 0
+        return sum(path.stat().st_size for path in self.root.glob("??/*"))
@@ -2,62 +2,141 @@ from playwright.async_api import Browser, async_playwright
 from playwright.sync_api import FloatRect
 
 from .db_image import db_image
+from .weapon_catalogue import get_weapon_catalogue
 from ..utils import *
 
 schedule_res = None
+# schedule_res 对应的对战日程索引，随日程数据一同刷新
+schedule_index = None
 _browser = None
 festivals_res = None
-festivals_res_save_ymdt: str
 
 
-def get_schedule_data():
-    """取日程数据"""
+def check_expire_schedule(schedule) -> bool:
+    """校验过期日程 当前时间不在第一个时段内即为过期"""
+    # json取到的时间是utc，本地时间也要取utc后才能比较
+    st = time_converter(schedule["regularSchedules"]["nodes"][0]["startTime"])
+    ed = time_converter(schedule["regularSchedules"]["nodes"][0]["endTime"])
+    now = get_time_now_china()
+    if st < now < ed:
+        return False
+    return True
 
-    # 校验过期日程
-    def check_expire_schedule(schedule):
-        # json取到的时间是utc，本地时间也要取utc后才能比较
-        st = time_converter(schedule["regularSchedules"]["nodes"][0]["startTime"])
-        ed = time_converter(schedule["regularSchedules"]["nodes"][0]["endTime"])
-        now = get_time_now_china()
-        if st < now < ed:
-            return False
-        return True
 
+def update_schedule(data):
+    """日程数据更新后 同步重建对战日程索引"""
     global schedule_res
-    if schedule_res is None or check_expire_schedule(schedule_res):
-        logger.info("重新请求:日程数据")
-        result = cf_http_get("https://splatoon3.ink/data/schedules.json").text
-        schedule_res = json.loads(result)
-        schedule_res = schedule_res["data"]
-        return schedule_res
-    else:
-        return schedule_res
+    global schedule_index
+    schedule_res = data
+    schedule_index = build_schedule_index(data)
 
 
-def get_festivals_data():
-    """取祭典数据"""
+def update_festivals(data):
     global festivals_res
-    global festivals_res_save_ymdt
-
-    # 校验过期祭典数据 记录%Y-%m-%dT%H，2h刷新一次
-    def check_expire_data(_festivals_res_save_ymd):
-        now_ymdt = get_expire_time()
-        if now_ymdt != _festivals_res_save_ymd:
-            return True
-        return False
-
-    if festivals_res is None or check_expire_data(festivals_res_save_ymdt):
-        logger.info("重新请求:祭典数据")
-        result = cf_http_get("https://splatoon3.ink/data/festivals.json").text
-        festivals_res = json.loads(result)
-        # 刷新储存时 时间
-        festivals_res_save_ymdt = get_expire_time()
-        return festivals_res
-    else:
-        return festivals_res
+    festivals_res = data
+
+
+# 日程数据 当前时间不在第一个时段内即为过期
+schedule_upstream = UpstreamData(
+    "schedules",
+    "https://splatoon3.ink/data/schedules.json",
+    parse=lambda res: res["data"],
+    check_expire=check_expire_schedule,
+    on_update=update_schedule,
+)
+# 祭典数据 按轮换整点过期
+festivals_upstream = UpstreamData("festivals", "https://splatoon3.ink/data/festivals.json", on_update=update_festivals)
+
+
+async def get_schedule_data():
+    """取日程数据  已过期时先返回旧数据并在后台刷新"""
+    return await schedule_upstream.get()
+
+
+def build_schedule_index(schedule) -> dict:
+    """构建对战日程索引
+    slots 键为 (时段索引, 比赛, 规则)，比赛或规则为None时表示不限，值为该时段满足条件的对战列表(按 涂地 挑战 开放 X 排序)
+    times 键为时段索引，值为该时段的 (开始时间, 结束时间)"""
+    # 涂地
+    regular = schedule["regularSchedules"]["nodes"]
+    # 真格
+    ranked = schedule["bankaraSchedules"]["nodes"]
+    # X段
+    xschedule = schedule["xSchedules"]["nodes"]
+
+    slots = {}
+    times = {}
+
+    def add_slot(_i, _contest, _rule, _node, _setting):
+        slot = {
+            "contest": _contest,
+            "rule": _rule,
+            "stages": _setting["vsStages"],
+            "start_time": _node["startTime"],
+            "end_time": _node["endTime"],
+        }
+        keys = [(_i, None, None), (_i, _contest, None)]
+        # 涂地只能按比赛筛选，不参与规则筛选
+        if _contest != "Turf War":
+            keys += [(_i, None, _rule), (_i, _contest, _rule)]
+        for key in keys:
+            slots.setdefault(key, []).append(slot)
+
+    for i, node in enumerate(regular):
+        # 时间表头取涂地模式的时间，除举办祭典外，都可用
+        times[i] = (node["startTime"], node["endTime"])
+        setting = node["regularMatchSetting"]
+        if setting is not None:
+            add_slot(i, "Turf War", setting["vsRule"]["rule"], node, setting)
+        if i < len(ranked) and ranked[i]["bankaraMatchSettings"] is not None:
+            for contest, setting in zip(("Ranked Challenge", "Ranked Open"), ranked[i]["bankaraMatchSettings"]):
+                add_slot(i, contest, setting["vsRule"]["rule"], ranked[i], setting)
+        if i < len(xschedule) and xschedule[i]["xMatchSetting"] is not None:
+            setting = xschedule[i]["xMatchSetting"]
+            add_slot(i, "X Schedule", setting["vsRule"]["rule"], xschedule[i], setting)
+    return {"slots": slots, "times": times}
+
+
+def get_schedule_index(schedule) -> dict:
+    """取对战日程索引  schedule为当前缓存的日程时直接复用已构建好的索引"""
+    global schedule_index
+    if schedule is schedule_res and schedule_index is not None:
+        return schedule_index
+    return build_schedule_index(schedule)
+
+
+def get_schedule_offset(index) -> int:
+    """取已结束的时段数
+    日程数据过期后仍在使用时，用户请求的第0个时段应为当前正在进行的时段"""
+    now = get_time_now_china()
+    offset = 0
+    for i in sorted(index["times"]):
+        if time_converter(index["times"][i][1]) > now:
+            break
+        offset += 1
+    return offset
+
+
+def query_schedule_index(index, num_list, contest_match=None, rule_match=None) -> list:
+    """按 时段索引列表 比赛 规则 查询对战日程索引
+    num_list 为相对于当前时段的索引
+    返回 [(日程中的时段索引, 对战列表)]，只包含有结果的时段"""
+    result = []
+    offset = get_schedule_offset(index)
+    for i in num_list:
+        i += offset
+        slots = index["slots"].get((i, contest_match, rule_match))
+        if slots:
+            result.append((i, slots))
+    return result
+
+
+async def get_festivals_data():
+    """取祭典数据"""
+    return await festivals_upstream.get()
 
 
-def get_coop_info(_all=None):
+async def get_coop_info(_all=None):
     """取 打工 信息"""
 
     # 取地图信息
@@ -105,9 +184,9 @@ def get_coop_info(_all=None):
         return False
 
     # 取日程
-    schedule = get_schedule_data()
+    schedule = await get_schedule_data()
     # 取翻译
-    get_trans_cht_data()
+    await get_trans_cht_data()
     # 一般打工数据
     regular_schedule = schedule["coopGroupingSchedule"]["regularSchedules"]["nodes"]
     # 团队打工竞赛
@@ -186,6 +265,7 @@ def get_coop_info(_all=None):
 
 def get_weapon_info(list_weapon: list):
     """取 装备信息"""
+    catalogue = get_weapon_catalogue()
     weapon1 = []
     weapon2 = []
     for v in list_weapon:
@@ -207,39 +287,21 @@ def get_weapon_info(list_weapon: list):
         elif _type == weapon_image_type[4]:
             # father_class
             zh_father_class = name
-        weaponData = db_image.get_weapon_info(zh_weapon_class, zh_weapon_sub, zh_weapon_special, zh_father_class)
-        weaponData2 = db_image.get_weapon_info(zh_weapon_class, zh_weapon_sub, zh_weapon_special, zh_father_class)
-        # 获取图片数据
-        # Main
-        weaponData.image = db_image.get_weapon_image(weaponData.name, weapon_image_type[0]).get("image")
-        weaponData2.image = db_image.get_weapon_image(weaponData2.name, weapon_image_type[0]).get("image")
-        # Sub
-        weaponData.sub_image = db_image.get_weapon_image(weaponData.sub_name, weapon_image_type[1]).get("image")
-        weaponData2.sub_image = db_image.get_weapon_image(weaponData2.sub_name, weapon_image_type[1]).get("image")
-        # Special
-        weaponData.special_image = db_image.get_weapon_image(weaponData.special_name, weapon_image_type[2]).get("image")
-        weaponData2.special_image = db_image.get_weapon_image(weaponData2.special_name, weapon_image_type[2]).get(
-            "image"
-        )
-        # Class
-        weaponData.weapon_class_image = db_image.get_weapon_image(weaponData.weapon_class, weapon_image_type[3]).get(
-            "image"
-        )
-        weaponData2.weapon_class_image = db_image.get_weapon_image(weaponData2.weapon_class, weapon_image_type[3]).get(
-            "image"
-        )
+        # 从内存武器目录随机取武器，不访问数据库
+        weaponData = catalogue.sample(zh_weapon_class, zh_weapon_sub, zh_weapon_special, zh_father_class)
+        weaponData2 = catalogue.sample(zh_weapon_class, zh_weapon_sub, zh_weapon_special, zh_father_class)
         # 添加
         weapon1.append(weaponData)
         weapon2.append(weaponData2)
     return weapon1, weapon2
 
 
-def get_stage_info(num_list=None, contest_match=None, rule_match=None):
+async def get_stage_info(num_list=None, contest_match=None, rule_match=None):
     """取 图 信息"""
     if num_list is None:
         num_list = [0]
-    schedule = get_schedule_data()
-    get_trans_cht_data()
+    schedule = await get_schedule_data()
+    await get_trans_cht_data()
     # 竞赛 规则
     if contest_match is not None and contest_match != "":
         new_contest_match = dict_contest_trans[contest_match]
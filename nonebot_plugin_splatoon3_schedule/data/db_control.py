@@ -4,6 +4,7 @@ from pathlib import Path
 from nonebot.log import logger
 
 from .db_image import DB_path
+from .db_pool import ConnectionPool
 
 DB_control = Path(os.path.join(DB_path, "control.db"))
 
@@ -11,20 +12,27 @@ DB_control = Path(os.path.join(DB_path, "control.db"))
 class DBCONTROL:
     _has_init = False
 
-    def __init__(self):
+    def __init__(self, db_path: Path = DB_path):
+        """:param db_path: 数据库目录，默认为插件资源目录下的db目录"""
         if not DBCONTROL._has_init:
-            if not DB_path.exists():
-                DB_control.mkdir(parents=True)
-            self.database_path = DB_control
-            self.conn = sqlite3.connect(self.database_path)
+            db_path = Path(db_path)
+            if not db_path.exists():
+                db_path.mkdir(parents=True)
+            self.database_path = db_path / DB_control.name
+            self.pool = ConnectionPool(self.database_path)
             # 打印sql日志
             # self.conn.set_trace_callback(print)
             self._create_table()
             logger.info("控制数据库连接！")
 
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """当前线程的数据库连接"""
+        return self.pool.conn
+
     def close(self):
         """关闭数据库"""
-        self.conn.close()
+        self.pool.close_all()
         logger.info("控制数据库关闭")
 
     def _create_table(self):
@@ -49,6 +57,40 @@ class DBCONTROL:
         # msg_source_type 消息来源类型 guild,channel,private,group,c2c  private为频道发起私聊 c2c为qq私聊;
         # status 是否启用  0为false 1为true;
         # active_push 是否主动推送 0为false 1为true;
+        # 同一消息来源只保留一行，供upsert使用，旧数据存在重复行时保留最早的一行(旧版本只会更新最早的一行)
+        index_sql = (
+            "CREATE UNIQUE INDEX IF NOT EXISTS UX_MESSAGE_CONTROL_SOURCE "
+            "ON MESSAGE_CONTROL(bot_adapter, bot_id, msg_source_type, msg_source_id);"
+        )
+        try:
+            c.execute(index_sql)
+        except sqlite3.IntegrityError:
+            logger.info("MESSAGE_CONTROL表存在重复数据，清理后创建唯一索引")
+            c.execute(
+                "DELETE FROM MESSAGE_CONTROL WHERE id NOT IN (SELECT MIN(id) FROM MESSAGE_CONTROL "
+                "GROUP BY bot_adapter, bot_id, msg_source_type, msg_source_id);"
+            )
+            c.execute(index_sql)
+        # 创建推送投递日志表 记录每个轮换每个推送目标每条消息的投递状态，重启后据此续推
+        # idempotency_key 为 轮换|适配器|bot id|目标|消息类型，同一条消息只会有一行
+        # status 投递状态 pending 未投递，sent 已投递，failed 重试耗尽仍失败
+        c.execute(
+            """CREATE TABLE IF NOT EXISTS PUSH_JOURNAL(
+                  "idempotency_key" text PRIMARY KEY,
+                  "rotation" text,
+                  "bot_adapter" text,
+                  "bot_id" text,
+                  "msg_source_id" text,
+                  "msg_kind" text,
+                  "status" text,
+                  "attempts" integer DEFAULT 0,
+                  "error" text,
+                  "update_time" text
+                );"""
+        )
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS IX_PUSH_JOURNAL_ROTATION ON PUSH_JOURNAL(rotation, bot_adapter, bot_id);"
+        )
         self.conn.commit()
 
     def check_msg_permission(self, bot_adapter: str, bot_id: str, msg_source_type: str, msg_source_id: str) -> bool:
@@ -83,7 +125,6 @@ class DBCONTROL:
             for row in rows:
                 result = dict(zip([column[0] for column in c.description], row))
                 results.append(result)
-        self.conn.commit()
         return results
 
     def get_all_push(self, bot_adapter: str, bot_id: str) -> [dict]:
@@ -98,7 +139,6 @@ class DBCONTROL:
             for row in rows:
                 result = dict(zip([column[0] for column in c.description], row))
                 results.append(result)
-        self.conn.commit()
         return results
 
     def add_or_modify_MESSAGE_CONTROL(
@@ -113,45 +153,105 @@ class DBCONTROL:
         status: int = None,
         active_push: int = None,
     ):
-        """添加或修改 消息控制表"""
+        """添加或修改 消息控制表  缺省(None)的字段不改变原有值"""
         sql = (
-            f"select * from MESSAGE_CONTROL where bot_adapter=? and bot_id=? and msg_source_type=? and msg_source_id=?"
+            f"INSERT INTO MESSAGE_CONTROL (bot_adapter,bot_id,msg_source_type,msg_source_id,msg_source_name,"
+            f"msg_source_parent_id,msg_source_parent_name,status,active_push) VALUES (?,?,?,?,?,?,?,?,?) "
+            f"ON CONFLICT(bot_adapter, bot_id, msg_source_type, msg_source_id) DO UPDATE SET "
+            f"msg_source_name=IFNULL(excluded.msg_source_name, MESSAGE_CONTROL.msg_source_name),"
+            f"msg_source_parent_id=IFNULL(excluded.msg_source_parent_id, MESSAGE_CONTROL.msg_source_parent_id),"
+            f"msg_source_parent_name=IFNULL(excluded.msg_source_parent_name, MESSAGE_CONTROL.msg_source_parent_name),"
+            f"status=IFNULL(excluded.status, MESSAGE_CONTROL.status),"
+            f"active_push=IFNULL(excluded.active_push, MESSAGE_CONTROL.active_push);"
         )
         c = self.conn.cursor()
-        c.execute(sql, (bot_adapter, bot_id, msg_source_type, msg_source_id))
-        row = c.fetchone()
-        if not row:  # create
-            sql = f"INSERT INTO MESSAGE_CONTROL (bot_adapter, bot_id,msg_source_type,msg_source_id,msg_source_name,msg_source_parent_id,msg_source_parent_name,status,active_push) VALUES (?,?,?,?,?,?,?,?,?);"
-            c.execute(
+        c.execute(
+            sql,
+            (
+                bot_adapter,
+                bot_id,
+                msg_source_type,
+                msg_source_id,
+                msg_source_name,
+                msg_source_parent_id,
+                msg_source_parent_name,
+                status,
+                active_push,
+            ),
+        )
+        self.pool.commit()
+
+
+    @staticmethod
+    def get_push_key(rotation: str, bot_adapter: str, bot_id: str, msg_source_id: str, msg_kind: str) -> str:
+        """推送投递的幂等键"""
+        return "|".join((rotation, bot_adapter, bot_id, msg_source_id, msg_kind))
+
+    def add_push_journal(self, rotation: str, bot_adapter: str, bot_id: str, msg_source_ids: list, msg_kinds: list):
+        """登记本轮换的推送投递  已登记的消息保持原状态不变"""
+        sql = (
+            f"INSERT INTO PUSH_JOURNAL (idempotency_key,rotation,bot_adapter,bot_id,msg_source_id,msg_kind,"
+            f"status,update_time) VALUES (?,?,?,?,?,?,'pending',datetime('now','localtime')) "
+            f"ON CONFLICT(idempotency_key) DO NOTHING;"
+        )
+        with self.pool.transaction() as conn:
+            conn.executemany(
                 sql,
                 (
-                    bot_adapter,
-                    bot_id,
-                    msg_source_type,
-                    msg_source_id,
-                    msg_source_name,
-                    msg_source_parent_id,
-                    msg_source_parent_name,
-                    status,
-                    active_push,
+                    (
+                        self.get_push_key(rotation, bot_adapter, bot_id, msg_source_id, msg_kind),
+                        rotation,
+                        bot_adapter,
+                        bot_id,
+                        msg_source_id,
+                        msg_kind,
+                    )
+                    for msg_source_id in msg_source_ids
+                    for msg_kind in msg_kinds
                 ),
             )
-        else:
-            result = dict(zip([column[0] for column in c.description], row))
-            _id = result["id"]
-            # 缺省时不改变值
-            if msg_source_parent_id is None:
-                msg_source_parent_id = result["msg_source_parent_id"]
-            if msg_source_parent_name is None:
-                msg_source_parent_name = result["msg_source_parent_name"]
-            if msg_source_name is None:
-                msg_source_name = result["msg_source_name"]
-            if status is None:
-                status = result["status"]
-            if active_push is None:
-                active_push = result["active_push"]
-            sql = f"UPDATE MESSAGE_CONTROL set msg_source_name=?,msg_source_parent_id=?, msg_source_parent_name=?,status=?,active_push=? where id=?"
-            c.execute(sql, (msg_source_name, msg_source_parent_id, msg_source_parent_name, status, active_push, _id))
+
+    def get_push_journal(self, rotation: str, bot_adapter: str, bot_id: str) -> [dict]:
+        """取某轮换某bot的全部推送投递记录"""
+        sql = (
+            f"select idempotency_key,msg_source_id,msg_kind,status,attempts from PUSH_JOURNAL "
+            f"where rotation=? and bot_adapter=? and bot_id=?"
+        )
+        c = self.conn.cursor()
+        c.execute(sql, (rotation, bot_adapter, bot_id))
+        columns = [column[0] for column in c.description]
+        return [dict(zip(columns, row)) for row in c.fetchall()]
+
+    def update_push_journal(self, idempotency_key: str, status: str, error: str = None, attempted: bool = True):
+        """更新推送投递状态  attempted 为本次是否实际调用了发送接口"""
+        sql = (
+            f"UPDATE PUSH_JOURNAL SET status=?,error=?,attempts=attempts+?,update_time=datetime('now','localtime') "
+            f"where idempotency_key=?"
+        )
+        c = self.conn.cursor()
+        c.execute(sql, (status, error, int(attempted), idempotency_key))
+        self.pool.commit()
+
+    def get_push_stats(self, limit: int = 6) -> [dict]:
+        """按轮换统计推送投递结果  取最近limit个轮换"""
+        sql = (
+            f"select rotation,bot_adapter,bot_id,count(distinct msg_source_id) as targets,"
+            f"sum(status='sent') as sent,sum(status='pending') as pending,sum(status='failed') as failed,"
+            f"sum(attempts) as attempts from PUSH_JOURNAL "
+            f"where rotation in (select distinct rotation from PUSH_JOURNAL ORDER BY rotation DESC LIMIT ?) "
+            f"GROUP BY rotation,bot_adapter,bot_id ORDER BY rotation DESC,bot_adapter,bot_id"
+        )
+        c = self.conn.cursor()
+        c.execute(sql, (limit,))
+        columns = [column[0] for column in c.description]
+        return [dict(zip(columns, row)) for row in c.fetchall()]
+
+    def clean_push_journal(self, keep_days: int = 7):
+        """删除过旧的推送投递记录"""
+        c = self.conn.cursor()
+        sql = f"delete from PUSH_JOURNAL where update_time < datetime('now','localtime',?);"
+        c.execute(sql, (f"-{keep_days} days",))
+        self.pool.commit()
 
 
 db_control = DBCONTROL()
@@ -3,41 +3,72 @@ import sqlite3
 from pathlib import Path
 from nonebot.log import logger
 
-from ..utils import WeaponData, DIR_RESOURCE
+from ..config import plugin_config
+from ..utils import WeaponData, DIR_RESOURCE, LRUCache, get_time_now_china, time_format_ymdh
+from .blob_store import BlobStore
+from .db_pool import ConnectionPool
 
 DB_path = Path(os.path.join(DIR_RESOURCE, "db"))
 DB_image = Path(os.path.join(DB_path, "image.db"))
+# 图片文件库  数据库中只保存图片的哈希
+DB_blobs = Path(os.path.join(DB_path, "blobs"))
+# 数据库结构版本 记录在 PRAGMA user_version 中
+# 1: 图片二进制数据从BLOB列迁移至文件库
+DB_image_version = 1
+# 储存图片的表与原BLOB列
+blob_columns = (("IMAGE_DATA", "image_data"), ("IMAGE_TEMP", "image_data"), ("WEAPON_IMAGES", "image"))
 
 
 class DBIMAGE:
     _has_init = False
 
-    def __init__(self):
+    def __init__(self, db_path: Path = DB_path):
+        """:param db_path: 数据库目录，默认为插件资源目录下的db目录"""
         if not DBIMAGE._has_init:
-            if not DB_path.exists():
-                DB_image.mkdir(parents=True)
-            self.database_path = DB_image
-            self.conn = sqlite3.connect(self.database_path)
+            self.db_path = Path(db_path)
+            if not self.db_path.exists():
+                self.db_path.mkdir(parents=True)
+            self.database_path = self.db_path / DB_image.name
+            # 绘图线程中也会读写素材图片，每个线程使用各自的连接
+            self.pool = ConnectionPool(self.database_path)
+            self.blobs = BlobStore(self.db_path / DB_blobs.name)
             # 打印sql日志
             # self.conn.set_trace_callback(print)
             self._create_table()
+            self._migrate_blobs()
+            # 合成图片缓存表前的内存缓存，值与 get_img_temp 的返回值相同
+            self.temp_cache = LRUCache(
+                plugin_config.splatoon3_image_cache_size * 1024 * 1024, sizeof=lambda v: len(v["image_data"])
+            )
             logger.info("图片数据库连接！")
 
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """当前线程的数据库连接"""
+        return self.pool.conn
+
+    def transaction(self):
+        """批量写入  with块内的写入在同一事务中提交"""
+        return self.pool.transaction()
+
     def clean_image_temp(self):
-        """载入插件时，清空合成图片缓存表"""
-        if DB_path.exists():
+        """载入插件时，清空合成图片缓存表
+        按输入数据哈希缓存的图片只要输入不变就不会改变，重启后继续保留"""
+        if self.db_path.exists():
             # 数据库文件存在时
             c = self.conn.cursor()
             # 清空合成图片缓存表
-            c.execute("delete from IMAGE_TEMP;")
-            self.conn.commit()
-            c.execute("VACUUM")
+            self.temp_cache.clear()
+            c.execute("delete from IMAGE_TEMP where input_key is null;")
+            c.execute("delete from IMAGE_RELAY;")
             self.conn.commit()
-            logger.info("数据库合成图片缓存数据已清空！")
+            # 图片数据已不在数据库内，表很小，无需VACUUM，只需删除不再被引用的图片文件
+            count = self.gc_blobs()
+            logger.info(f"数据库合成图片缓存数据已清空！删除图片文件{count}个")
 
     def close(self):
         """关闭数据库"""
-        self.conn.close()
+        self.pool.close_all()
         logger.info("图片数据库关闭")
 
     def _create_table(self):
@@ -89,24 +120,143 @@ class DBIMAGE:
                     image BLOB
                 );"""
         )
-        self.conn.commit()
+        # 创建武器同步状态表 记录每把武器上次写入时的行哈希，用于增量更新
+        c.execute(
+            """CREATE TABLE IF NOT EXISTS WEAPON_SYNC(
+                    name text PRIMARY KEY,
+                    row_hash text
+                );"""
+        )
+        # 创建http校验信息表 记录爬取过的url的 ETag Last-Modified 与内容哈希，用于条件请求
+        # resolved_url 为 File 页面解析出的图片真实地址，页面未改变(304)时直接使用
+        c.execute(
+            """CREATE TABLE IF NOT EXISTS HTTP_VALIDATORS(
+                    url text PRIMARY KEY,
+                    etag text,
+                    last_modified text,
+                    sha text,
+                    resolved_url text
+                );"""
+        )
+        # 创建图片中转链接表 记录q群发图时经其他平台上传得到的图片链接，键为图片内容哈希
+        c.execute(
+            """CREATE TABLE IF NOT EXISTS IMAGE_RELAY(
+                    image_sha text PRIMARY KEY,
+                    url text,
+                    expire_time text
+                );"""
+        )
+        # 武器图片表 以 name+type 作为唯一键，供upsert使用
+        self._create_unique_index("WEAPON_IMAGES", "UX_WEAPON_IMAGES_NAME_TYPE", ("name", "type"), keep="MAX")
+        # 图片文件哈希列，旧版本数据库中不存在时补充
+        for table, _ in blob_columns:
+            self._add_column(table, "image_sha", "text")
+        # 合成图片的输入数据哈希列，相同输入的图片无需重新渲染
+        self._add_column("IMAGE_TEMP", "input_key", "text")
+        c.execute("CREATE INDEX IF NOT EXISTS IX_IMAGE_TEMP_INPUT_KEY ON IMAGE_TEMP(input_key);")
+        self.pool.commit()
+
+    def _add_column(self, table: str, column: str, column_type: str):
+        """表中不存在该列时添加"""
+        c = self.conn.cursor()
+        c.execute(f"PRAGMA table_info({table});")
+        if column not in [row[1] for row in c.fetchall()]:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type};")
+
+    def _migrate_blobs(self):
+        """一次性迁移  将BLOB列中的图片写入文件库，数据库中只保留哈希"""
+        c = self.conn.cursor()
+        c.execute("PRAGMA user_version;")
+        if c.fetchone()[0] >= DB_image_version:
+            return
+        logger.info("开始将数据库内图片迁移至文件库，此过程只会执行一次")
+        db_size = os.path.getsize(self.database_path)
+        count = 0
+        with self.transaction() as conn:
+            for table, column in blob_columns:
+                # 逐行读取，避免一次将全部图片读入内存
+                ids = [row[0] for row in conn.execute(f"select id from {table} where {column} is not null;")]
+                for _id in ids:
+                    data = conn.execute(f"select {column} from {table} where id=?;", (_id,)).fetchone()[0]
+                    sha = self.blobs.put(data)
+                    conn.execute(f"update {table} set image_sha=?,{column}=NULL where id=?;", (sha, _id))
+                    count += 1
+            conn.execute(f"PRAGMA user_version={DB_image_version};")
+        # 回收BLOB占用的空间  WAL模式下需检查点后数据库文件才会缩小
+        self.conn.execute("VACUUM")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        logger.info(
+            "图片迁移完成，共{}张 数据库 {:.1f}MB -> {:.1f}MB 文件库 {:.1f}MB".format(
+                count,
+                db_size / 1024 / 1024,
+                os.path.getsize(self.database_path) / 1024 / 1024,
+                self.blobs.get_size() / 1024 / 1024,
+            )
+        )
+
+    def _read_blob(self, sha, data):
+        """读取图片  未迁移的旧数据仍在BLOB列中"""
+        if sha:
+            return self.blobs.get(sha)
+        return data
+
+    def get_referenced_shas(self) -> set:
+        """取全部被引用的图片哈希"""
+        c = self.conn.cursor()
+        shas = set()
+        for table, _ in blob_columns:
+            c.execute(f"select image_sha from {table} where image_sha is not null;")
+            shas.update(row[0] for row in c.fetchall())
+        # 本地中转上传的链接直接指向文件库中的文件
+        c.execute("select image_sha from IMAGE_RELAY;")
+        shas.update(row[0] for row in c.fetchall())
+        return shas
+
+    def gc_blobs(self) -> int:
+        """删除文件库中不再被引用的图片文件"""
+        return self.blobs.gc(self.get_referenced_shas)
+
+    def _create_unique_index(self, table: str, index_name: str, columns: tuple, keep: str = "MAX"):
+        """创建唯一索引  旧版本数据库中可能存在重复行，创建失败时按keep保留一行后重试"""
+        cols = ",".join(columns)
+        sql = f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table}({cols});"
+        c = self.conn.cursor()
+        try:
+            c.execute(sql)
+        except sqlite3.IntegrityError:
+            logger.info(f"{table}表存在重复数据，清理后创建唯一索引")
+            c.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT {keep}(id) FROM {table} GROUP BY {cols});")
+            c.execute(sql)
 
     def add_or_modify_IMAGE_DATA(self, image_name: str, image_data, image_zh_name: str, image_source_type: str):
         """添加或修改 图片数据表"""
-        sql = f"select * from IMAGE_DATA where image_name=?"
+        self.add_or_modify_IMAGE_DATA_bulk([(image_name, image_data, image_zh_name, image_source_type)])
+
+    def add_or_modify_IMAGE_DATA_bulk(self, records):
+        """批量添加或修改 图片数据表  records 为 [(image_name, image_data, image_zh_name, image_source_type)]
+        全部记录在同一事务中写入"""
+        sql = (
+            f"INSERT INTO IMAGE_DATA (image_sha,image_zh_name,image_source_type,image_name) VALUES (?, ?, ?, ?) "
+            f"ON CONFLICT(image_name) DO UPDATE SET image_sha=excluded.image_sha,image_data=NULL,"
+            f"image_zh_name=excluded.image_zh_name,image_source_type=excluded.image_source_type;"
+        )
+        # 先写文件再写数据库，数据库中的哈希总能找到对应文件
+        params = [
+            (self.blobs.put(data), zh_name, source_type, name) for name, data, zh_name, source_type in records
+        ]
+        with self.transaction() as conn:
+            conn.executemany(sql, params)
+
+    def get_img_names(self) -> set:
+        """取全部已储存的素材图片名称"""
+        sql = f"select image_name from IMAGE_DATA"
         c = self.conn.cursor()
-        c.execute(sql, (image_name,))
-        row = c.fetchone()
-        if not row:  # create
-            sql = f"INSERT INTO IMAGE_DATA (image_data, image_zh_name,image_source_type,image_name) VALUES (?, ?,?, ?);"
-        else:
-            sql = f"UPDATE IMAGE_DATA set image_data=?,image_zh_name=?,image_source_type=? where image_name=?"
-        c.execute(sql, (image_data, image_zh_name, image_source_type, image_name))
-        self.conn.commit()
+        c.execute(sql)
+        return {row[0] for row in c.fetchall()}
 
     def get_img_data(self, image_name) -> dict:
         """取图片信息(图片二进制数据)"""
-        sql = f"select image_data,image_zh_name,image_source_type from IMAGE_DATA where image_name=?"
+        sql = f"select image_sha,image_data,image_zh_name,image_source_type from IMAGE_DATA where image_name=?"
         c = self.conn.cursor()
         c.execute(sql, (image_name,))
         # 单行查询结果
@@ -114,28 +264,40 @@ class DBIMAGE:
         if row is not None:
             # 查询有结果时将查询结果转换为字典
             result = dict(zip([column[0] for column in c.description], row))
+            result["image_data"] = self._read_blob(result.pop("image_sha"), result["image_data"])
+            if result["image_data"] is None:
+                # 文件丢失时视为不存在，由调用方重新下载
+                result = None
         else:
             result = None
-        self.conn.commit()
         return result
 
-    def add_or_modify_IMAGE_TEMP(self, trigger_word: str, image_data, image_expire_time: str):
-        """添加或修改 图片缓存表"""
-        sql = f"select * from IMAGE_TEMP where trigger_word=?"
+    def add_or_modify_IMAGE_TEMP(self, trigger_word: str, image_data, image_expire_time: str, input_key: str = None):
+        """添加或修改 图片缓存表
+        :param input_key: 渲染所用输入数据的哈希，绘图函数未声明输入数据时为None"""
+        sql = (
+            f"INSERT INTO IMAGE_TEMP (image_sha,image_expire_time,input_key,trigger_word) VALUES (?, ?, ?, ?) "
+            f"ON CONFLICT(trigger_word) DO UPDATE SET image_sha=excluded.image_sha,image_data=NULL,"
+            f"image_expire_time=excluded.image_expire_time,input_key=excluded.input_key;"
+        )
+        sha = self.blobs.put(image_data)
         c = self.conn.cursor()
-        c.execute(sql, (trigger_word,))
-        row = c.fetchone()
-        if not row:  # create
-            sql = f"INSERT INTO IMAGE_TEMP ( image_data,image_expire_time,trigger_word) VALUES (?, ?, ?);"
-        else:
-            sql = f"UPDATE IMAGE_TEMP set image_data=?,image_expire_time=? where trigger_word=?"
-
-        c.execute(sql, (image_data, image_expire_time, trigger_word))
-        self.conn.commit()
+        c.execute(sql, (sha, image_expire_time, input_key, trigger_word))
+        self.pool.commit()
+        self.temp_cache.put(
+            trigger_word, {"image_data": image_data, "image_expire_time": image_expire_time, "input_key": input_key}
+        )
 
     def get_img_temp(self, trigger_word) -> dict:
-        """取图片缓存(图片二进制数据)"""
-        sql = f"select image_data,image_expire_time from IMAGE_TEMP where trigger_word=?"
+        """取图片缓存(图片二进制数据)  优先读取内存缓存"""
+        result = self.temp_cache.get(trigger_word)
+        if result is not None:
+            return result
+        return self.load_img_temp(trigger_word)
+
+    def load_img_temp(self, trigger_word) -> dict:
+        """从数据库取图片缓存并写入内存缓存  已在事件循环中查过内存缓存时直接调用，避免重复计入未命中"""
+        sql = f"select image_sha,image_data,image_expire_time,input_key from IMAGE_TEMP where trigger_word=?"
         c = self.conn.cursor()
         c.execute(sql, (trigger_word,))
         # 单行查询结果
@@ -143,51 +305,88 @@ class DBIMAGE:
         if row is not None:
             # 查询有结果时将查询结果转换为字典
             result = dict(zip([column[0] for column in c.description], row))
+            result["image_data"] = self._read_blob(result.pop("image_sha"), result["image_data"])
+            if result["image_data"] is None:
+                return None
+            self.temp_cache.put(trigger_word, result)
         else:
             result = None
-        self.conn.commit()
         return result
 
-    def add_or_modify_weapon_info(self, weapon: WeaponData):
-        """添加或修改 武器信息表"""
-        sql = f"select * from WEAPON_INFO where name=?"
+    def get_img_temp_by_input_key(self, input_key: str) -> dict:
+        """按输入数据哈希取图片缓存  其他触发词已用相同输入渲染过时直接复用"""
+        sql = f"select image_sha,image_data,image_expire_time,input_key from IMAGE_TEMP where input_key=? limit 1"
         c = self.conn.cursor()
-        c.execute(sql, (weapon.name,))
+        c.execute(sql, (input_key,))
         row = c.fetchone()
-        if not row:  # create
-            sql = (
-                f"INSERT INTO WEAPON_INFO (sub_name,special_name,special_points,"
-                f"level,weapon_class,zh_name,zh_sub_name,zh_special_name,zh_weapon_class,zh_father_class,name) "
-                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
-            )
-        else:
-            # 查询有结果时将查询结果转换为字典
-            result = dict(zip([column[0] for column in c.description], row))
-            # 如果存在中文名便保留原有名称
-            if result.get("zh_name") != "" and result.get("zh_name") != "None":
-                weapon.zh_name = result.get("zh_name")
-            sql = (
-                f"UPDATE WEAPON_INFO set sub_name=?,special_name=?,"
-                f"special_points=?,level=?,weapon_class=?,zh_name=?,zh_sub_name=?,"
-                f"zh_special_name=?,zh_weapon_class=?,zh_father_class=? where name=?"
-            )
-        c.execute(
-            sql,
-            (
-                weapon.sub_name,
-                weapon.special_name,
-                weapon.special_points,
-                weapon.level,
-                weapon.weapon_class,
-                weapon.zh_name,
-                weapon.zh_sub_name,
-                weapon.zh_special_name,
-                weapon.zh_weapon_class,
-                weapon.zh_father_class,
-                weapon.name,
-            ),
+        if row is None:
+            return None
+        result = dict(zip([column[0] for column in c.description], row))
+        result["image_data"] = self._read_blob(result.pop("image_sha"), result["image_data"])
+        if result["image_data"] is None:
+            return None
+        return result
+
+    def add_or_modify_IMAGE_RELAY(self, image_sha: str, url: str, expire_time: str):
+        """添加或修改 图片中转链接"""
+        sql = (
+            f"INSERT INTO IMAGE_RELAY (image_sha, url, expire_time) VALUES (?, ?, ?) "
+            f"ON CONFLICT(image_sha) DO UPDATE SET url=excluded.url,expire_time=excluded.expire_time;"
         )
-        self.conn.commit()
+        c = self.conn.cursor()
+        c.execute(sql, (image_sha, url, expire_time))
+        # 顺带清理已过期的链接  过期时间为 ymdh 格式字符串，可直接比较大小
+        c.execute("delete from IMAGE_RELAY where expire_time<=?;", (get_time_now_china().strftime(time_format_ymdh),))
+        self.pool.commit()
+
+    def get_image_relay(self, image_sha: str) -> str:
+        """取未过期的图片中转链接"""
+        sql = f"select url from IMAGE_RELAY where image_sha=? AND expire_time>?"
+        c = self.conn.cursor()
+        c.execute(sql, (image_sha, get_time_now_china().strftime(time_format_ymdh)))
+        row = c.fetchone()
+        if row is not None:
+            return row[0]
+        return None
+
+    def add_or_modify_weapon_info(self, weapon: WeaponData):
+        """添加或修改 武器信息表"""
+        self.add_or_modify_weapon_info_bulk([weapon])
+
+    def add_or_modify_weapon_info_bulk(self, weapons):
+        """批量添加或修改 武器信息表  全部记录在同一事务中写入"""
+        # 如果存在中文名便保留原有名称
+        sql = (
+            f"INSERT INTO WEAPON_INFO (sub_name,special_name,special_points,"
+            f"level,weapon_class,zh_name,zh_sub_name,zh_special_name,zh_weapon_class,zh_father_class,name) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            f"ON CONFLICT(name) DO UPDATE SET sub_name=excluded.sub_name,special_name=excluded.special_name,"
+            f"special_points=excluded.special_points,level=excluded.level,weapon_class=excluded.weapon_class,"
+            f"zh_name=CASE WHEN IFNULL(WEAPON_INFO.zh_name, '') NOT IN ('', 'None') "
+            f"THEN WEAPON_INFO.zh_name ELSE excluded.zh_name END,"
+            f"zh_sub_name=excluded.zh_sub_name,zh_special_name=excluded.zh_special_name,"
+            f"zh_weapon_class=excluded.zh_weapon_class,zh_father_class=excluded.zh_father_class;"
+        )
+        with self.transaction() as conn:
+            conn.executemany(
+                sql,
+                (
+                    (
+                        weapon.sub_name,
+                        weapon.special_name,
+                        weapon.special_points,
+                        weapon.level,
+                        weapon.weapon_class,
+                        weapon.zh_name,
+                        weapon.zh_sub_name,
+                        weapon.zh_special_name,
+                        weapon.zh_weapon_class,
+                        weapon.zh_father_class,
+                        weapon.name,
+                    )
+                    for weapon in weapons
+                ),
+            )
 
     def get_weapon_info(self, zh_weapon_class, zh_sub_name, zh_special_name, zh_father_class) -> WeaponData:
         """条件查询 武器信息 并随机输出一条结果"""
@@ -223,7 +422,6 @@ class DBIMAGE:
         else:
             weapon = None
             logger.error("查询武器失败，请检查武器数据表WEAPON_INFO和WEAPON_IMAGES内是否存在数据")
-        self.conn.commit()
         return weapon
 
     def get_all_weapon_info(self) -> [dict]:
@@ -241,41 +439,120 @@ class DBIMAGE:
                 results.append(result)
         else:
             logger.error("查询武器失败，请检查武器数据表WEAPON_INFO和WEAPON_IMAGES内是否存在数据")
-        self.conn.commit()
         return results
 
+    def get_all_weapon_data(self) -> [WeaponData]:
+        """查询 全部武器信息 完整字段"""
+        sql = (
+            f"select name,sub_name,special_name,special_points,level,weapon_class,"
+            f"zh_name,zh_sub_name,zh_special_name,zh_weapon_class,zh_father_class from WEAPON_INFO ORDER BY id"
+        )
+        c = self.conn.cursor()
+        c.execute(sql)
+        rows = c.fetchall()
+        columns = [column[0] for column in c.description]
+        return [WeaponData(**dict(zip(columns, row))) for row in rows]
+
+    def get_all_weapon_images(self) -> dict:
+        """查询 全部武器图片  返回 {(name, type): image}，文件丢失的图片不包含在内"""
+        sql = f"select name,type,image_sha,image from WEAPON_IMAGES"
+        c = self.conn.cursor()
+        c.execute(sql)
+        images = {}
+        for name, type_name, sha, image in c.fetchall():
+            image = self._read_blob(sha, image)
+            if image is not None:
+                images[(name, type_name)] = image
+        return images
+
+    def get_weapon_image_keys(self) -> set:
+        """查询 已存在的武器图片  返回 {(name, type)}
+        文件丢失的图片不包含在内，更新武器数据时会重新下载"""
+        sql = f"select name,type,image_sha,image is not null from WEAPON_IMAGES"
+        c = self.conn.cursor()
+        c.execute(sql)
+        keys = set()
+        for name, type_name, sha, has_image in c.fetchall():
+            # 未迁移的旧数据仍在BLOB列中
+            if self.blobs.has(sha) if sha else has_image:
+                keys.add((name, type_name))
+        return keys
+
+    def get_all_weapon_sync(self) -> dict:
+        """查询 武器同步状态  返回 {name: row_hash}"""
+        sql = f"select name,row_hash from WEAPON_SYNC"
+        c = self.conn.cursor()
+        c.execute(sql)
+        return dict(c.fetchall())
+
+    def add_or_modify_weapon_sync(self, name, row_hash):
+        """添加或修改 武器同步状态"""
+        self.add_or_modify_weapon_sync_bulk([(name, row_hash)])
+
+    def add_or_modify_weapon_sync_bulk(self, records):
+        """批量添加或修改 武器同步状态  records 为 [(name, row_hash)]"""
+        sql = (
+            f"INSERT INTO WEAPON_SYNC (name, row_hash) VALUES (?, ?) "
+            f"ON CONFLICT(name) DO UPDATE SET row_hash=excluded.row_hash;"
+        )
+        with self.transaction() as conn:
+            conn.executemany(sql, records)
+
+    def get_all_http_validators(self) -> dict:
+        """查询 http校验信息  返回 {url: {etag, last_modified, sha, resolved_url}}"""
+        sql = f"select url,etag,last_modified,sha,resolved_url from HTTP_VALIDATORS"
+        c = self.conn.cursor()
+        c.execute(sql)
+        columns = [column[0] for column in c.description]
+        return {row[0]: dict(zip(columns[1:], row[1:])) for row in c.fetchall()}
+
+    def add_or_modify_http_validator(self, url, etag, last_modified, sha, resolved_url=None):
+        """添加或修改 http校验信息"""
+        self.add_or_modify_http_validator_bulk([(url, etag, last_modified, sha, resolved_url)])
+
+    def add_or_modify_http_validator_bulk(self, records):
+        """批量添加或修改 http校验信息  records 为 [(url, etag, last_modified, sha, resolved_url)]"""
+        sql = (
+            f"INSERT INTO HTTP_VALIDATORS (url, etag, last_modified, sha, resolved_url) VALUES (?, ?, ?, ?, ?) "
+            f"ON CONFLICT(url) DO UPDATE SET etag=excluded.etag,last_modified=excluded.last_modified,"
+            f"sha=excluded.sha,resolved_url=IFNULL(excluded.resolved_url, HTTP_VALIDATORS.resolved_url);"
+        )
+        with self.transaction() as conn:
+            conn.executemany(sql, records)
+
     def add_or_modify_weapon_images(self, name, type_name, image):
         """
         添加或更新 武器图片数据
         type_name = (main|sub|special|class)
         """
-        sql = f"select * from WEAPON_IMAGES where name=? AND type=?"
-        c = self.conn.cursor()
-        c.execute(sql, (name, type_name))
-        row = c.fetchone()
-        if not row:  # create
-            sql = f"INSERT INTO WEAPON_IMAGES (image, name, type) VALUES (?, ?, ?);"
-        else:
-            # 需要使用两个条件进行判定，因为有重名图片
-            sql = f"UPDATE WEAPON_IMAGES set image=? where name=? AND type=?"
-        c.execute(sql, (image, name, type_name))
-        self.conn.commit()
+        self.add_or_modify_weapon_images_bulk([(name, type_name, image)])
+
+    def add_or_modify_weapon_images_bulk(self, records):
+        """批量添加或更新 武器图片数据  records 为 [(name, type_name, image)]，全部记录在同一事务中写入"""
+        # 需要使用两个条件进行判定，因为有重名图片
+        sql = (
+            f"INSERT INTO WEAPON_IMAGES (image_sha, name, type) VALUES (?, ?, ?) "
+            f"ON CONFLICT(name, type) DO UPDATE SET image_sha=excluded.image_sha,image=NULL;"
+        )
+        params = [(self.blobs.put(image), name, type_name) for name, type_name, image in records]
+        with self.transaction() as conn:
+            conn.executemany(sql, params)
 
     def get_weapon_image(self, name, type_name) -> dict:
         """取武器图片数据"""
-        sql = f"select image from WEAPON_IMAGES where name=? AND type=?"
+        sql = f"select image_sha,image from WEAPON_IMAGES where name=? AND type=?"
         c = self.conn.cursor()
         # 需要使用两个条件进行判定，因为有重名图片
         c.execute(sql, (name, type_name))
         # 单行查询结果
         row = c.fetchone()
-        if row is not None:
-            # 查询有结果时将查询结果转换为字典
-            result = dict(zip([column[0] for column in c.description], row))
-        else:
-            result = None
-        self.conn.commit()
-        return result
+        if row is None:
+            return None
+        image = self._read_blob(*row)
+        if image is None:
+            # 文件丢失时视为不存在
+            return None
+        return {"image": image}
 
     def get_build_info(self, keyword, is_deco) -> dict:
         """取配装数据"""
@@ -294,7 +571,6 @@ class DBIMAGE:
             result = dict(zip([column[0] for column in c.description], row))
         else:
             result = None
-        self.conn.commit()
         return result
 
 
@@ -0,0 +1,82 @@
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from nonebot.log import logger
+
+# 每个连接建立时执行的 pragma
+# WAL 模式下读写互不阻塞；synchronous=NORMAL 在WAL下仍能保证一致性，且写入不必每次fsync
+DEFAULT_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA busy_timeout=5000;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-8000;",
+)
+
+
+class ConnectionPool:
+    """sqlite 线程本地连接池
+    每个线程(事件循环线程，绘图线程，run_db的工作线程)首次访问时建立自己的连接，之后一直复用"""
+
+    def __init__(self, database_path, pragmas=DEFAULT_PRAGMAS):
+        self.database_path = database_path
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """取当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 关闭时需要由主线程统一关闭全部连接，故关闭同线程检查
+            conn = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+            for pragma in self.pragmas:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """批量写入  with块内当前线程的写入在同一事务中提交，出错时整体回滚"""
+        depth = getattr(self._local, "batch_depth", 0)
+        self._local.batch_depth = depth + 1
+        try:
+            yield self.conn
+        except BaseException:
+            if depth == 0:
+                self.conn.rollback()
+            raise
+        else:
+            if depth == 0:
+                self.conn.commit()
+        finally:
+            self._local.batch_depth = depth
+
+    def commit(self):
+        """提交当前线程的写入  处于transaction内时由transaction统一提交"""
+        if not getattr(self._local, "batch_depth", 0):
+            self.conn.commit()
+
+    def close_all(self):
+        """关闭全部线程的连接"""
+        with self._lock:
+            conns = self._conns
+            self._conns = []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"关闭数据库连接失败: {e}")
+        # 当前线程之后再次访问时重新建立连接
+        self._local = threading.local()
+
+
+async def run_db(func, *args, **kwargs):
+    """在工作线程中执行数据库操作，不阻塞事件循环"""
+    return await asyncio.to_thread(func, *args, **kwargs)
@@ -1,22 +1,346 @@
+import asyncio
+import hashlib
+import json
+import shutil
+import time
+from pathlib import Path
+
 from bs4 import BeautifulSoup
 
-from .db_image import db_image
+from .db_image import db_image, DB_path
+from .weapon_catalogue import weapon_catalogue
+from .db_pool import run_db
 from ..utils import *
 
 # 爬取地址
 weapon_url = "https://splatoonwiki.org/wiki/List_of_weapons_in_Splatoon_3"
 base_url = "https://splatoonwiki.org/wiki"
+# 同时进行的请求数
+CRAWLER_CONCURRENCY = 8
+# 单个请求失败时的重试次数
+CRAWLER_RETRY_TIMES = 3
+# 爬取中间结果暂存目录，爬取被中断时下次从这里继续
+crawl_staging_path = Path(os.path.join(DB_path, "weapon_crawl"))
+crawl_manifest_name = "manifest.json"
+# 每暂存多少张图片写入一次清单  中断时最多重新下载这么多张
+CRAWL_MANIFEST_FLUSH_SIZE = 20
+
+# 最近一次爬取的报告
+last_crawl_report = "暂未进行武器数据爬取"
+
+
+class CrawlStaging:
+    """爬取暂存目录  已下载的图片写入文件并记录在manifest中，全部写入数据库后删除
+    文件读写都在线程中进行，不阻塞事件循环"""
+
+    def __init__(self, path: Path, flush_size: int = CRAWL_MANIFEST_FLUSH_SIZE):
+        self.path = path
+        self.manifest_path = path / crawl_manifest_name
+        self.flush_size = flush_size
+        self.items = {}
+        # 已暂存但还未写入清单的图片数
+        self._unflushed = 0
+        # 清单按顺序写入，较早的快照不会覆盖较新的快照
+        self._flush_lock = asyncio.Lock()
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    self.items = json.load(f).get("items", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"武器爬取暂存清单读取失败，将重新爬取: {e}")
+                self.items = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def get_key(name, type_name) -> str:
+        return "{}|{}".format(type_name, name)
+
+    def has(self, name, type_name) -> bool:
+        return self.get_key(name, type_name) in self.items
+
+    async def save(self, name, type_name, image_data: bytes, validator: dict = None):
+        """暂存一张图片  validator 为该图片url的校验信息，随图片一同写入数据库
+        清单每暂存 flush_size 张图片写入一次，爬取结束时需要调用 flush 写入剩余部分"""
+        key = self.get_key(name, type_name)
+        file_name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".img"
+        await asyncio.to_thread(self._write_file, file_name, image_data)
+        self.items[key] = {
+            "name": name,
+            "type": type_name,
+            "file": file_name,
+            "bytes": len(image_data),
+            "validator": validator,
+        }
+        self._unflushed += 1
+        if self._unflushed >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        """写入清单"""
+        async with self._flush_lock:
+            if self._unflushed == 0:
+                return
+            self._unflushed = 0
+            # 在事件循环中复制，写入线程中不会遇到正在修改的字典
+            items = dict(self.items)
+            await asyncio.to_thread(self._write_manifest, items)
+
+    def _write_file(self, file_name: str, image_data: bytes):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / file_name, "wb") as f:
+            f.write(image_data)
+
+    def _write_manifest(self, items: dict):
+        """先写临时文件再改名，中途退出也不会留下半个清单"""
+        tmp_path = self.path / (crawl_manifest_name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"items": items}, f, ensure_ascii=False)
+        tmp_path.replace(self.manifest_path)
+
+    def load_images(self) -> list:
+        """读取全部暂存图片 返回 [(name, type, image_data)]"""
+        images = []
+        for item in self.items.values():
+            with open(self.path / item["file"], "rb") as f:
+                images.append((item["name"], item["type"], f.read()))
+        return images
+
+    def get_validators(self) -> dict:
+        """取全部暂存图片的校验信息 返回 {url: validator}"""
+        return {item["validator"]["url"]: item["validator"] for item in self.items.values() if item.get("validator")}
+
+    def clear(self):
+        """删除暂存目录"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.items = {}
+
+
+class CrawlReport:
+    """爬取报告"""
+
+    def __init__(self, incremental: bool):
+        self.incremental = incremental
+        self.start = time.perf_counter()
+        self.rows = 0
+        self.rows_changed = 0
+        self.images_new = 0
+        self.images_resumed = 0
+        self.images_not_modified = 0
+        self.bytes = 0
+        self.requests = 0
+        self.list_not_modified = False
+        self.failed = []
+        self.duration = 0.0
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    def get_text(self) -> str:
+        mode = "增量更新" if self.incremental else "全量重载"
+        if self.list_not_modified:
+            return "{} 武器列表未改变，无需更新 请求: {}次 耗时: {:.1f}s".format(mode, self.requests, self.duration)
+        text = (
+            "{} 武器数据: {}条(变更{}条) 新图片: {}张({:.1f}KB) 未改变: {}张 断点续传: {}张 "
+            "请求: {}次 耗时: {:.1f}s".format(
+                mode,
+                self.rows,
+                self.rows_changed,
+                self.images_new,
+                self.bytes / 1024,
+                self.images_not_modified,
+                self.images_resumed,
+                self.requests,
+                self.duration,
+            )
+        )
+        if self.failed:
+            text += "\n失败: {}张，再次发送 更新武器数据 将从断点继续\n{}".format(len(self.failed), "\n".join(self.failed[:10]))
+        return text
+
 
+def get_sha(data) -> str:
+    """内容哈希"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
 
-async def reload_weapon_info():
-    """爬取wiki数据 来重载武器数据，包括：武器图片，副武器图片，大招图片，武器配置信息"""
-    global weapon_url
-    response = await async_http_get(weapon_url)
-    soup = BeautifulSoup(response.text, "html.parser")
+
+def get_weapon_row_hash(weapon_data: WeaponData, images: [ImageInfo]) -> str:
+    """武器行哈希  由武器信息(含翻译)与类型图片地址计算，任一项改变时需要重新写入该武器"""
+    fields = [
+        weapon_data.name,
+        weapon_data.sub_name,
+        weapon_data.special_name,
+        weapon_data.special_points,
+        weapon_data.level,
+        weapon_data.weapon_class,
+        weapon_data.zh_name,
+        weapon_data.zh_sub_name,
+        weapon_data.zh_special_name,
+        weapon_data.zh_weapon_class,
+        weapon_data.zh_father_class,
+    ] + [img.url for img in images]
+    return get_sha(json.dumps(fields, ensure_ascii=False))
+
+
+async def reload_weapon_info(
+    incremental: bool = True, fetch=None, concurrency: int = CRAWLER_CONCURRENCY, staging_path: Path = None
+) -> str:
+    """爬取wiki数据 来重载武器数据，包括：武器图片，副武器图片，大招图片，武器配置信息
+    incremental 为True时只处理行哈希改变的武器，并对已爬取过的页面与图片发送条件请求；为False时全部重新爬取
+    fetch 为 async (url, headers) -> Response，默认使用共享http连接池，离线测试时可传入读取本地html的函数
+    返回爬取报告文本"""
+    global last_crawl_report
+    if fetch is None:
+        fetch = async_http_get
+    staging = CrawlStaging(staging_path or crawl_staging_path)
+    report = CrawlReport(incremental)
+    semaphore = asyncio.Semaphore(concurrency)
+    validators = await run_db(db_image.get_all_http_validators) if incremental else {}
+    # 本次爬取得到的新校验信息，与数据一同写入
+    new_validators = {}
+
+    async def fetch_with_retry(url, conditional=False):
+        """请求url  conditional为True且存在校验信息时发送条件请求，内容未改变(304)时返回None"""
+        headers = {}
+        validator = validators.get(url) if conditional else None
+        if validator:
+            if validator.get("etag"):
+                headers["If-None-Match"] = validator["etag"]
+            if validator.get("last_modified"):
+                headers["If-Modified-Since"] = validator["last_modified"]
+        for i in range(CRAWLER_RETRY_TIMES):
+            try:
+                async with semaphore:
+                    report.requests += 1
+                    response = await fetch(url, headers=headers or None)
+                if response.status_code == 304 and validator:
+                    return None
+                response.raise_for_status()
+                return response
+            except Exception as e:
+                if i == CRAWLER_RETRY_TIMES - 1:
+                    raise e
+                await asyncio.sleep(1 + i)
+
+    def get_validator(url, response, resolved_url=None) -> dict:
+        return {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha": get_sha(response.content),
+            "resolved_url": resolved_url,
+        }
+
+    async def crawl_image(img: ImageInfo, conditional: bool):
+        try:
+            if img.url is None:
+                # 先从 File 页面取图片真实地址，页面未改变时使用上次解析的地址
+                page_url = get_file_page_url(img)
+                page_validator = validators.get(page_url) or {}
+                response = await fetch_with_retry(page_url, conditional and bool(page_validator.get("resolved_url")))
+                if response is None:
+                    img.url = page_validator["resolved_url"]
+                else:
+                    img.url = parse_image_url(response.text)
+                    new_validators[page_url] = get_validator(page_url, response, img.url)
+            response = await fetch_with_retry(img.url, conditional)
+            if response is None:
+                report.images_not_modified += 1
+                return
+            image_data = response.content
+            if len(image_data) == 0:
+                raise ValueError("empty image")
+            validator = get_validator(img.url, response)
+            if conditional and (validators.get(img.url) or {}).get("sha") == validator["sha"]:
+                # 服务器不支持条件请求，但内容未改变
+                report.images_not_modified += 1
+                new_validators[img.url] = validator
+                return
+            await staging.save(img.name, img.source_type, image_data, validator)
+            report.images_new += 1
+            report.bytes += len(image_data)
+            logger.info("[ImageDB] new weapon image {}".format(img.name))
+        except Exception as e:
+            failed_keys.add((img.name, img.source_type))
+            report.failed.append("{} {}: {}".format(img.source_type, img.name, e))
+            logger.warning(f"武器图片爬取失败 {img.source_type} {img.name}: {e}")
+
+    # 武器列表  有未完成的暂存数据时需要完整请求，以便把暂存数据写入
+    response = await fetch_with_retry(weapon_url, conditional=incremental and len(staging) == 0)
+    if response is None:
+        report.list_not_modified = True
+        report.finish()
+        last_crawl_report = report.get_text()
+        logger.info("武器数据爬取完成 " + last_crawl_report)
+        return last_crawl_report
+    list_validator = get_validator(weapon_url, response)
+    rows = await parse_weapon_list(response.text)
+    report.rows = len(rows)
+
+    # 增量模式下跳过行哈希未改变的武器
+    sync_hashes = await run_db(db_image.get_all_weapon_sync) if incremental else {}
+    changed_rows = []
+    for weapon_data, images in rows:
+        row_hash = get_weapon_row_hash(weapon_data, images)
+        if sync_hashes.get(weapon_data.name) != row_hash:
+            changed_rows.append((weapon_data, images, row_hash))
+    report.rows_changed = len(changed_rows)
+
+    # 已在暂存目录中的图片不再重复下载，副武器大招等重名图片只下载一次
+    # 增量模式下 已在数据库中的图片发送条件请求，全量模式下全部重新下载
+    exist_keys = await run_db(db_image.get_weapon_image_keys)
+    failed_keys = set()
+    tasks = {}
+    for weapon_data, images, row_hash in changed_rows:
+        for img in images:
+            key = (img.name, img.source_type)
+            if key in tasks:
+                continue
+            if staging.has(img.name, img.source_type):
+                report.images_resumed += 1
+                tasks[key] = None
+            else:
+                tasks[key] = crawl_image(img, conditional=incremental and key in exist_keys)
+    await asyncio.gather(*[task for task in tasks.values() if task is not None])
+    # 有失败时暂存目录会保留到下次继续，需要写入完整清单
+    await staging.flush()
+
+    # 图片全部成功的武器才记录行哈希，失败的武器下次继续处理
+    weapons = []
+    weapon_hashes = []
+    for weapon_data, images, row_hash in changed_rows:
+        weapons.append(weapon_data)
+        if not any((img.name, img.source_type) in failed_keys for img in images):
+            weapon_hashes.append((weapon_data.name, row_hash))
+    new_validators.update(staging.get_validators())
+    if not report.failed:
+        new_validators[weapon_url] = list_validator
+
+    # 武器信息，新图片与校验信息在同一个事务中写入
+    staged_images = await asyncio.to_thread(staging.load_images)
+    await run_db(write_weapon_data, weapons, staged_images, weapon_hashes, list(new_validators.values()))
+    # 全部成功时清理暂存目录，有失败时保留以便下次继续
+    if not report.failed:
+        await asyncio.to_thread(staging.clear)
+    # 重建内存武器目录
+    await run_db(weapon_catalogue.load)
+    report.finish()
+    last_crawl_report = report.get_text()
+    logger.info("武器数据爬取完成 " + last_crawl_report)
+    return last_crawl_report
+
+
+async def parse_weapon_list(html: str) -> [(WeaponData, [ImageInfo])]:
+    """解析wiki武器列表  返回 [(武器信息, 该武器需要的图片列表)]"""
+    soup = BeautifulSoup(html, "html.parser")
     # 通过 selector 找到 Weapon list
     weapon_list = iter(soup.select_one("#mw-content-text > div > div > table > tbody").find_all("tr"))
     # 跳过表头
     next(weapon_list)
+    rows = []
     for weapon_info in weapon_list:
         # (image_td, name_td, id_td, sub_td, special_td, special_points_td, level_pd, price_td, class_pd)
         # 筛选掉用作分隔符的偶数下标元素
@@ -42,7 +366,7 @@ async def reload_weapon_info():
             weapon_data.zh_name = dict_weapon_main_trans[weapon_data.name]
         else:
             # 没有的话利用中英对照数据看能不能找到翻译数据(贴牌武器基本都不行，就只能等手动更新)
-            weapon_data.zh_name = weapons_trans_eng_to_cht(weapon_data.name)
+            weapon_data.zh_name = await weapons_trans_eng_to_cht(weapon_data.name)
         if weapon_data.sub_name in dict_weapon_sub_trans:
             weapon_data.zh_sub_name = dict_weapon_sub_trans[weapon_data.sub_name]
         if weapon_data.special_name in dict_weapon_special_trans:
@@ -55,9 +379,6 @@ async def reload_weapon_info():
                 weapon_data.name, weapon_data.sub_name, weapon_data.special_name, weapon_data.weapon_class
             )
         )
-        # 数据库新增 装备信息
-        db_image.add_or_modify_weapon_info(weapon_data)
-        # 数据库新增 装备图片
         names = [
             weapon_data.name,
             weapon_data.sub_name,
@@ -65,13 +386,12 @@ async def reload_weapon_info():
             weapon_data.weapon_class,
         ]
         ids = [0, 3, 4, 8]
+        images = []
         for i in range(3):
-            # 主武器图片、副武器图片、大招图片
-            await get_image_info(
-                ImageInfo(name=names[i], url=None, source_type=weapon_image_type[i], zh_name=None)
-            )  # 多余项忽略
+            # 主武器图片、副武器图片、大招图片，需要从 File 页面取真实地址
+            images.append(ImageInfo(name=names[i], url=None, source_type=weapon_image_type[i], zh_name=None))
         # 类型图片，没有找到 File 页面
-        await push_weapon_images(
+        images.append(
             ImageInfo(
                 name=names[3],
                 url="https:" + weapon_info[ids[3]].contents[0].contents[0].contents[0].attrs["src"],
@@ -79,39 +399,29 @@ async def reload_weapon_info():
                 zh_name=None,  # 多余项忽略
             )
         )
-    return True
+        rows.append((weapon_data, images))
+    return rows
 
 
-async def get_image_info(imageInfo: ImageInfo):
-    """网页爬取图片信息"""
-    global base_url
-    url = base_url + "/File:S3_Weapon_{}_{}.png".format(imageInfo.source_type, imageInfo.name.replace(" ", "_"))
-    response = await async_http_get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
-    imageInfo.url = "https:" + soup.select_one("#file > a > img").attrs["src"]
-    await push_weapon_images(imageInfo)
+def get_file_page_url(imageInfo: ImageInfo) -> str:
+    """武器图片的 File 页面地址"""
+    return base_url + "/File:S3_Weapon_{}_{}.png".format(imageInfo.source_type, imageInfo.name.replace(" ", "_"))
 
 
-async def push_weapon_images(img: ImageInfo):
-    """向数据库新增 武器图片 二进制文件"""
-    res = db_image.get_weapon_image(img.name, img.source_type)
-    if not res:
-        image_data = await get_file_url(img.url)
-        if len(image_data) != 0:
-            logger.info("[ImageDB] new weapon image {}".format(img.name))
-            db_image.add_or_modify_weapon_images(
-                img.name,
-                img.source_type,
-                image_data,
-            )
+def parse_image_url(html: str) -> str:
+    """从 File 页面解析图片真实地址"""
+    soup = BeautifulSoup(html, "html.parser")
+    return "https:" + soup.select_one("#file > a > img").attrs["src"]
 
 
-async def get_file_url(url):
-    """从网页读获取图片"""
-    resp = await async_http_get(url)
-    data = resp.content
-    return data
-
-
-if __name__ == "__main__":
-    reload_weapon_info()
+def write_weapon_data(weapons: [WeaponData], images: list, weapon_hashes: list, validators: list):
+    """在同一事务中写入 武器信息，武器图片，武器行哈希 与 http校验信息"""
+    with db_image.transaction():
+        # 数据库新增 装备信息
+        db_image.add_or_modify_weapon_info_bulk(weapons)
+        # 数据库新增 装备图片
+        db_image.add_or_modify_weapon_images_bulk(images)
+        db_image.add_or_modify_weapon_sync_bulk(weapon_hashes)
+        db_image.add_or_modify_http_validator_bulk(
+            [(v["url"], v["etag"], v["last_modified"], v["sha"], v["resolved_url"]) for v in validators]
+        )
@@ -0,0 +1,112 @@
+import copy
+import random
+import threading
+
+from nonebot.log import logger
+
+from .db_image import db_image
+from ..utils import WeaponData, weapon_image_type
+
+# 武器目录的分桶字段，对应随机武器的筛选条件
+WEAPON_BUCKET_FIELDS = ("zh_weapon_class", "zh_father_class", "zh_sub_name", "zh_special_name")
+
+
+class WeaponCatalogue:
+    """武器目录  WEAPON_INFO 与 WEAPON_IMAGES 的内存索引
+    随机武器请求只读取内存，不再访问数据库，武器数据重载后需要重新load"""
+
+    def __init__(self):
+        self.weapons: [WeaponData] = []
+        # {(name, type): image}
+        self.images = {}
+        # {字段: {值: [武器下标]}}
+        self.buckets = {field: {} for field in WEAPON_BUCKET_FIELDS}
+        # 筛选条件 -> 候选武器下标，每次load后清空
+        self._candidates_cache = {}
+        # 每次load后自增，供依赖武器数据的缓存判断是否失效
+        self.version = 0
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.weapons)
+
+    def load(self):
+        """从数据库载入全部武器信息与图片，并重建分桶索引"""
+        weapons = db_image.get_all_weapon_data()
+        images = db_image.get_all_weapon_images()
+        # 绘制武器图块需要 主武器 副武器 大招 三张图片，缺少图片(如文件丢失)的武器不参与随机
+        complete = [weapon for weapon in weapons if self.has_tile_images(weapon, images)]
+        if len(complete) < len(weapons):
+            logger.warning(f"{len(weapons) - len(complete)}把武器缺少图片，请发送 更新武器数据 重新下载")
+        weapons = complete
+        buckets = {field: {} for field in WEAPON_BUCKET_FIELDS}
+        for idx, weapon in enumerate(weapons):
+            for field in WEAPON_BUCKET_FIELDS:
+                buckets[field].setdefault(getattr(weapon, field), []).append(idx)
+        with self._lock:
+            self.weapons = weapons
+            self.images = images
+            self.buckets = buckets
+            self._candidates_cache = {}
+            self.version += 1
+            self.loaded = True
+        logger.info(f"武器目录已载入，共{len(weapons)}把武器，{len(images)}张武器图片")
+
+    def get_candidates(self, zh_weapon_class, zh_sub_name, zh_special_name, zh_father_class) -> list:
+        """取满足任一筛选条件的武器下标，条件全为空时为全部武器"""
+        key = (zh_weapon_class, zh_sub_name, zh_special_name, zh_father_class)
+        candidates = self._candidates_cache.get(key)
+        if candidates is None:
+            conditions = dict(zip(("zh_weapon_class", "zh_sub_name", "zh_special_name", "zh_father_class"), key))
+            if all(value == "" for value in conditions.values()):
+                candidates = list(range(len(self.weapons)))
+            else:
+                matched = set()
+                for field, value in conditions.items():
+                    if value != "":
+                        matched.update(self.buckets[field].get(value, []))
+                candidates = sorted(matched)
+            self._candidates_cache[key] = candidates
+        return candidates
+
+    def sample(self, zh_weapon_class, zh_sub_name, zh_special_name, zh_father_class) -> WeaponData:
+        """按条件随机取一把武器(含图片数据)  没有满足条件的武器时返回None"""
+        candidates = self.get_candidates(zh_weapon_class, zh_sub_name, zh_special_name, zh_father_class)
+        if not candidates:
+            logger.error("查询武器失败，请检查武器数据表WEAPON_INFO和WEAPON_IMAGES内是否存在数据")
+            return None
+        return self.with_images(self.weapons[random.choice(candidates)])
+
+    def all_weapons(self) -> [WeaponData]:
+        """取全部武器(含图片数据)"""
+        return [self.with_images(weapon) for weapon in self.weapons]
+
+    @staticmethod
+    def has_tile_images(weapon: WeaponData, images: dict) -> bool:
+        """武器图块需要的图片是否齐全"""
+        keys = (
+            (weapon.name, weapon_image_type[0]),
+            (weapon.sub_name, weapon_image_type[1]),
+            (weapon.special_name, weapon_image_type[2]),
+        )
+        return all(key in images for key in keys)
+
+    def with_images(self, weapon: WeaponData) -> WeaponData:
+        """返回附带图片数据的武器副本，避免调用方修改目录中的数据"""
+        weapon = copy.copy(weapon)
+        weapon.image = self.images.get((weapon.name, weapon_image_type[0]))
+        weapon.sub_image = self.images.get((weapon.sub_name, weapon_image_type[1]))
+        weapon.special_image = self.images.get((weapon.special_name, weapon_image_type[2]))
+        weapon.weapon_class_image = self.images.get((weapon.weapon_class, weapon_image_type[3]))
+        return weapon
+
+
+weapon_catalogue = WeaponCatalogue()
+
+
+def get_weapon_catalogue() -> WeaponCatalogue:
+    """取武器目录  首次使用时从数据库载入"""
+    if not weapon_catalogue.loaded:
+        weapon_catalogue.load()
+    return weapon_catalogue
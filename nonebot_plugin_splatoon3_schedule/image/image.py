@@ -1,20 +1,64 @@
-from ..data import get_coop_info, get_stage_info, get_weapon_info, get_schedule_data, get_screenshot
+import asyncio
+import copy
+import hashlib
+
+from ..data import (
+    get_coop_info,
+    get_stage_info,
+    get_weapon_info,
+    get_schedule_data,
+    get_festivals_data,
+    get_schedule_index,
+    query_schedule_index,
+    get_screenshot,
+    run_db,
+)
 from .image_processer import *
 from .image_processer_tools import image_to_bytes
+from .render_executor import run_render, run_compress_image
+
+
+async def prefetch_schedule_images(schedule, concurrency=8) -> int:
+    """预取 日程用到但数据库中还没有的素材图片  并发下载压缩后在同一事务中批量写入，返回新增数量"""
+    image_infos = get_schedule_image_infos(schedule)
+    exist_names = await run_db(db_image.get_img_names)
+    missing = [img for img in image_infos if img.name not in exist_names]
+    if not missing:
+        return 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def download(img: ImageInfo):
+        async with semaphore:
+            try:
+                image_data = await asyncio.to_thread(get_cf_file_url, img.url)
+            except Exception as e:
+                logger.warning(f"[ImageDB] 预取素材 {img.name} 失败: {e}")
+                return None
+        if len(image_data) == 0:
+            return None
+        # 与 load_save_file 一致，压缩到100k以下确保最后发出图片的大小
+        image_data = await run_compress_image(image_data, kb=100, step=10, quality=50)
+        return img.name, image_data, img.zh_name, img.source_type
+
+    records = [r for r in await asyncio.gather(*(download(img) for img in missing)) if r is not None]
+    if records:
+        await run_db(db_image.add_or_modify_IMAGE_DATA_bulk, records)
+        logger.info("[ImageDB] 预取新增素材 {}张".format(len(records)))
+    return len(records)
 
 
 async def get_coop_stages_image(*args):
     """取 打工图片"""
     _all = args[0]
     # 获取数据
-    stage, weapon, time, boss, mode = get_coop_info(_all)
+    stage, weapon, time, boss, mode = await get_coop_info(_all)
     # 绘制图片
-    image = get_coop_stages(stage, weapon, time, boss, mode)
+    image = await run_render(get_coop_stages, stage, weapon, time, boss, mode)
     return image
 
 
 async def get_stages_image(*args):
-    """取 对战图片"""
+    """取 对战图片  没有满足条件的对战时返回None"""
     num_list = args[0]
     contest_match = args[1]
     rule_match = args[2]
@@ -22,26 +66,37 @@ async def get_stages_image(*args):
     logger.info("contest_match为:" + str(contest_match))
     logger.info("rule_match为:" + str(rule_match))
     # 获取数据
-    schedule, new_num_list, new_contest_match, new_rule_match = get_stage_info(num_list, contest_match, rule_match)
+    schedule, new_num_list, new_contest_match, new_rule_match = await get_stage_info(
+        num_list, contest_match, rule_match
+    )
+    # 如果当前处于祭典，需要提前取好祭典数据
+    festivals = None
+    fest_nodes = schedule["festSchedules"]["nodes"]
+    if have_festival(fest_nodes) and now_is_festival(fest_nodes):
+        festivals = copy.deepcopy(await get_festivals_data())
     # 绘制图片
-    image = get_stages(schedule, new_num_list, new_contest_match, new_rule_match)
+    image = await run_render(get_stages, schedule, new_num_list, new_contest_match, new_rule_match, festivals)
     return image
 
 
 async def get_festival_image(*args):
     """取 祭典图片"""
-    festivals = get_festivals_data()
-    image = get_festival(festivals)
+    festivals = await get_festivals_data()
+    await get_trans_cht_data()
+    # 绘制时会写入翻译文本，传入副本避免修改缓存数据
+    image = await run_render(get_festival, copy.deepcopy(festivals))
     return image
 
 
 async def get_events_image(*args):
     """取 活动图片"""
-    schedule = get_schedule_data()
+    schedule = await get_schedule_data()
+    await get_trans_cht_data()
     events = schedule["eventSchedules"]["nodes"]
     # 如果存在活动
     if len(events) > 0:
-        image = get_events(events)
+        # 绘制时会写入翻译文本，传入副本避免修改缓存数据
+        image = await run_render(get_events, copy.deepcopy(events))
         return image
     else:
         return None
@@ -49,13 +104,13 @@ async def get_events_image(*args):
 
 async def get_help_image(*args):
     """取 帮助图片"""
-    image = get_help()
+    image = await run_render(get_help)
     return image
 
 
 async def get_nso_help_image(*args):
     """取 nso帮助图片"""
-    image = get_nso_help()
+    image = await run_render(get_nso_help)
     return image
 
 
@@ -116,67 +171,270 @@ async def get_random_weapon_image(*args):
     random.shuffle(weapon2)
 
     # 绘制图片
-    image = get_random_weapon(weapon1, weapon2)
+    image = await run_render(get_random_weapon, weapon1, weapon2)
     return image
 
 
+async def get_stages_expire_time() -> str:
+    """对战图片 过期时间  当前时段结束或下一个时段开始时，祭典时段开始时图片会切换为祭典图片"""
+    schedule = await get_schedule_data()
+    time_list = []
+    for key in ("regularSchedules", "bankaraSchedules", "xSchedules", "festSchedules"):
+        time_list += [node[k] for node in schedule[key]["nodes"] for k in ("startTime", "endTime")]
+    return get_expire_time_by_nodes(time_list)
+
+
+async def get_coop_expire_time() -> str:
+    """打工图片 过期时间  最早开始或结束的打工时段节点，时段开始时图片上的 已开始 标记会改变
+    大型跑与团队打工可能在一般打工时段中途开始"""
+    schedule = await get_schedule_data()
+    time_list = []
+    for key in ("regularSchedules", "bigRunSchedules", "teamContestSchedules"):
+        nodes = schedule["coopGroupingSchedule"][key]["nodes"]
+        time_list += [node[k] for node in nodes for k in ("startTime", "endTime")]
+    return get_expire_time_by_nodes(time_list)
+
+
+async def get_events_expire_time() -> str:
+    """活动图片 过期时间  最早开始或结束的活动时段节点，图片上各时段的 未开始/已结束 状态在此时改变"""
+    schedule = await get_schedule_data()
+    time_list = []
+    for event in schedule["eventSchedules"]["nodes"]:
+        time_list += [period[k] for period in event["timePeriods"] for k in ("startTime", "endTime")]
+    return get_expire_time_by_nodes(time_list)
+
+
+async def get_festival_expire_time() -> str:
+    """祭典图片 过期时间  祭典开始、中期、结束时；已结束(CLOSED)的祭典结果不会再变化，最长缓存一天等待新祭典公布"""
+    festivals = await get_festivals_data()
+    cap_hours = 24
+    time_list = []
+    for area in ("JP", "AP"):
+        nodes = festivals[area]["data"]["festRecords"]["nodes"]
+        if len(nodes) == 0 or nodes[0]["state"] == "CLOSED":
+            continue
+        time_list += [nodes[0].get(key) for key in ("startTime", "midtermTime", "endTime")]
+    if not time_list:
+        expire_time = get_time_now_china() + datetime.timedelta(hours=cap_hours)
+        return expire_time.strftime(time_format_ymdh).strip()
+    return get_expire_time_by_nodes(time_list, cap_hours=cap_hours)
+
+
+# 各绘图函数的缓存过期时间计算函数，按图片依赖的日程节点的实际开始、结束时间过期；未登记的函数按下一个轮换整点过期
+render_expire_getters = {
+    get_stages_image: get_stages_expire_time,
+    get_coop_stages_image: get_coop_expire_time,
+    get_events_image: get_events_expire_time,
+    get_festival_image: get_festival_expire_time,
+}
+
+
+async def get_render_expire_time(func) -> str:
+    """取绘图函数结果的缓存过期时间"""
+    getter = render_expire_getters.get(func)
+    if getter is None:
+        return get_expire_time()
+    try:
+        return await getter()
+    except Exception as e:
+        logger.warning(f"计算 {func.__name__} 缓存过期时间失败，按下一个轮换整点过期: {e}")
+        return get_expire_time()
+
+
+async def get_festival_input(*args) -> dict:
+    """祭典图片 输入数据  日服与港服最近一次祭典及其翻译"""
+    festivals = await get_festivals_data()
+    await get_trans_cht_data()
+    trans = get_trans_cht_cache()["festivals"]
+    nodes = [festivals[area]["data"]["festRecords"]["nodes"][:1] for area in ("JP", "AP")]
+    return {
+        "festivals": nodes,
+        "trans": {node["__splatoon3ink_id"]: trans.get(node["__splatoon3ink_id"]) for area in nodes for node in area},
+    }
+
+
+async def get_stages_input(*args) -> dict:
+    """对战图片 输入数据  与 get_stages 相同的查询结果及地图翻译，祭典期间为祭典图片的输入数据"""
+    schedule, num_list, contest_match, rule_match = await get_stage_info(args[0], args[1], args[2])
+    fest_nodes = schedule["festSchedules"]["nodes"]
+    if have_festival(fest_nodes) and now_is_festival(fest_nodes):
+        return {"festival": await get_festival_input()}
+    index = get_schedule_index(schedule)
+    groups = query_schedule_index(index, num_list, contest_match, rule_match)
+    if not groups and not have_festival(fest_nodes):
+        groups = query_schedule_index(index, sorted(index["times"]), contest_match, rule_match)
+    trans = get_trans_cht_cache()["stages"]
+    stage_ids = sorted({stage["id"] for _, slots in groups for slot in slots for stage in slot["stages"]})
+    return {
+        "contest": contest_match,
+        "groups": [(index["times"][i], slots) for i, slots in groups],
+        "trans": {_id: trans.get(_id) for _id in stage_ids},
+    }
+
+
+async def get_coop_input(*args) -> dict:
+    """打工图片 输入数据  get_coop_info 的结果及各时段是否已开始"""
+    stage, weapon, time, boss, mode = await get_coop_info(args[0])
+    return {
+        "stage": stage,
+        "weapon": weapon,
+        "time": time,
+        "boss": boss,
+        "mode": mode,
+        "started": [check_coop_fish(_time) for _time in time],
+    }
+
+
+async def get_events_input(*args) -> dict:
+    """活动图片 输入数据  活动日程、翻译及各时段的 未开始/已结束 状态"""
+    schedule = await get_schedule_data()
+    await get_trans_cht_data()
+    trans = get_trans_cht_cache()["events"]
+    events = schedule["eventSchedules"]["nodes"]
+    now = get_time_now_china()
+    event_ids = [event["leagueMatchSetting"]["leagueMatchEvent"]["id"] for event in events]
+    return {
+        "events": events,
+        "trans": {_id: trans.get(_id) for _id in event_ids},
+        "state": [
+            [(time_converter(p["startTime"]) > now, time_converter(p["endTime"]) < now) for p in event["timePeriods"]]
+            for event in events
+        ],
+    }
+
+
+# 各绘图函数声明的输入数据 (绘图版本, 取输入数据函数)
+# 缓存键为 绘图版本+输入数据 的哈希，输入不变时不再重新渲染；修改绘图代码改变了输出时，需要增加对应的绘图版本
+render_inputs = {
+    get_stages_image: (1, get_stages_input),
+    get_coop_stages_image: (1, get_coop_input),
+    get_events_image: (1, get_events_input),
+    get_festival_image: (1, get_festival_input),
+}
+
+
+# 渲染输入数据哈希的内存缓存  {(绘图函数, 参数): (上游数据版本, 过期时间, 哈希)}
+# 输入数据只由上游数据与当前时间决定，上游数据未被替换且未到 render_expire_getters 的过期时间时，哈希不会改变
+render_input_keys = {}
+
+
+async def get_render_input_key(func, *args) -> str:
+    """取渲染输入数据的哈希  绘图函数未声明输入数据或取数据失败时返回None，按过期时间缓存"""
+    render_input = render_inputs.get(func)
+    if render_input is None:
+        return None
+    memo_key = (func, repr(args))
+    data_version = get_upstream_data_version()
+    memo = render_input_keys.get(memo_key)
+    if memo is not None and memo[0] == data_version and get_time_now_china() < memo[1]:
+        return memo[2]
+    version, get_input = render_input
+    try:
+        data = await get_input(*args)
+    except Exception as e:
+        logger.warning(f"取 {func.__name__} 输入数据失败，按过期时间缓存: {e}")
+        return None
+    # 规范化json  键排序，ImageInfo 等对象按属性字典序列化
+    text = json.dumps(
+        [func.__name__, version, data], ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=vars
+    )
+    input_key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    # 取数据期间上游数据被替换时，记录的是旧版本，下次请求会重新计算
+    expire_time = datetime.datetime.strptime(await get_render_expire_time(func), time_format_ymdh)
+    render_input_keys[memo_key] = (data_version, expire_time, input_key)
+    return input_key
+
+
+# 合成图片缓存 并发渲染合并，同一输入(未声明输入时为同一触发词)同一时间只渲染一次
+temp_image_flight = SingleFlight()
+# 按输入数据哈希命中的次数  hits 为同一触发词输入未改变，shared 为复用其他触发词相同输入的图片
+render_input_stats = {"hits": 0, "shared": 0}
+
+
 async def get_save_temp_image(trigger_word, func, *args):
-    """向数据库新增或读取图片二进制  缓存图片"""
-    res = db_image.get_img_temp(trigger_word)
-    image: Image
-    image_data: bytes
-    if not res:
-        # 重新生成图片并写入
-        image = await func(*args)
-        if image is None:
-            return image
-        if isinstance(image, str):
-            # 错误文本消息
-            return image
-        if isinstance(image, Image.Image):
-            image_data = image_to_bytes(image)
-        else:
-            image_data = image
-        if len(image_data) != 0:
-            # 如果是太大的图片，需要压缩到1000k以下确保最后发出图片的大小
-            image_data = compress_image(image_data, kb=1000, step=10, quality=80)
-            logger.info("[ImageDB] new temp image {}".format(trigger_word))
-            if "配装" not in trigger_word:
-                db_image.add_or_modify_IMAGE_TEMP(trigger_word, image_data, get_expire_time())
-            else:
-                # 配装截图一个月过期
-                time_now = get_time_now_china()
-                expire_time = time_now + datetime.timedelta(days=30)
-                expire_time_str = expire_time.strftime(time_format_ymdh).strip()
-                db_image.add_or_modify_IMAGE_TEMP(trigger_word, image_data, expire_time_str)
-        return image_data
-    else:
-        image_expire_time = res.get("image_expire_time")
+    """向数据库新增或读取图片二进制  缓存图片
+    绘图函数声明了输入数据时，输入数据未改变即读取缓存图片，不再判断过期时间"""
+    input_key = await get_render_input_key(func, *args)
+    # 先查内存缓存，命中时不切换到数据库线程
+    res = db_image.temp_cache.get(trigger_word)
+    if res is None:
+        res = await run_db(db_image.load_img_temp, trigger_word)
+    if res:
         image_data = res.get("image_data")
-        # 判断时间是否过期
-        expire_time = datetime.datetime.strptime(image_expire_time, time_format_ymdh)
-        time_now = get_time_now_china()
-        if time_now >= expire_time or (time_now.hour == 0 and time_now.minute < 1):
-            # 重新生成图片并写入
-            image = await func(*args)
-            if image is None:
-                return image
-            if isinstance(image, str):
-                # 错误文本消息
-                return image
-            if isinstance(image, Image.Image):
-                image_data = image_to_bytes(image)
-            else:
-                image_data = image
-            if len(image_data) != 0:
-                # 如果是太大的图片，需要压缩到1000k以下确保最后发出图片的大小
-                image_data = compress_image(image_data, kb=1000, step=10, quality=80)
-                logger.info("[ImageDB] update temp image {}".format(trigger_word))
-                db_image.add_or_modify_IMAGE_TEMP(trigger_word, image_data, get_expire_time())
+        if input_key is not None:
+            if res.get("input_key") == input_key:
+                render_input_stats["hits"] += 1
+                logger.info(f"触发词:{trigger_word} 输入数据未改变，将读取缓存图片")
+                return image_data
+        else:
+            image_expire_time = res.get("image_expire_time")
+            # 判断时间是否过期
+            expire_time = datetime.datetime.strptime(image_expire_time, time_format_ymdh)
+            time_now = get_time_now_china()
+            if not (time_now >= expire_time or (time_now.hour == 0 and time_now.minute < 1)):
+                logger.info(f"触发词:{trigger_word} 存在时效范围内的缓存图片，将读取缓存图片")
+                # 缓存内已是压缩后的jpeg，直接返回，无需解码再编码
+                return image_data
+    if input_key is not None:
+        # 其他触发词已用相同输入渲染过，如 塔楼 与 真格塔楼 查询结果相同时
+        res = await run_db(db_image.get_img_temp_by_input_key, input_key)
+        if res:
+            render_input_stats["shared"] += 1
+            logger.info(f"触发词:{trigger_word} 存在相同输入的缓存图片，将复用缓存图片")
+            image_data = res.get("image_data")
+            await run_db(
+                db_image.add_or_modify_IMAGE_TEMP, trigger_word, image_data, res.get("image_expire_time"), input_key
+            )
             return image_data
+    # 缓存不存在或已失效，相同输入的并发请求只渲染一次，其余请求等待同一结果
+    flight_key = input_key or trigger_word
+    if temp_image_flight.is_running(flight_key):
+        logger.info(f"触发词:{trigger_word} 图片正在渲染中，将等待渲染结果")
+    return await temp_image_flight.do(flight_key, render_save_temp_image, trigger_word, input_key, func, *args)
+
+
+async def render_save_temp_image(trigger_word, input_key, func, *args):
+    """重新生成图片并写入缓存"""
+    image = await func(*args)
+    if image is None:
+        return image
+    if isinstance(image, str):
+        # 错误文本消息
+        return image
+    if isinstance(image, Image.Image):
+        image_data = image_to_bytes(image)
+    else:
+        image_data = image
+    if len(image_data) != 0:
+        # 如果是太大的图片，需要压缩到1000k以下确保最后发出图片的大小
+        image_data = await run_compress_image(image_data, kb=1000, step=10, quality=80)
+        logger.info("[ImageDB] new temp image {}".format(trigger_word))
+        if "配装" not in trigger_word:
+            expire_time_str = await get_render_expire_time(func)
         else:
-            logger.info(f"触发词:{trigger_word} 存在时效范围内的缓存图片，将读取缓存图片")
-            return image_to_bytes(Image.open(io.BytesIO(image_data)))
+            # 配装截图一个月过期
+            time_now = get_time_now_china()
+            expire_time = time_now + datetime.timedelta(days=30)
+            expire_time_str = expire_time.strftime(time_format_ymdh).strip()
+        await run_db(db_image.add_or_modify_IMAGE_TEMP, trigger_word, image_data, expire_time_str, input_key)
+    return image_data
+
+
+def get_temp_image_stats() -> str:
+    """合成图片缓存 统计信息"""
+    stats = temp_image_flight.stats
+    text = "合成图片缓存未命中{}次 实际渲染{}次 合并等待{}次 输入未改变命中{}次 复用相同输入{}次".format(
+        stats["calls"],
+        stats["executions"],
+        stats["coalesced"],
+        render_input_stats["hits"],
+        render_input_stats["shared"],
+    )
+    return "{}\n合成图片内存缓存: {}\n素材图片内存缓存: {}".format(
+        text,
+        db_image.temp_cache.get_stats_text(),
+        asset_cache.get_stats_text(),
+    )
 
 
 # 旧版 取 随机武器图片 不能进行缓存，这个需要实时生成
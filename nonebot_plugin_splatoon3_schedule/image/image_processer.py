@@ -1,4 +1,4 @@
-from ..data import get_festivals_data
+from ..data import get_schedule_index, query_schedule_index
 from .image_processer_tools import *
 from ..utils import *
 
@@ -42,7 +42,7 @@ def get_area_festival(festival, area_title, language_font_path) -> Image.Image:
         flag_festival_close = True
     # 获取翻译
     _id = festival["__splatoon3ink_id"]
-    festival_data = get_trans_cht_data()["festivals"]
+    festival_data = get_trans_cht_cache()["festivals"]
     trans_cht_festival_data = festival_data.get(_id)
     # 替换为翻译
     teams_list = []
@@ -68,7 +68,7 @@ def get_area_festival(festival, area_title, language_font_path) -> Image.Image:
     bg_rgb = dict_bg_rgb["祭典"]
     # 创建纯色背景
     image_background = Image.new("RGBA", image_background_size, bg_rgb)
-    bg_mask = get_file("festival_mask").resize((600, 400))
+    bg_mask = get_file("festival_mask", size=(600, 400))
     # 填充小图蒙版
     image_background = tiled_fill(image_background, bg_mask)
     # 圆角化
@@ -101,7 +101,7 @@ def get_events(events: list) -> Image.Image:
     bg_rgb = dict_bg_rgb["活动"]
     # 创建纯色背景
     image_background = Image.new("RGBA", background_size, bg_rgb)
-    bg_mask = get_file("cat_paw_mask").resize((400, 250))
+    bg_mask = get_file("cat_paw_mask", size=(400, 250))
     # 填充小图蒙版
     image_background = tiled_fill(image_background, bg_mask)
     # 圆角
@@ -116,7 +116,7 @@ def get_events(events: list) -> Image.Image:
         # 获取翻译
         cht_event_data = event["leagueMatchSetting"]["leagueMatchEvent"]
         _id = cht_event_data["id"]
-        trans_cht_event_data = get_trans_cht_data()["events"][_id]
+        trans_cht_event_data = get_trans_cht_cache()["events"][_id]
         # 替换为翻译文本
         cht_event_data["name"] = trans_cht_event_data.get("name", cht_event_data["name"])
         cht_event_data["desc"] = trans_cht_event_data.get("desc", cht_event_data["desc"])
@@ -125,20 +125,20 @@ def get_events(events: list) -> Image.Image:
         # 顶部活动标志(大号)
         pos_h += 20
         game_mode_img_size = (80, 80)
-        game_mode_img = get_file("event_bg").resize(game_mode_img_size, Image.ANTIALIAS)
+        game_mode_img = get_file("event_bg", size=game_mode_img_size, resample=Image.ANTIALIAS)
         game_mode_img_pos = (20, pos_h)
         paste_with_a(image_background, game_mode_img, game_mode_img_pos)
         pos_h += game_mode_img_size[1] + 20
         # 绘制主标题
         main_title = cht_event_data["name"]
         drawer = ImageDraw.Draw(image_background)
-        ttf = ImageFont.truetype(ttf_path_chinese, 40)
+        ttf = get_font(ttf_path_chinese, 40)
         main_title_pos = (game_mode_img_pos[0] + game_mode_img_size[0] + 20, game_mode_img_pos[1])
         main_title_size = ttf.getsize(main_title)
         drawer.text(main_title_pos, main_title, font=ttf, fill=(255, 255, 255))
         # 绘制描述
         desc = cht_event_data["desc"]
-        ttf = ImageFont.truetype(ttf_path_chinese, 30)
+        ttf = get_font(ttf_path_chinese, 30)
         desc_pos = (main_title_pos[0], main_title_pos[1] + main_title_size[1] + 10)
         drawer.text(desc_pos, desc, font=ttf, fill=(255, 255, 255))
         # 绘制对战卡片
@@ -165,60 +165,38 @@ def get_events(events: list) -> Image.Image:
     return image_background
 
 
-def get_stages(schedule, num_list, contest_match=None, rule_match=None) -> Image.Image:
-    """绘制 竞赛地图"""
-    # 涂地
-    regular = schedule["regularSchedules"]["nodes"]
-    # 真格
-    ranked = schedule["bankaraSchedules"]["nodes"]
-    # X段
-    xschedule = schedule["xSchedules"]["nodes"]
+# 对战卡片 比赛名称与比赛图标
+dict_contest_card = {
+    "Turf War": ("一般比赛", "Regular"),
+    "Ranked Challenge": ("蛮颓比赛-挑战", "Ranked-Challenge"),
+    "Ranked Open": ("蛮颓比赛-开放", "Ranked-Open"),
+    "X Schedule": ("X比赛", "X"),
+}
+
+
+def get_stages(schedule, num_list, contest_match=None, rule_match=None, festivals_data=None) -> Image.Image:
+    """绘制 竞赛地图
+    当前处于祭典时，需要传入已取好的祭典数据 festivals_data
+    没有任何满足条件的对战时返回None"""
     # 祭典
     festivals = schedule["festSchedules"]["nodes"]
 
     # 如果存在祭典，且当前时间位于祭典，转变为输出祭典地图，后续不再进行处理
-    if have_festival(festivals) and now_is_festival(festivals):
-        festivals = get_festivals_data()
-        image = get_festival(festivals)
+    if have_festival(festivals) and now_is_festival(festivals) and festivals_data is not None:
+        image = get_festival(festivals_data)
         return image
 
-    cnt = 0
-    time_head_count = 0
-    # 计算满足条件的有效数据有多少排
-    for i in num_list:
-        # 筛选到数据的个数
-        count_match_data = 0
-        if contest_match is None or contest_match == "Turf War":
-            if regular[i]["regularMatchSetting"] is not None:
-                if rule_match is None:
-                    cnt += 1
-                    count_match_data += 1
-        if contest_match is None or contest_match == "Ranked Challenge":
-            if ranked[i]["bankaraMatchSettings"] is not None:
-                if rule_match is None or rule_match == ranked[i]["bankaraMatchSettings"][0]["vsRule"]["rule"]:
-                    cnt += 1
-                    count_match_data += 1
-        if contest_match is None or contest_match == "Ranked Open":
-            if ranked[i]["bankaraMatchSettings"] is not None:
-                if rule_match is None or rule_match == ranked[i]["bankaraMatchSettings"][1]["vsRule"]["rule"]:
-                    cnt += 1
-                    count_match_data += 1
-
-        if contest_match is None or contest_match == "X Schedule":
-            if xschedule[i]["xMatchSetting"] is not None:
-                if rule_match is None or rule_match == xschedule[i]["xMatchSetting"]["vsRule"]["rule"]:
-                    cnt += 1
-                    count_match_data += 1
-
-        # 如果有筛选结果,需要加上一个时间卡片
-        if count_match_data:
-            time_head_count += 1
-
-    if cnt == 0 and not have_festival(festivals):
-        # 没有搜索结果情况下，用全部list再次调用自身
-        num_list = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
-        return get_stages(schedule, num_list, contest_match, rule_match)
-
+    # 从日程索引中取满足条件的对战，每个时段一组
+    index = get_schedule_index(schedule)
+    groups = query_schedule_index(index, num_list, contest_match, rule_match)
+    if not groups and not have_festival(festivals):
+        # 没有搜索结果情况下，用全部时段再查询一次
+        groups = query_schedule_index(index, sorted(index["times"]), contest_match, rule_match)
+    if not groups:
+        return None
+
+    cnt = sum(len(slots) for _, slots in groups)
+    time_head_count = len(groups)
     time_head_bg_size = (540, 60)
     # 一张对战卡片高度为340 时间卡片高度为time_head_bg_size[1] 加上间隔为10
     background_size = (1044, 340 * cnt + (time_head_bg_size[1] + 10) * time_head_count)
@@ -230,156 +208,49 @@ def get_stages(schedule, num_list, contest_match=None, rule_match=None) -> Image
         bg_rgb = default_bg_rgb
     # 创建纯色背景
     image_background = Image.new("RGBA", background_size, bg_rgb)
-    bg_mask = get_file("fight_mask").resize((600, 399))
+    bg_mask = get_file("fight_mask", size=(600, 399))
     # 填充小图蒙版
     image_background = tiled_fill(image_background, bg_mask)
 
-    total_pos = 0
-    for i in num_list:
-        pos = 0
-        # 创建一张纯透明图片 用来存放一个时间周期内的多张地图卡片
-        background = Image.new("RGBA", background_size, (0, 0, 0, 0))
-        # 筛选到数据的个数
-        count_match_data = 0
-
-        # 第一排绘制 默认为涂地模式
-        if contest_match is None or contest_match == "Turf War":
-            if regular[i]["regularMatchSetting"] is not None:
-                if rule_match is None:
-                    count_match_data += 1
-
-                    stage = regular[i]["regularMatchSetting"]["vsStages"]
-                    regular_card = get_stage_card(
-                        ImageInfo(
-                            name=stage[0]["name"],
-                            url=stage[0]["image"]["url"],
-                            zh_name=get_trans_stage(stage[0]["id"]),
-                            source_type="对战地图",
-                        ),
-                        ImageInfo(
-                            name=stage[1]["name"],
-                            url=stage[1]["image"]["url"],
-                            zh_name=get_trans_stage(stage[1]["id"]),
-                            source_type="对战地图",
-                        ),
-                        "一般比赛",
-                        "Regular",
-                        regular[i]["regularMatchSetting"]["vsRule"]["rule"],
-                        time_converter_hm(regular[i]["startTime"]),
-                        time_converter_hm(regular[i]["endTime"]),
-                    )
-                    paste_with_a(background, regular_card, (10, pos))
-                    pos += 340
-                    total_pos += 340
-
-        # 第二排绘制 默认为真格区域
-        if contest_match is None or contest_match == "Ranked Challenge":
-            if ranked[i]["bankaraMatchSettings"] is not None:
-                if rule_match is None or rule_match == ranked[i]["bankaraMatchSettings"][0]["vsRule"]["rule"]:
-                    count_match_data += 1
-                    stage = ranked[i]["bankaraMatchSettings"][0]["vsStages"]
-                    ranked_challenge_card = get_stage_card(
-                        ImageInfo(
-                            name=stage[0]["name"],
-                            url=stage[0]["image"]["url"],
-                            zh_name=get_trans_stage(stage[0]["id"]),
-                            source_type="对战地图",
-                        ),
-                        ImageInfo(
-                            name=stage[1]["name"],
-                            url=stage[1]["image"]["url"],
-                            zh_name=get_trans_stage(stage[1]["id"]),
-                            source_type="对战地图",
-                        ),
-                        "蛮颓比赛-挑战",
-                        "Ranked-Challenge",
-                        ranked[i]["bankaraMatchSettings"][0]["vsRule"]["rule"],
-                        time_converter_hm(ranked[i]["startTime"]),
-                        time_converter_hm(ranked[i]["endTime"]),
-                    )
-                    paste_with_a(background, ranked_challenge_card, (10, pos))
-                    pos += 340
-                    total_pos += 340
-
-        # 第三排绘制 默认为真格开放
-        if contest_match is None or contest_match == "Ranked Open":
-            if ranked[i]["bankaraMatchSettings"] is not None:
-                if rule_match is None or rule_match == ranked[i]["bankaraMatchSettings"][1]["vsRule"]["rule"]:
-                    count_match_data += 1
-                    stage = ranked[i]["bankaraMatchSettings"][1]["vsStages"]
-                    ranked_challenge_card = get_stage_card(
-                        ImageInfo(
-                            name=stage[0]["name"],
-                            url=stage[0]["image"]["url"],
-                            zh_name=get_trans_stage(stage[0]["id"]),
-                            source_type="对战地图",
-                        ),
-                        ImageInfo(
-                            name=stage[1]["name"],
-                            url=stage[1]["image"]["url"],
-                            zh_name=get_trans_stage(stage[1]["id"]),
-                            source_type="对战地图",
-                        ),
-                        "蛮颓比赛-开放",
-                        "Ranked-Open",
-                        ranked[i]["bankaraMatchSettings"][1]["vsRule"]["rule"],
-                        time_converter_hm(ranked[i]["startTime"]),
-                        time_converter_hm(ranked[i]["endTime"]),
-                    )
-                    paste_with_a(background, ranked_challenge_card, (10, pos))
-                    pos += 340
-                    total_pos += 340
-
-        # 第四排绘制 默认为X赛
-        if contest_match is None or contest_match == "X Schedule":
-            if xschedule[i]["xMatchSetting"] is not None:
-                if rule_match is None or rule_match == xschedule[i]["xMatchSetting"]["vsRule"]["rule"]:
-                    count_match_data += 1
-                    stage = xschedule[i]["xMatchSetting"]["vsStages"]
-                    ranked_challenge_card = get_stage_card(
-                        ImageInfo(
-                            name=stage[0]["name"],
-                            url=stage[0]["image"]["url"],
-                            zh_name=get_trans_stage(stage[0]["id"]),
-                            source_type="对战地图",
-                        ),
-                        ImageInfo(
-                            name=stage[1]["name"],
-                            url=stage[1]["image"]["url"],
-                            zh_name=get_trans_stage(stage[1]["id"]),
-                            source_type="对战地图",
-                        ),
-                        "X比赛",
-                        "X",
-                        xschedule[i]["xMatchSetting"]["vsRule"]["rule"],
-                        time_converter_hm(xschedule[i]["startTime"]),
-                        time_converter_hm(xschedule[i]["endTime"]),
-                    )
-                    paste_with_a(background, ranked_challenge_card, (10, pos))
-                    pos += 340
-                    total_pos += 340
-        # 如果有筛选结果，将时间表头贴到底图上
-        if count_match_data:
-            # 取涂地模式的时间，除举办祭典外，都可用
-            date_time = time_converter_yd(regular[i]["startTime"])
-            start_time = time_converter_hm(regular[i]["startTime"])
-            end_time = time_converter_hm(regular[i]["endTime"])
-            # 绘制时间表头
-            time_head_bg = get_time_head_bg(time_head_bg_size, date_time, start_time, end_time)
-            # 贴到大图上
-            time_head_bg_pos = (
-                (background_size[0] - time_head_bg_size[0]) // 2,
-                total_pos - 340 * count_match_data + 10,
-            )
-            paste_with_a(image_background, time_head_bg, time_head_bg_pos)
-            total_pos += time_head_bg_size[1] + 10
-
-            # 将一组图片贴到底图上
-            paste_with_a(
-                image_background,
-                background,
-                (0, time_head_bg_pos[1] + time_head_bg_size[1]),
+    pos_h = 0
+    for i, slots in groups:
+        # 绘制时间表头
+        start_time, end_time = index["times"][i]
+        time_head_bg = get_time_head_bg(
+            time_head_bg_size,
+            time_converter_yd(start_time),
+            time_converter_hm(start_time),
+            time_converter_hm(end_time),
+        )
+        time_head_bg_pos = ((background_size[0] - time_head_bg_size[0]) // 2, pos_h + 10)
+        paste_with_a(image_background, time_head_bg, time_head_bg_pos)
+        pos_h = time_head_bg_pos[1] + time_head_bg_size[1]
+
+        # 按 涂地 挑战 开放 X 的顺序绘制该时段的地图卡片
+        for slot in slots:
+            stage = slot["stages"]
+            contest_mode, contest_name = dict_contest_card[slot["contest"]]
+            stage_card = get_stage_card(
+                ImageInfo(
+                    name=stage[0]["name"],
+                    url=stage[0]["image"]["url"],
+                    zh_name=get_trans_stage(stage[0]["id"]),
+                    source_type="对战地图",
+                ),
+                ImageInfo(
+                    name=stage[1]["name"],
+                    url=stage[1]["image"]["url"],
+                    zh_name=get_trans_stage(stage[1]["id"]),
+                    source_type="对战地图",
+                ),
+                contest_mode,
+                contest_name,
+                slot["rule"],
+                time_converter_hm(slot["start_time"]),
+                time_converter_hm(slot["end_time"]),
             )
+            paste_with_a(image_background, stage_card, (10, pos_h))
+            pos_h += 340
 
     # 圆角化
     image_background = circle_corner(image_background, radii=16)
@@ -389,18 +260,6 @@ def get_stages(schedule, num_list, contest_match=None, rule_match=None) -> Image
 def get_coop_stages(stage, weapon, time, boss, mode) -> Image.Image:
     """绘制 打工地图"""
 
-    # 校验是否需要绘制小鲑鱼(现在时间处于该打工时间段内)
-    def check_coop_fish(_time):
-        start_time = _time.split(" - ")[0]
-        now_time = get_time_now_china()
-        # 输入时间都缺少年份，需要手动补充一个年份后还原为date对象
-        year = now_time.year
-        start_time = str(year) + "-" + start_time
-        st = datetime.datetime.strptime(start_time, "%Y-%m-%d %H:%M")
-        if st < now_time:
-            return True
-        return False
-
     top_size_pos = (0, -2)
     bg_size = (800, len(stage) * 162 + top_size_pos[1])
     stage_bg_size = (300, 160)
@@ -413,14 +272,14 @@ def get_coop_stages(stage, weapon, time, boss, mode) -> Image.Image:
     image_background_rgb = dict_bg_rgb["打工"]
     image_background = Image.new("RGBA", bg_size, image_background_rgb)
     bg_mask_size = (300, 200)
-    bg_mask = get_file("coop_mask").resize(bg_mask_size)
+    bg_mask = get_file("coop_mask", size=bg_mask_size)
     # 填充小图蒙版
     image_background = tiled_fill(image_background, bg_mask)
 
     # 绘制地图信息
     coop_stage_bg = Image.new("RGBA", (bg_size[0], bg_size[1] + 2), (0, 0, 0, 0))
     dr = ImageDraw.Draw(coop_stage_bg)
-    font = ImageFont.truetype(ttf_path, 30)
+    font = get_font(ttf_path, 30)
     for pos, val in enumerate(time):
         # 绘制时间文字
         time_text_pos = (50, 5 + pos * 160)
@@ -428,12 +287,12 @@ def get_coop_stages(stage, weapon, time, boss, mode) -> Image.Image:
         dr.text(time_text_pos, val, font=font, fill="#FFFFFF")
         if check_coop_fish(val):
             # 现在时间处于打工时间段内，绘制小鲑鱼
-            coop_fish_img = get_file("coop_fish").resize(coop_fish_size)
+            coop_fish_img = get_file("coop_fish", size=coop_fish_size)
             coop_fish_img_pos = (5, 8 + pos * 160)
             paste_with_a(coop_stage_bg, coop_fish_img, coop_fish_img_pos)
     for pos, val in enumerate(stage):
         # 绘制打工地图
-        stage_bg = get_save_file(val).resize(stage_bg_size, Image.ANTIALIAS)
+        stage_bg = get_save_file(val, size=stage_bg_size, resample=Image.ANTIALIAS)
         stage_bg_pos = (500, 2 + 162 * pos)
         coop_stage_bg.paste(stage_bg, stage_bg_pos)
 
@@ -451,21 +310,21 @@ def get_coop_stages(stage, weapon, time, boss, mode) -> Image.Image:
             # 绘制武器底图
             weapon_bg_img = Image.new("RGBA", weapon_size, (30, 30, 30))
             # 绘制武器图片
-            weapon_image = get_save_file(val_weapon).resize(weapon_size, Image.ANTIALIAS)
+            weapon_image = get_save_file(val_weapon, size=weapon_size, resample=Image.ANTIALIAS)
             paste_with_a(weapon_bg_img, weapon_image, (0, 0))
             coop_stage_bg.paste(weapon_bg_img, (120 * pos_weapon + 20, 60 + 160 * pos))
     for pos, val in enumerate(boss):
         if val != "":
             # 绘制boss图标
             try:
-                boss_img = get_file(val).resize(boss_size)
+                boss_img = get_file(val, size=boss_size)
                 boss_img_pos = (500, 160 * pos + stage_bg_size[1] - 40)
                 paste_with_a(coop_stage_bg, boss_img, boss_img_pos)
             except Exception as e:
                 logger.warning(f"get boss file error: {e}")
     for pos, val in enumerate(mode):
         # 绘制打工模式图标
-        mode_img = get_file(val).resize(mode_size)
+        mode_img = get_file(val, size=mode_size)
         mode_img_pos = (500 - 70, 160 * pos + 15)
         paste_with_a(coop_stage_bg, mode_img, mode_img_pos)
 
@@ -476,15 +335,37 @@ def get_coop_stages(stage, weapon, time, boss, mode) -> Image.Image:
     return image_background
 
 
+# 随机武器 上下两排武器卡片的 背景色 文字色
+weapon_card_styles = (
+    (dict_bg_rgb["上-武器卡片"], (34, 34, 34)),
+    (dict_bg_rgb["下-武器卡片"], (255, 255, 255)),
+)
+
+
+def build_weapon_atlas():
+    """预先绘制全部武器的图块到图集，启动时及武器数据重载后调用"""
+    # 武器目录重新载入后，旧版本的图块不会再命中
+    prune_weapon_tile_atlas(weapon_catalogue.version)
+    cnt = 0
+    for weapon in weapon_catalogue.all_weapons():
+        for rgb, font_color in weapon_card_styles:
+            try:
+                get_weapon_tile(weapon, rgb, font_color)
+                cnt += 1
+            except Exception as e:
+                logger.warning(f"绘制武器图块失败 {weapon.name}: {e}")
+    logger.info(f"武器图集已生成，共{cnt}张图块")
+
+
 def get_random_weapon(weapon1: [WeaponData], weapon2: [WeaponData]) -> Image.Image:
     """绘制 随机武器"""
     # 底图
     image_background_size = (660, 500)
-    image_background = circle_corner(get_file("bg2").resize(image_background_size), radii=20)
+    image_background = circle_corner(get_file("bg2", size=image_background_size), radii=20)
     # 绘制上下两块武器区域
     weapon_card_bg_size = (image_background_size[0] - 10, (image_background_size[1] - 10) // 2)
-    top_weapon_card = get_weapon_card(weapon1, weapon_card_bg_size, dict_bg_rgb["上-武器卡片"], (34, 34, 34))
-    down_weapon_card = get_weapon_card(weapon2, weapon_card_bg_size, dict_bg_rgb["下-武器卡片"], (255, 255, 255))
+    top_weapon_card = get_weapon_card(weapon1, weapon_card_bg_size, *weapon_card_styles[0])
+    down_weapon_card = get_weapon_card(weapon2, weapon_card_bg_size, *weapon_card_styles[1])
     # 将武器区域贴到最下层背景
     paste_with_a(image_background, top_weapon_card, (5, 5))
     paste_with_a(image_background, down_weapon_card, (5, (image_background_size[1]) // 2))
@@ -494,7 +375,7 @@ def get_random_weapon(weapon1: [WeaponData], weapon2: [WeaponData]) -> Image.Ima
         (image_background_size[0] - private_img_size[0]) // 2,
         (image_background_size[1] - private_img_size[1]) // 2,
     )
-    private_img = get_file("private").resize(private_img_size)
+    private_img = get_file("private", size=private_img_size)
     paste_with_a(image_background, private_img, private_img_pos)
 
     return image_background
@@ -509,7 +390,7 @@ def get_help() -> Image.Image:
     bg_rgb = dict_bg_rgb["活动"]
     # 创建纯色背景
     image_background = Image.new("RGBA", image_background_size, bg_rgb)
-    bg_mask = get_file("cat_paw_mask").resize((400, 250))
+    bg_mask = get_file("cat_paw_mask", size=(400, 250))
     # 填充小图蒙版
     image_background = tiled_fill(image_background, bg_mask)
     # 圆角
@@ -741,7 +622,7 @@ def get_nso_help() -> Image.Image:
     bg_rgb = dict_bg_rgb["活动"]
     # 创建纯色背景
     image_background = Image.new("RGBA", image_background_size, bg_rgb)
-    bg_mask = get_file("cat_paw_mask").resize((400, 250))
+    bg_mask = get_file("cat_paw_mask", size=(400, 250))
     # 填充小图蒙版
     image_background = tiled_fill(image_background, bg_mask)
     # 圆角
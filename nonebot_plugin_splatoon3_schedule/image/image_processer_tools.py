@@ -3,10 +3,11 @@ import io
 import re
 import sys
 import textwrap
+import threading
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 
-from ..data import db_image
+from ..data import db_image, weapon_catalogue
 from ..utils import *
 
 # 图片文件夹
@@ -19,6 +20,31 @@ ttf_path = os.path.join(font_folder_path, "common.otf")
 ttf_path_chinese = os.path.join(font_folder_path, "cn.ttf")
 ttf_path_jp = os.path.join(font_folder_path, "Splatfont2.otf")
 
+# 字体缓存  键为 (字体路径, 字号)，每种字体字号只解析一次，由所有绘图函数共享
+font_cache = {}
+# 启动时预加载的常用字体字号
+preload_font_sizes = {
+    ttf_path_chinese: (24, 25, 30, 40),
+    ttf_path: (30, 40),
+}
+
+
+def get_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    """取字体  cn.ttf体积较大，每次truetype都需要重新解析字体文件，这里对字体对象进行缓存"""
+    key = (font_path, font_size)
+    font = font_cache.get(key)
+    if font is None:
+        font = ImageFont.truetype(font_path, font_size)
+        font_cache[key] = font
+    return font
+
+
+def preload_fonts():
+    """预加载常用字体字号"""
+    for font_path, sizes in preload_font_sizes.items():
+        for size in sizes:
+            get_font(font_path, size)
+
 
 def image_to_bytes(image: Image.Image) -> bytes:
     """图片转bytes"""
@@ -28,15 +54,51 @@ def image_to_bytes(image: Image.Image) -> bytes:
     return buffered.getvalue()
 
 
-def get_file(name, format_name="png") -> Image.Image:
-    """取文件"""
-    img = Image.open(os.path.join(image_folder, "{}.{}".format(name, format_name)))
-    return img
+def get_image_sizeof(image: Image.Image) -> int:
+    """估算解码后图片占用的内存大小"""
+    w, h = image.size
+    return w * h * len(image.getbands())
+
+
+# 素材图片解码缓存  键为 (来源, 名称, 尺寸, 缩放算法)，值为已解码并缩放好的Image
+# 缓存中的Image为多个绘图线程共享，只能读取或粘贴，需要在上面绘制时请先copy()
+asset_cache = LRUCache(plugin_config.splatoon3_asset_cache_size * 1024 * 1024, sizeof=get_image_sizeof)
+
 
+def get_cached_asset(key, loader, size=None, resample=None) -> Image.Image:
+    """从素材缓存取图片，未命中时通过loader加载并缩放到指定尺寸"""
+    cache_key = key + (size, resample)
+    image = asset_cache.get(cache_key)
+    if image is None:
+        image = loader()
+        # Image.open为延迟加载，需要在放入缓存前完成解码
+        image.load()
+        if size is not None:
+            image = image.resize(size, resample)
+        asset_cache.put(cache_key, image)
+    return image
 
-def get_weapon(name) -> Image.Image:
-    """获取武器"""
-    return Image.open(os.path.join(weapon_folder, "{}".format(name)))
+
+def clean_asset_cache():
+    """清空素材图片解码缓存"""
+    asset_cache.clear()
+
+
+def get_file(name, format_name="png", size=None, resample=None) -> Image.Image:
+    """取文件  返回的图片为缓存共享对象，不可直接修改"""
+    return get_cached_asset(
+        ("file", name, format_name),
+        lambda: Image.open(os.path.join(image_folder, "{}.{}".format(name, format_name))),
+        size,
+        resample,
+    )
+
+
+def get_weapon(name, size=None, resample=None) -> Image.Image:
+    """获取武器  返回的图片为缓存共享对象，不可直接修改"""
+    return get_cached_asset(
+        ("weapon", name), lambda: Image.open(os.path.join(weapon_folder, "{}".format(name))), size, resample
+    )
 
 
 def get_cf_file_url(url) -> bytes:
@@ -45,7 +107,12 @@ def get_cf_file_url(url) -> bytes:
     return r.content
 
 
-def get_save_file(img: ImageInfo) -> Image.Image:
+def get_save_file(img: ImageInfo, size=None, resample=None) -> Image.Image:
+    """取数据库素材图片  返回的图片为缓存共享对象，不可直接修改"""
+    return get_cached_asset(("db", img.name), lambda: load_save_file(img), size, resample)
+
+
+def load_save_file(img: ImageInfo) -> Image.Image:
     """向数据库新增或读取素材图片二进制文件"""
     res = db_image.get_img_data(img.name)
     if not res:
@@ -60,22 +127,76 @@ def get_save_file(img: ImageInfo) -> Image.Image:
         return Image.open(io.BytesIO(res.get("image_data")))
 
 
+def get_schedule_image_infos(schedule) -> list[ImageInfo]:
+    """取 日程数据中 对战地图，打工地图，打工武器 的素材图片信息  按名称去重"""
+    infos = {}
+
+    def add_vs_stages(_setting):
+        if _setting is None:
+            return
+        for stage in _setting["vsStages"]:
+            infos.setdefault(
+                stage["name"],
+                ImageInfo(
+                    name=stage["name"],
+                    url=stage["image"]["url"],
+                    zh_name=get_trans_stage(stage["id"]),
+                    source_type="对战地图",
+                ),
+            )
+
+    for node in schedule["regularSchedules"]["nodes"]:
+        add_vs_stages(node["regularMatchSetting"])
+    for node in schedule["bankaraSchedules"]["nodes"]:
+        for setting in node["bankaraMatchSettings"] or []:
+            add_vs_stages(setting)
+    for node in schedule["xSchedules"]["nodes"]:
+        add_vs_stages(node["xMatchSetting"])
+
+    coop = schedule["coopGroupingSchedule"]
+    for key in ("regularSchedules", "bigRunSchedules", "teamContestSchedules"):
+        for node in coop[key]["nodes"]:
+            stage = node["setting"]["coopStage"]
+            infos.setdefault(
+                stage["name"],
+                ImageInfo(stage["name"], stage["image"]["url"], get_trans_stage(stage["id"]), "打工地图"),
+            )
+            for weapon in node["setting"]["weapons"]:
+                name = weapon["name"] + "_" + weapon["__splatoon3ink_id"]
+                infos.setdefault(
+                    name,
+                    ImageInfo(
+                        name=name,
+                        url=weapon["image"]["url"],
+                        zh_name=get_trans_weapon(weapon["__splatoon3ink_id"]),
+                        source_type="武器",
+                    ),
+                )
+    return list(infos.values())
+
+
 def get_file_path(name, format_name="png") -> str:
     """取文件路径"""
     return os.path.join(image_folder, "{}.{}".format(name, format_name))
 
 
-def circle_corner(img, radii) -> Image.Image:
-    """圆角处理"""
-    """
-    圆角处理
-    :param img: 源图象。
-    :param radii: 半径，如：30。
-    :return: 返回一个圆角处理后的图象。
-    """
-    # 原图
-    img = img.convert("RGBA")
-    w, h = img.size
+# 圆角蒙版缓存  键为 (尺寸, 半径)，值为L模式的alpha蒙版
+corner_mask_cache = LRUCache(16 * 1024 * 1024, sizeof=get_image_sizeof)
+
+
+def get_corner_mask(size, radii) -> Image.Image:
+    """取 圆角蒙版  返回的蒙版为缓存共享对象，不可直接修改"""
+    key = (tuple(size), radii)
+    alpha = corner_mask_cache.get(key)
+    if alpha is None:
+        alpha = draw_corner_mask(size, radii)
+        corner_mask_cache.put(key, alpha)
+    return alpha
+
+
+def draw_corner_mask(size, radii) -> Image.Image:
+    """绘制 圆角蒙版"""
+    w, h = size
 
     if w < 2 * radii:
         radii = w // 2
@@ -88,7 +209,7 @@ def circle_corner(img, radii) -> Image.Image:
     draw.ellipse((0, 0, radii * 2, radii * 2), fill=255)  # 画白色圆形
 
     # 画4个角（将整圆分离为4个部分）
-    alpha = Image.new("L", img.size, 255)
+    alpha = Image.new("L", (w, h), 255)
     left_top = circle.crop((0, 0, radii, radii))
     # x轴翻转
     left_down = ImageOps.flip(left_top)
@@ -101,8 +222,20 @@ def circle_corner(img, radii) -> Image.Image:
     alpha.paste(right_top, (w - radii, 0))  # 右上角
     alpha.paste(right_down, (w - radii, h - radii))  # 右下角
     alpha.paste(left_down, (0, h - radii))  # 左下角
+    return alpha
 
-    img.putalpha(alpha)  # 白色区域透明可见，黑色区域不可见
+
+def circle_corner(img, radii) -> Image.Image:
+    """圆角处理"""
+    """
+    圆角处理
+    :param img: 源图象。
+    :param radii: 半径，如：30。
+    :return: 返回一个圆角处理后的图象。
+    """
+    # 原图
+    img = img.convert("RGBA")
+    img.putalpha(get_corner_mask(img.size, radii))  # 白色区域透明可见，黑色区域不可见
     return img
 
 
@@ -141,7 +274,7 @@ def drawer_text(
                         write_text.append(_line)
         return write_text
 
-    ttf = ImageFont.truetype(ttf_path_chinese, font_size)
+    ttf = get_font(ttf_path_chinese, font_size)
     para = add_long_text(text, text_width)
     # 绘制每一行文本
     height = 0
@@ -261,7 +394,7 @@ def paste_with_a(image_background, image_pasted, pos):
 
 def get_stage_name_bg(stage_name, font_size=24) -> Image.Image:
     """绘制 地图名称及文字底图"""
-    ttf = ImageFont.truetype(ttf_path_chinese, font_size)
+    ttf = get_font(ttf_path_chinese, font_size)
     w, h = ttf.getsize(stage_name)
     stage_name_bg_size = (w + 20, h + 10)
     # 新建画布
@@ -280,11 +413,11 @@ def get_translucent_name_bg(
     text, transparency, font_size=24, bg_color=None, font_path: str = ttf_path_chinese, line_height: int = 20
 ) -> Image.Image:
     """绘制 半透明文字背景"""
-    ttf = ImageFont.truetype(font_path, font_size)
+    ttf = get_font(font_path, font_size)
     w, h = ttf.getsize(text)
     # 文字背景
     text_bg_size = (w + 20, h + line_height)
-    text_bg = get_file("filleted_corner").resize(text_bg_size).convert("RGBA")
+    text_bg = get_file("filleted_corner", size=text_bg_size).convert("RGBA")
     if bg_color is not None:
         text_bg = circle_corner(Image.new("RGBA", text_bg_size, bg_color), radii=20)
     text_bg = circle_corner(text_bg, radii=text_bg_size[1] // 2)
@@ -300,9 +433,10 @@ def get_translucent_name_bg(
 def get_time_head_bg(time_head_bg_size, date_time, start_time, end_time) -> Image.Image:
     """绘制 时间表头"""
     # 绘制背景
-    time_head_bg = get_file("time_head_bg").resize(time_head_bg_size)
+    # 缓存中的素材为共享对象，需要copy后才能在上面绘制
+    time_head_bg = get_file("time_head_bg", size=time_head_bg_size).copy()
     # 绘制开始，结束时间 文字居中绘制
-    ttf = ImageFont.truetype(ttf_path, 40)
+    ttf = get_font(ttf_path, 40)
     time_head_text = "{}  {} - {}".format(date_time, start_time, end_time)
     w, h = ttf.getsize(time_head_text)
     time_head_text_pos = (
@@ -323,6 +457,19 @@ def have_festival(_festivals) -> bool:
     return False
 
 
+def check_coop_fish(_time) -> bool:
+    """校验是否需要绘制小鲑鱼(现在时间处于该打工时间段内)  _time 为 月-日 时:分 - 月-日 时:分"""
+    start_time = _time.split(" - ")[0]
+    now_time = get_time_now_china()
+    # 输入时间都缺少年份，需要手动补充一个年份后还原为date对象
+    year = now_time.year
+    start_time = str(year) + "-" + start_time
+    st = datetime.datetime.strptime(start_time, "%Y-%m-%d %H:%M")
+    if st < now_time:
+        return True
+    return False
+
+
 def now_is_festival(_festivals) -> bool:
     """现在是否是祭典"""
     now = get_time_now_china()
@@ -352,15 +499,15 @@ def get_stage_card(
     desc="",
     img_size=(1024, 340),
 ) -> Image.Image:
-    image_background = circle_corner(get_file("bg").resize(img_size), radii=20)
+    image_background = circle_corner(get_file("bg", size=img_size), radii=20)
 
     # 绘制两张地图
     # 计算尺寸，加载图片
     stage_size = (int(img_size[0] * 0.48), int(img_size[1] * 0.7))
-    image_left = get_save_file(stage1).resize(stage_size, Image.ANTIALIAS)
-    image_right = get_save_file(stage2).resize(stage_size, Image.ANTIALIAS)
+    image_left = get_save_file(stage1, size=stage_size, resample=Image.ANTIALIAS)
+    image_right = get_save_file(stage2, size=stage_size, resample=Image.ANTIALIAS)
     # 定义圆角 蒙版
-    image_alpha = circle_corner(image_left, radii=16)
+    image_alpha = get_corner_mask(stage_size, radii=16)
 
     # 计算地图间隔
     width_between_stages = int((img_size[0] - 2 * stage_size[0]) / 3)
@@ -416,7 +563,7 @@ def get_stage_card(
     blank_size = (img_size[0], start_stage_pos[1])
     drawer = ImageDraw.Draw(image_background)
     # 绘制竞赛模式文字
-    ttf = ImageFont.truetype(ttf_path_chinese, 40)
+    ttf = get_font(ttf_path_chinese, 40)
     contest_mode_pos = (start_stage_pos[0] + 10, start_stage_pos[1] - 60)
     drawer.text(contest_mode_pos, contest_mode, font=ttf, fill=(255, 255, 255))
     # 绘制游戏模式文字
@@ -424,7 +571,7 @@ def get_stage_card(
     game_mode_text_pos = (blank_size[0] // 3, contest_mode_pos[1])
     drawer.text(game_mode_text_pos, game_mode_text, font=ttf, fill=(255, 255, 255))
     # 绘制游戏模式小图标
-    game_mode_img = get_file(game_mode).resize((35, 35), Image.ANTIALIAS)
+    game_mode_img = get_file(game_mode, size=(35, 35), resample=Image.ANTIALIAS)
     game_mode_img_pos = (game_mode_text_pos[0] - 40, game_mode_text_pos[1] + 10)
     paste_with_a(image_background, game_mode_img, game_mode_img_pos)
     # # 绘制开始，结束时间
@@ -435,81 +582,92 @@ def get_stage_card(
     # )
     # 绘制活动模式描述
     if desc != "":
-        ttf = ImageFont.truetype(ttf_path, 40)
+        ttf = get_font(ttf_path, 40)
         desc_pos = (blank_size[0] * 2 // 3, contest_mode_pos[1] - 10)
         drawer.text(desc_pos, desc, font=ttf, fill=(255, 255, 255))
 
     return image_background
 
 
-def get_weapon_card(weapon: [WeaponData], weapon_card_bg_size, rgb, font_color) -> Image.Image:
-    """绘制一排武器"""
+# 武器图块图集  键为 (武器目录版本, 武器名, 背景色, 文字色)，值为绘制好的单张武器图块(主武器 副武器 大招 武器名)
+# 保存全部武器的图块，不受素材缓存容量限制，由 build_weapon_atlas 在启动及武器数据重载后生成
+weapon_tile_atlas = {}
+# 绘图线程并发写入图集时加锁
+weapon_tile_atlas_lock = threading.Lock()
+
+
+def get_weapon_tile(weapon: WeaponData, rgb, font_color) -> Image.Image:
+    """从图集取单张武器图块，不存在时绘制并放入图集  返回的图块为共享对象，不可直接修改"""
+    key = (weapon_catalogue.version, weapon.name, tuple(rgb), tuple(font_color))
+    tile = weapon_tile_atlas.get(key)
+    if tile is None:
+        tile = draw_weapon_tile(weapon, rgb, font_color)
+        with weapon_tile_atlas_lock:
+            weapon_tile_atlas[key] = tile
+    return tile
+
+
+def prune_weapon_tile_atlas(version: int):
+    """移除图集中不属于指定武器目录版本的图块"""
+    with weapon_tile_atlas_lock:
+        for key in [key for key in weapon_tile_atlas if key[0] != version]:
+            del weapon_tile_atlas[key]
+
+
+def draw_weapon_tile(v: WeaponData, rgb, font_color) -> Image.Image:
+    """绘制单张武器图块"""
     # 单张武器背景
     weapon_bg_size = (150, 230)
     # 主武器，副武器，大招
     main_size = (120, 120)
     sub_size = (55, 55)
     special_size = (55, 55)
+    # 单张武器背景
+    weapon_bg = Image.new("RGB", weapon_bg_size, rgb)
+    weapon_bg = circle_corner(weapon_bg, radii=20)
+    # 调整透明度
+    weapon_bg = change_image_alpha(weapon_bg, 80)
+    # 主武器
+    main_image = Image.open(io.BytesIO(v.image)).resize(main_size, Image.ANTIALIAS)
+    main_image_bg_pos = ((weapon_bg_size[0] - main_size[0]) // 2, 10)
+    # 副武器
+    sub_image = Image.open(io.BytesIO(v.sub_image)).resize(sub_size, Image.ANTIALIAS)
+    sub_image_bg_pos = (main_image_bg_pos[0], main_image_bg_pos[1] + main_size[1] + 10)
+    # 大招
+    special_image = Image.open(io.BytesIO(v.special_image)).resize(special_size, Image.ANTIALIAS)
+    special_image_bg_pos = (main_image_bg_pos[0] + main_size[0] - special_size[0], sub_image_bg_pos[1])
+    # 贴到单个武器背景
+    paste_with_a(weapon_bg, main_image, main_image_bg_pos)
+    paste_with_a(weapon_bg, sub_image, sub_image_bg_pos)
+    paste_with_a(weapon_bg, special_image, special_image_bg_pos)
+
+    # 武器名
+    weapon_zh_name = v.zh_name
+    font_size = 16
+    if len(weapon_zh_name) > 8:
+        font_size = 15
+    if len(weapon_zh_name) > 10:
+        font_size = 14
+    font = get_font(ttf_path_chinese, font_size)
+    zh_name_size = font.getsize(weapon_zh_name)
+    # 纯文字不带背景 实现方式
+    dr = ImageDraw.Draw(weapon_bg)
+    zh_name_pos = ((weapon_bg_size[0] - zh_name_size[0]) // 2, weapon_bg_size[1] - zh_name_size[1] - 7)
+    dr.text(zh_name_pos, weapon_zh_name, font=font, fill=font_color)
+    return weapon_bg
+
+
+def get_weapon_card(weapon: [WeaponData], weapon_card_bg_size, rgb, font_color) -> Image.Image:
+    """绘制一排武器"""
+    # 单张武器背景
+    weapon_bg_size = (150, 230)
     # 一排武器的背景
     weapon_card_bg = circle_corner(Image.new("RGBA", weapon_card_bg_size, rgb), radii=20)
 
     # 遍历进行贴图
     for i, v in enumerate(weapon):
         v: WeaponData
-        # 单张武器背景
-        weapon_bg = Image.new("RGB", weapon_bg_size, rgb)
-        weapon_bg = circle_corner(weapon_bg, radii=20)
-        # 调整透明度
-        weapon_bg = change_image_alpha(weapon_bg, 80)
-        # 主武器
-        main_image_bg = Image.new("RGBA", main_size, (30, 30, 30, 255))
-        main_image = Image.open(io.BytesIO(v.image)).resize(main_size, Image.ANTIALIAS)
-        main_image_bg_pos = ((weapon_bg_size[0] - main_size[0]) // 2, 10)
-        # main_image = circle_corner(main_image, radii=16)
-        # main_image_bg.paste(main_image, (0, 0))
-        # 副武器
-        sub_image_bg = Image.new("RGBA", sub_size, (60, 60, 60, 255))
-        sub_image = Image.open(io.BytesIO(v.sub_image)).resize(sub_size, Image.ANTIALIAS)
-        sub_image_bg_pos = (main_image_bg_pos[0], main_image_bg_pos[1] + main_size[1] + 10)
-        # sub_image = circle_corner(sub_image, radii=16)
-        # sub_image_bg.paste(sub_image, (0, 0))
-        # 大招
-        special_image_bg = Image.new("RGBA", special_size, (30, 30, 30, 255))
-        special_image = Image.open(io.BytesIO(v.special_image)).resize(special_size, Image.ANTIALIAS)
-        special_image_bg_pos = (main_image_bg_pos[0] + main_size[0] - special_size[0], sub_image_bg_pos[1])
-        # special_image = circle_corner(special_image, radii=16)
-        # special_image_bg.paste(special_image, (0, 0))
-        # 贴到单个武器背景
-        # weapon_bg.paste(main_image, main_image_bg_pos)
-        # weapon_bg.paste(sub_image, sub_image_bg_pos)
-        # weapon_bg.paste(special_image, special_image_bg_pos)
-
-        paste_with_a(weapon_bg, main_image, main_image_bg_pos)
-        paste_with_a(weapon_bg, sub_image, sub_image_bg_pos)
-        paste_with_a(weapon_bg, special_image, special_image_bg_pos)
-
-        # 武器名
-        weapon_zh_name = v.zh_name
-        font_size = 16
-        if len(weapon_zh_name) > 8:
-            font_size = 15
-        if len(weapon_zh_name) > 10:
-            font_size = 14
-        font = ImageFont.truetype(ttf_path_chinese, font_size)
-        zh_name_size = font.getsize(weapon_zh_name)
-        # 纯文字不带背景 实现方式
-        dr = ImageDraw.Draw(weapon_bg)
-        zh_name_pos = ((weapon_bg_size[0] - zh_name_size[0]) // 2, weapon_bg_size[1] - zh_name_size[1] - 7)
-        dr.text(zh_name_pos, weapon_zh_name, font=font, fill=font_color)
-        # 带背景文字 实现方式
-        # weapon_zh_name_bg = get_stage_name_bg(weapon_zh_name, font_size)
-        # weapon_zh_name_bg_size = weapon_zh_name_bg.size
-        # zh_name_pos = (
-        #     (weapon_bg_size[0] - weapon_zh_name_bg_size[0]) // 2,
-        #     weapon_bg_size[1] - weapon_zh_name_bg_size[1],
-        # )
-        # paste_with_a(weapon_bg, weapon_zh_name_bg, zh_name_pos)
-
+        weapon_bg = get_weapon_tile(v, rgb, font_color)
         # 将武器背景贴到武器区域
         paste_with_a(
             weapon_card_bg,
@@ -523,7 +681,7 @@ def get_weapon_card(weapon: [WeaponData], weapon_card_bg_size, rgb, font_color)
 def get_event_card(event, event_card_bg_size) -> Image.Image:
     """绘制 活动地图卡片"""
     # 背景
-    event_card_bg = get_file("filleted_corner").resize(event_card_bg_size).convert("RGBA")
+    event_card_bg = get_file("filleted_corner", size=event_card_bg_size).convert("RGBA")
     # 调整透明度
     event_card_bg = change_image_alpha(event_card_bg, 70)
     # 比赛卡片
@@ -550,13 +708,13 @@ def get_event_card(event, event_card_bg_size) -> Image.Image:
     paste_with_a(event_card_bg, stage_card, stage_card_pos)
     # 绘制三个或多个活动时间
     drawer = ImageDraw.Draw(event_card_bg)
-    ttf = ImageFont.truetype(ttf_path_chinese, 40)
+    ttf = get_font(ttf_path_chinese, 40)
     pos_h = stage_card_pos[1] + stage_card_size[1] + 20
     for v in range(len(event["timePeriods"])):
         # 绘制游戏模式小图标
         game_mode_text = event["leagueMatchSetting"]["vsRule"]["rule"]
         game_mode_img_size = (35, 35)
-        game_mode_img = get_file(game_mode_text).resize(game_mode_img_size, Image.ANTIALIAS)
+        game_mode_img = get_file(game_mode_text, size=game_mode_img_size, resample=Image.ANTIALIAS)
         game_mode_img_pos = (20, pos_h)
         paste_with_a(event_card_bg, game_mode_img, game_mode_img_pos)
         # 绘制时间
@@ -640,7 +798,7 @@ def get_festival_team_card(
     drawer = ImageDraw.Draw(team_bg)
     area_title_text_pos = ((card_bg_size[0] - group_img_size[0]) // 2, 30)
     text_rgb = dict_bg_rgb["祭典时间-金黄"]
-    ttf = ImageFont.truetype(ttf_path_chinese, font_size)
+    ttf = get_font(ttf_path_chinese, font_size)
     drawer.text(area_title_text_pos, area_title, font=ttf, fill=text_rgb)
     # 存放阵营图片的透明卡片
     group_card_size = (group_img_size[0], group_img_size[1] + rectangle_h)
@@ -648,14 +806,15 @@ def get_festival_team_card(
 
     # 绘制阵营图片
     group_img = get_save_file(
-        ImageInfo(name=title, url=festival["image"]["url"], zh_name=title, source_type="祭典阵营图片")
-    ).resize(group_img_size)
+        ImageInfo(name=title, url=festival["image"]["url"], zh_name=title, source_type="祭典阵营图片"),
+        size=group_img_size,
+    )
     paste_with_a(group_card, group_img, (0, 0))
     # 绘制阵营名称
     drawer = ImageDraw.Draw(group_card)
     pos_w = group_card_size[0] // 6
     font_size = 30
-    ttf = ImageFont.truetype(ttf_path_chinese, font_size)
+    ttf = get_font(ttf_path_chinese, font_size)
     for k, v in enumerate(teams_list):
         group_text_bg_rgb = (int(v["color"]["r"] * 255), int(v["color"]["g"] * 255), int(v["color"]["b"] * 255))
         # 绘制色块对比图
@@ -712,8 +871,9 @@ def get_festival_result_card(card_bg_size: tuple, teams_list: [], font_path: str
         team_bg = circle_corner(team_bg, radii=14)
         # 绘制图标
         team_icon = get_save_file(
-            ImageInfo(name=v["teamName"], url=v["image"]["url"], zh_name=v["teamName"], source_type="祭典阵营单图")
-        ).resize(team_icon_size)
+            ImageInfo(name=v["teamName"], url=v["image"]["url"], zh_name=v["teamName"], source_type="祭典阵营单图"),
+            size=team_icon_size,
+        )
         team_icon_pos = ((team_bg_size[0] - team_icon_size[0]) // 2, (team_bg_size[1] - team_icon_size[1]) // 2)
         paste_with_a(team_bg, team_icon, team_icon_pos)
         # 粘贴队伍图标
@@ -724,7 +884,7 @@ def get_festival_result_card(card_bg_size: tuple, teams_list: [], font_path: str
     list_item_names = ["法螺获得率", "得票率", "开放", "挑战", "三色夺宝攻击"]
     pos_h = 120
     font_size = 30
-    ttf = ImageFont.truetype(ttf_path_chinese, font_size)
+    ttf = get_font(ttf_path_chinese, font_size)
     drawer = ImageDraw.Draw(temp_card)
     for v in range(5):
         # 绘制条目名称
@@ -741,8 +901,8 @@ def get_festival_result_card(card_bg_size: tuple, teams_list: [], font_path: str
         pos_h += h + 30
     # 绘制最终冠军
     font_size = 50
-    ttf_cn = ImageFont.truetype(ttf_path_chinese, font_size)
-    ttf_win = ImageFont.truetype(font_path, font_size)
+    ttf_cn = get_font(ttf_path_chinese, font_size)
+    ttf_win = get_font(font_path, font_size)
     win_text_1 = win_team_name
     win_text_2 = " 获胜!"
     w, h = ttf_win.getsize(win_text_1 + win_text_2)
@@ -771,7 +931,7 @@ def get_festival_result_item_card(
     item_card = circle_corner(item_card, radii=30)
     drawer = ImageDraw.Draw(item_card)
     font_size = 24
-    ttf = ImageFont.truetype(font_path, font_size)
+    ttf = get_font(font_path, font_size)
 
     # 格式化整理数据,返回 是否是赢家，百分比点数
     def get_data(index: int, value: dict) -> (bool, str):
@@ -812,7 +972,7 @@ def get_festival_result_item_card(
 def get_event_desc_card(cht_event_data, event_desc_card_bg_size) -> Image.Image:
     """绘制 活动地图描述卡片"""
     # 背景
-    event_desc_card_bg = get_file("filleted_corner").resize(event_desc_card_bg_size).convert("RGBA")
+    event_desc_card_bg = get_file("filleted_corner", size=event_desc_card_bg_size).convert("RGBA")
     # 调整透明度
     event_desc_card_bg = change_image_alpha(event_desc_card_bg, 60)
     # 对规则文字分行
@@ -821,7 +981,7 @@ def get_event_desc_card(cht_event_data, event_desc_card_bg_size) -> Image.Image:
     regulation_list = regulation.split("<br />")
     # 绘制文本
     drawer = ImageDraw.Draw(event_desc_card_bg)
-    ttf = ImageFont.truetype(ttf_path_chinese, 30)
+    ttf = get_font(ttf_path_chinese, 30)
     pos_h = 20
     for v in regulation_list:
         if v != "":
@@ -0,0 +1,58 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from nonebot.log import logger
+
+from .image_processer_tools import image_to_bytes, compress_image
+from ..config import plugin_config
+
+# 绘图线程池
+# 绘图函数依赖翻译缓存、素材数据库等进程内状态，故使用线程池而非进程池
+# pillow 的 resize、paste、编码等耗时操作会释放GIL，多个渲染可在多核上同时进行
+_render_executor: ThreadPoolExecutor = None
+
+
+def get_render_executor() -> ThreadPoolExecutor:
+    """取绘图线程池"""
+    global _render_executor
+    if _render_executor is None:
+        workers = plugin_config.splatoon3_render_workers
+        if workers <= 0:
+            workers = min(4, os.cpu_count() or 1)
+        _render_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sp3_render")
+        logger.info(f"绘图线程池已启动，线程数:{workers}")
+    return _render_executor
+
+
+def shutdown_render_executor():
+    """关闭绘图线程池"""
+    global _render_executor
+    if _render_executor is not None:
+        _render_executor.shutdown(wait=False)
+        _render_executor = None
+
+
+def render_to_bytes(func, *args) -> bytes:
+    """在绘图线程内执行 绘制图片并编码为jpeg bytes"""
+    image = func(*args)
+    if image is None:
+        return image
+    return image_to_bytes(image)
+
+
+async def run_in_render_executor(func, *args):
+    """在绘图线程池中执行同步函数，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_render_executor(), functools.partial(func, *args))
+
+
+async def run_render(func, *args) -> bytes:
+    """在绘图线程池中绘制图片  func需为只依赖传入参数的绘图函数，返回编码后的图片bytes"""
+    return await run_in_render_executor(render_to_bytes, func, *args)
+
+
+async def run_compress_image(image_bytes: bytes, kb=500, step=10, quality=50) -> bytes:
+    """在绘图线程池中压缩图片"""
+    return await run_in_render_executor(compress_image, image_bytes, kb, step, quality)
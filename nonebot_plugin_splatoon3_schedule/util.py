@@ -1,20 +1,61 @@
+import asyncio
+import datetime
+import functools
+import hashlib
 import time
 from nonebot.adapters.qq import AuditException, ActionFailed
+from nonebot.exception import ActionFailed as BaseActionFailed, NetworkError
 
 from .config import plugin_config
-from .image.image import get_save_temp_image, get_stages_image, get_coop_stages_image, get_events_image
-from .utils.utils import get_time_now_china
-from .data import db_control, db_image
+from .image.image import (
+    get_save_temp_image,
+    get_stages_image,
+    get_coop_stages_image,
+    get_events_image,
+    get_festival_image,
+    prefetch_schedule_images,
+)
+from .utils import dict_contest_trans, dict_rule_trans, TokenBucket, fan_out, SingleFlight
+from .utils.utils import get_time_now_china, get_expire_time, time_format_ymdh
+from .data import (
+    db_control,
+    db_image,
+    get_schedule_data,
+    schedule_upstream,
+    check_expire_schedule,
+    run_db,
+    get_weapon_catalogue,
+)
 from .utils.bot import *
 
+# 最近一次预渲染的结果
+last_prerender_report = "暂未进行预渲染"
+# 各bot最近一次主动推送的结果  键为bot id
+last_push_reports = {}
+# 各平台主动推送的限速令牌桶  键为适配器名称，同平台的全部bot共用
+push_limiters = {}
+# 主动推送时需要重试的异常
+push_retry_exceptions = (BaseActionFailed, NetworkError)
+# 主动推送的消息  (消息类型即触发词, 绘图函数, 参数)，按顺序发送
+push_messages = [
+    ("图", get_stages_image, ([0], None, None)),
+    ("工", get_coop_stages_image, (False,)),
+    ("活动", get_events_image, ()),
+]
+# 定时推送在每个轮换开始后的第几分钟执行
+PUSH_MINUTE = 1
+# 同一bot同一轮换的推送投递合并为一次，避免定时推送与续推同时发送
+push_flight = SingleFlight()
+# 已上传图片的句柄(kook图片链接，onebot12 file_id)  键为 (适配器, bot id, 图片哈希)，值为 (句柄, 过期时间)
+# 同一轮换内同一张图片对同一bot只上传一次，主动推送的全部频道与普通回复共用
+media_handles = {}
+# 并发推送时同一张图片的上传合并为一次
+media_upload_flight = SingleFlight()
+
 
 def get_weapon_info_test() -> bool:
-    """测试武器数据库能否取到数据"""
-    res = db_image.get_weapon_info("", "", "", "")
-    if res is not None:
-        return True
-    else:
-        return False
+    """测试武器目录能否取到数据"""
+    return len(get_weapon_catalogue()) > 0
 
 
 def write_weapon_trans_dict() -> None:
@@ -34,7 +75,7 @@ def write_weapon_trans_dict() -> None:
 
 async def cron_job(bot: Bot, bot_adapter: str, bot_id: str):
     """定时任务， 每1分钟每个bot执行"""
-    push_jobs = db_control.get_all_push(bot_adapter, bot_id)
+    push_jobs = await run_db(db_control.get_all_push, bot_adapter, bot_id)
     now = get_time_now_china()
 
     # 非kook，qqbot机器人不处理
@@ -46,54 +87,318 @@ async def cron_job(bot: Bot, bot_adapter: str, bot_id: str):
         # logger.info(f"不在时间段，当前时间{now.hour} : {now.minute}")
         return
     if len(push_jobs) > 0:
-        for _push_job in push_jobs:
-            # active_push = push_job.get("active_push")
-            msg_source_type = _push_job.get("msg_source_type")
-            msg_source_id = _push_job.get("msg_source_id")
-            # 目前仅开启频道推送
-            if msg_source_type == "channel":
-                await send_push(bot, msg_source_id)
+        await send_push(bot, get_push_channels(push_jobs))
 
 
 async def push_job(bot: Bot, bot_adapter: str, bot_id: str):
     """推送定时任务， 每两小时执行一次"""
-    push_jobs = db_control.get_all_push(bot_adapter, bot_id)
+    push_jobs = await run_db(db_control.get_all_push, bot_adapter, bot_id)
 
     # 非kook，qqbot机器人不处理
     if not isinstance(bot, (Kook_Bot, QQ_Bot)):
         return
 
+    # 清理过旧的投递日志
+    await run_db(db_control.clean_push_journal)
     if len(push_jobs) > 0:
-        for _push_job in push_jobs:
-            # active_push = push_job.get("active_push")
-            msg_source_type = _push_job.get("msg_source_type")
-            msg_source_id = _push_job.get("msg_source_id")
-            # 目前仅开启频道推送
-            if msg_source_type == "channel":
-                await send_push(bot, msg_source_id)
-
-
-async def send_push(bot: Bot, source_id):
-    """频道主动推送"""
-    logger.info(f"即将主动推送消息")
-    # 发送 图
-    func = get_stages_image
-    num_list = [0]
-    contest_match = None
-    rule_match = None
-    image = await get_save_temp_image("图", func, num_list, contest_match, rule_match)
-    await send_channel_msg(bot, source_id, image)
-    time.sleep(1)
-    # 发送 工
-    func = get_coop_stages_image
-    _all = False
-    image = await get_save_temp_image("工", func, _all)
-    await send_channel_msg(bot, source_id, image)
-    time.sleep(1)
-    # 发送 活动
-    func = get_events_image
-    image = await get_save_temp_image("活动", func)
-    await send_channel_msg(bot, source_id=source_id, msg=image)
+        await send_push(bot, get_push_channels(push_jobs))
+
+
+def get_push_channels(push_jobs: list) -> list:
+    """取需要推送的频道id"""
+    # active_push = push_job.get("active_push")
+    # 目前仅开启频道推送
+    return [
+        _push_job.get("msg_source_id") for _push_job in push_jobs if _push_job.get("msg_source_type") == "channel"
+    ]
+
+
+def get_push_limiter(bot_adapter: str) -> TokenBucket:
+    """取平台的推送限速令牌桶"""
+    limiter = push_limiters.get(bot_adapter)
+    if limiter is None:
+        limiter = TokenBucket(plugin_config.splatoon3_push_rate)
+        push_limiters[bot_adapter] = limiter
+    return limiter
+
+
+def get_push_report() -> str:
+    """取各bot最近一次主动推送的结果"""
+    if not last_push_reports:
+        return "暂未进行主动推送"
+    return "\n".join(last_push_reports.values())
+
+
+def get_prerender_list() -> list:
+    """需要预渲染的触发词  返回 (触发词, 绘图函数, 参数)"""
+    prerender_list = [
+        ("图", get_stages_image, ([0], None, None)),
+        ("图图", get_stages_image, ([0, 1], None, None)),
+        ("工", get_coop_stages_image, (False,)),
+        ("全部工", get_coop_stages_image, (True,)),
+        ("活动", get_events_image, ()),
+        ("祭典", get_festival_image, ()),
+    ]
+    # 对战 触发器的 比赛与规则组合，触发词顺序与 matcher_stage 生成的一致
+    for contest in dict_contest_trans:
+        prerender_list.append((contest, get_stages_image, ([0], contest, None)))
+    for rule in dict_rule_trans:
+        prerender_list.append((rule, get_stages_image, ([0], None, rule)))
+    for contest in dict_contest_trans:
+        # 涂地没有规则区分
+        if contest == "涂地":
+            continue
+        for rule in dict_rule_trans:
+            prerender_list.append((contest + rule, get_stages_image, ([0], contest, rule)))
+    return prerender_list
+
+
+async def prerender_job(retry_times=3, retry_interval=30):
+    """预渲染定时任务，每次日程轮换时执行，提前把常用触发词的图片写入缓存"""
+    global last_prerender_report
+    if not plugin_config.splatoon3_prerender_enable:
+        return
+    start = time.perf_counter()
+    # 日程数据只请求一次，后续全部图片都使用同一份数据渲染
+    schedule = await get_schedule_data()
+    # splatoon3.ink 的数据可能晚于整点更新，此时不能把旧日程渲染进缓存
+    retry = 0
+    while check_expire_schedule(schedule):
+        if retry >= retry_times:
+            last_prerender_report = "预渲染跳过: 日程数据未更新"
+            logger.warning(last_prerender_report)
+            return
+        retry += 1
+        logger.info(f"日程数据尚未更新，{retry_interval}s后重试预渲染")
+        await asyncio.sleep(retry_interval)
+        # 过期时 get_schedule_data 会立即返回旧数据并只在后台刷新，这里需要等待重新请求的结果
+        try:
+            schedule = await schedule_upstream.refresh()
+        except Exception as e:
+            logger.warning(f"重新请求日程数据失败: {e}")
+
+    # 先批量补齐日程用到的素材图片，避免渲染时逐张下载写库
+    try:
+        await prefetch_schedule_images(schedule)
+    except Exception as e:
+        logger.warning(f"预取素材失败: {e}")
+
+    count = 0
+    fail_count = 0
+    for trigger_word, func, args in get_prerender_list():
+        try:
+            await get_save_temp_image(trigger_word, func, *args)
+            count += 1
+        except Exception as e:
+            fail_count += 1
+            logger.warning(f"预渲染 {trigger_word} 失败: {e}")
+    last_prerender_report = "预渲染完成: 成功{}张 失败{}张 耗时{:.2f}s".format(
+        count, fail_count, time.perf_counter() - start
+    )
+    logger.info(last_prerender_report)
+
+
+async def gc_blobs_job():
+    """图片文件清理定时任务，每次日程轮换后执行  合成图片缓存被替换后旧的图片文件不再被引用，与是否开启预渲染无关"""
+    try:
+        count = await run_db(db_image.gc_blobs)
+        logger.info(f"清理图片文件{count}个")
+    except Exception as e:
+        logger.warning(f"清理图片文件失败: {e}")
+
+
+def get_prerender_report() -> str:
+    """取最近一次预渲染的结果"""
+    return last_prerender_report
+
+
+def get_push_rotation() -> str:
+    """取当前推送轮换  为本轮日程开始的整点(偶数小时)，格式同过期时间 ymdh"""
+    now = get_time_now_china()
+    return now.replace(hour=now.hour - now.hour % 2).strftime(time_format_ymdh)
+
+
+async def send_push(bot: Bot, source_ids: list):
+    """频道主动推送  登记本轮换的投递日志后，并发向全部频道依次发送 图 工 活动"""
+    if not source_ids:
+        return
+    rotation = get_push_rotation()
+    bot_adapter = bot.adapter.get_name()
+    msg_kinds = [kind for kind, _, _ in push_messages]
+    await run_db(db_control.add_push_journal, rotation, bot_adapter, bot.self_id, source_ids, msg_kinds)
+    return await deliver_push(bot, rotation)
+
+
+async def resume_push(bot: Bot):
+    """bot重新接入时 续推本轮换内尚未投递成功的消息
+    bot在推送时间断线(定时任务未执行，没有投递日志)时，补发本轮换的推送"""
+    # 非kook，qqbot机器人不处理
+    if not isinstance(bot, (Kook_Bot, QQ_Bot)):
+        return
+    rotation = get_push_rotation()
+    bot_adapter = bot.adapter.get_name()
+    journal = await run_db(db_control.get_push_journal, rotation, bot_adapter, bot.self_id)
+    if journal:
+        if any(row["status"] != "sent" for row in journal):
+            logger.info(f"bot {bot.self_id} 存在本轮换未完成的推送，开始续推")
+            await deliver_push(bot, rotation)
+        return
+    # 还未到推送时间时，由定时任务推送
+    push_time = datetime.datetime.strptime(rotation, time_format_ymdh) + datetime.timedelta(minutes=PUSH_MINUTE)
+    if get_time_now_china() < push_time:
+        return
+    push_jobs = await run_db(db_control.get_all_push, bot_adapter, bot.self_id)
+    source_ids = get_push_channels(push_jobs)
+    if source_ids:
+        logger.info(f"bot {bot.self_id} 本轮换的定时推送未执行，开始补发")
+        await send_push(bot, source_ids)
+
+
+async def deliver_push(bot: Bot, rotation: str):
+    """按投递日志发送本轮换尚未投递成功的消息  同一bot同一轮换同时只有一个投递在执行"""
+    return await push_flight.do((rotation, bot.adapter.get_name(), bot.self_id), _deliver_push, bot, rotation)
+
+
+async def _deliver_push(bot: Bot, rotation: str):
+    bot_adapter = bot.adapter.get_name()
+    journal = await run_db(db_control.get_push_journal, rotation, bot_adapter, bot.self_id)
+    # 幂等键  键为 (频道id, 消息类型)，已投递的消息不会再次发送
+    keys = {(row["msg_source_id"], row["msg_kind"]): row["idempotency_key"] for row in journal}
+    delivered = {(row["msg_source_id"], row["msg_kind"]) for row in journal if row["status"] == "sent"}
+    source_ids = list(dict.fromkeys(source_id for source_id, _ in keys))
+    if len(delivered) == len(keys):
+        return None
+    logger.info(f"即将向{len(source_ids)}个频道主动推送消息")
+    # 全部频道推送的图片相同，只取一次
+    images = {kind: await get_save_temp_image(kind, func, *args) for kind, func, args in push_messages}
+
+    def skip(source_id, kind):
+        return (source_id, kind) in delivered
+
+    async def send(source_id, kind):
+        key = keys[(source_id, kind)]
+        if images[kind]:
+            try:
+                await send_channel_msg(bot, source_id, images[kind], raise_error=True)
+            except Exception as e:
+                await run_db(db_control.update_push_journal, key, "pending", str(e))
+                raise
+        # 先发送再登记，进程恰好在两者之间退出时续推会重发这一条，不会漏发
+        await run_db(db_control.update_push_journal, key, "sent", None, bool(images[kind]))
+        delivered.add((source_id, kind))
+
+    # 消息间隔由平台令牌桶控制，不再固定等待
+    report = await fan_out(
+        f"{bot_adapter} {bot.self_id} 主动推送",
+        source_ids,
+        [kind for kind, _, _ in push_messages],
+        send,
+        limiter=get_push_limiter(bot_adapter),
+        concurrency=plugin_config.splatoon3_push_concurrency,
+        retry_exceptions=push_retry_exceptions,
+        skip=skip,
+    )
+    # 重试耗尽的消息标记为失败，bot重新接入时仍会续推
+    for source_id in report.errors:
+        for kind, _, _ in push_messages:
+            if (source_id, kind) not in delivered:
+                key = keys[(source_id, kind)]
+                await run_db(db_control.update_push_journal, key, "failed", report.errors[source_id], False)
+    last_push_reports[bot.self_id] = report.get_text()
+    logger.info(last_push_reports[bot.self_id])
+    return report
+
+
+def get_push_stats() -> str:
+    """按轮换统计推送投递结果"""
+    stats = db_control.get_push_stats()
+    if not stats:
+        return "暂无推送记录"
+    return "\n".join(
+        "{} {} {}: 频道{}个 已投递{} 未投递{} 失败{} 发送次数{}".format(
+            row["rotation"],
+            row["bot_adapter"],
+            row["bot_id"],
+            row["targets"],
+            row["sent"],
+            row["pending"],
+            row["failed"],
+            row["attempts"],
+        )
+        for row in stats
+    )
+
+
+async def get_media_handle(bot: Bot, img: bytes, upload) -> str:
+    """取已上传图片的句柄，不存在或已过期时调用 upload(img) 上传
+    qq适配器的 file_image 直接随消息发送图片二进制，没有可复用的句柄，不经过此缓存"""
+    key = (bot.adapter.get_name(), bot.self_id, hashlib.sha256(img).hexdigest())
+    cached = media_handles.get(key)
+    if cached is not None:
+        handle, expire_time = cached
+        if get_time_now_china() < datetime.datetime.strptime(expire_time, time_format_ymdh):
+            return handle
+    handle = await media_upload_flight.do(key, upload, img)
+    if handle:
+        # 写入时顺带清理已过期的句柄
+        now = get_time_now_china()
+        for k in [k for k, v in media_handles.items() if now >= datetime.datetime.strptime(v[1], time_format_ymdh)]:
+            media_handles.pop(k, None)
+        media_handles[key] = (handle, get_expire_time())
+    return handle
+
+
+async def upload_v12_file(bot: V12_Bot, img: bytes) -> str:
+    """onebot12 上传图片取file_id"""
+    resp = await bot.upload_file(type="data", name="temp.png", data=img)
+    return resp["file_id"]
+
+
+async def kook_relay_upload(img: bytes) -> str:
+    """使用kook的接口上传图片取url  没有接入kook bot时返回None"""
+    kook_bot = None
+    bots = nonebot.get_bots()
+    for k, b in bots.items():
+        if isinstance(b, Kook_Bot):
+            kook_bot = b
+            break
+    if kook_bot is None:
+        return None
+    return await kook_bot.upload_file(img)
+
+
+async def local_relay_upload(img: bytes) -> str:
+    """本地测试用的中转上传  将图片写入文件库并返回本地文件url，不依赖其他平台的bot"""
+    sha = await run_db(db_image.blobs.put, img)
+    return db_image.blobs.get_path(sha).as_uri()
+
+
+# q群发图时的中转上传方式  值为上传图片并返回url的协程函数
+relay_uploaders = {
+    "kook": kook_relay_upload,
+    "local": local_relay_upload,
+}
+# 并发请求同一张图片时只上传一次
+relay_upload_flight = SingleFlight()
+
+
+async def get_relay_url(img: bytes) -> str:
+    """取图片的中转url  同一轮换内相同内容的图片只上传一次，链接持久化在数据库中，重启后仍可复用"""
+    image_sha = hashlib.sha256(img).hexdigest()
+    # 查询数据库也在合并范围内，否则查询未命中后才加入的请求会在上传完成后再上传一次
+    return await relay_upload_flight.do(image_sha, get_or_upload_relay_url, image_sha, img)
+
+
+async def get_or_upload_relay_url(image_sha: str, img: bytes) -> str:
+    """读取数据库中的中转url，不存在时上传并保存"""
+    url = await run_db(db_image.get_image_relay, image_sha)
+    if url:
+        return url
+    upload = relay_uploaders.get(plugin_config.splatoon3_image_relay, kook_relay_upload)
+    url = await upload(img)
+    if url:
+        await run_db(db_image.add_or_modify_IMAGE_RELAY, image_sha, url, get_expire_time())
+    return url
 
 
 async def send_msg(bot: Bot, event: Event, msg: str | bytes):
@@ -128,8 +433,7 @@ async def send_msg(bot: Bot, event: Event, msg: str | bytes):
         elif isinstance(bot, V12_Bot):
             # onebot12协议需要先上传文件获取file_id后才能发送图片
             try:
-                resp = await bot.upload_file(type="data", name="temp.png", data=img)
-                file_id = resp["file_id"]
+                file_id = await get_media_handle(bot, img, functools.partial(upload_v12_file, bot))
                 if file_id:
                     await bot.send(event, message=V12_MsgSeg.image(file_id=file_id), reply_message=reply_mode)
             except Exception as e:
@@ -140,28 +444,22 @@ async def send_msg(bot: Bot, event: Event, msg: str | bytes):
             else:
                 await bot.send(event, Tg_File.photo(img))
         elif isinstance(bot, Kook_Bot):
-            url = await bot.upload_file(img)
+            url = await get_media_handle(bot, img, bot.upload_file)
             await bot.send(event, Kook_MsgSeg.image(url), reply_sender=reply_mode)
         elif isinstance(bot, QQ_Bot):
             if not isinstance(event, GroupAtMessageCreateEvent):
                 await bot.send(event, message=QQ_MsgSeg.file_image(img))
             else:
                 # 目前q群只支持url图片，得想办法上传图片获取url
-                kook_bot = None
-                bots = nonebot.get_bots()
-                for k, b in bots.items():
-                    if isinstance(b, Kook_Bot):
-                        kook_bot = b
-                        break
-                if kook_bot is not None:
-                    # 使用kook的接口传图片
-                    url = await kook_bot.upload_file(img)
+                url = await get_relay_url(img)
+                if url:
                     # logger.info("url:" + url)
                     await bot.send(event, message=QQ_MsgSeg.image(url))
 
 
-async def send_channel_msg(bot: Bot, source_id, msg: str | bytes):
-    """公用发送频道消息"""
+async def send_channel_msg(bot: Bot, source_id, msg: str | bytes, raise_error=False):
+    """公用发送频道消息
+    :param raise_error: 为True时api操作失败的异常继续抛出，交由调用方重试"""
     if isinstance(msg, str):
         # 文字消息
         if isinstance(bot, Kook_Bot):
@@ -173,13 +471,15 @@ async def send_channel_msg(bot: Bot, source_id, msg: str | bytes):
                 logger.warning(f"主动消息审核结果为{e.__dict__}")
             except ActionFailed as e:
                 logger.warning(f"主动消息发送失败，api操作结果为{e.__dict__}")
+                if raise_error:
+                    raise
         elif isinstance(bot, Tg_Bot):
             await bot.send_message(chat_id=source_id, text=msg)
     elif isinstance(msg, bytes):
         # 图片
         img = msg
         if isinstance(bot, Kook_Bot):
-            url = await bot.upload_file(img)
+            url = await get_media_handle(bot, img, bot.upload_file)
             await bot.send_channel_msg(channel_id=source_id, message=Kook_MsgSeg.image(url))
         elif isinstance(bot, QQ_Bot):
             try:
@@ -188,6 +488,8 @@ async def send_channel_msg(bot: Bot, source_id, msg: str | bytes):
                 logger.warning(f"主动消息审核结果为{e.__dict__}")
             except ActionFailed as e:
                 logger.warning(f"主动消息发送失败，api操作结果为{e.__dict__}")
+                if raise_error:
+                    raise
         elif isinstance(bot, Tg_Bot):
             await bot.send_photo(source_id, img)
 
@@ -213,7 +515,7 @@ async def send_private_msg(bot: Bot, source_id, msg: str | bytes, event=None):
         # 图片
         img = msg
         if isinstance(bot, Kook_Bot):
-            url = await bot.upload_file(img)
+            url = await get_media_handle(bot, img, bot.upload_file)
             await bot.send_private_msg(user_id=source_id, message=Kook_MsgSeg.image(url))
         elif isinstance(bot, QQ_Bot):
             try:
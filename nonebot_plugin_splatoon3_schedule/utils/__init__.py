@@ -1,3 +1,7 @@
 from .utils import *
 from .translation import *
 from .dataClass import ImageInfo, WeaponData
+from .cache import SingleFlight, LRUCache
+from .fanout import TokenBucket, FanOutReport, fan_out
+from .snapshot import SnapshotStore, snapshot_store
+from .upstream import UpstreamData, load_snapshot, refresh_upstream_data, get_upstream_data_version, get_upstream_stats
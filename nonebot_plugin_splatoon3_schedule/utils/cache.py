@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class SingleFlight:
+    """并发请求合并
+    同一个key同时只会执行一次func，其余并发调用者等待同一个future的结果"""
+
+    def __init__(self):
+        self._futures: dict[str, asyncio.Future] = {}
+        # calls 总调用次数  executions 实际执行次数  coalesced 被合并的等待者数量
+        self.stats = {"calls": 0, "executions": 0, "coalesced": 0}
+
+    def is_running(self, key) -> bool:
+        """该key是否正在执行"""
+        return key in self._futures
+
+    async def do(self, key, func, *args):
+        """执行或等待 key 对应的协程函数 func(*args)"""
+        self.stats["calls"] += 1
+        future = self._futures.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            # shield 防止某个等待者被取消时，连带取消其他等待者
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._futures[key] = future
+        self.stats["executions"] += 1
+        try:
+            result = await func(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 标记异常已被读取，避免没有等待者时输出 exception never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._futures.pop(key, None)
+
+
+class LRUCache:
+    """按占用大小限制容量的LRU缓存
+    sizeof 用于计算单个值的占用大小，默认为len，即按字节数计算"""
+
+    def __init__(self, max_size: int, sizeof=len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """取值，命中时会将该值移动到最近使用的位置"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[0]
+
+    def put(self, key, value):
+        """写入值，超出容量时从最久未使用的值开始淘汰"""
+        size = self.sizeof(value)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            # 单个值超过总容量时不缓存
+            if size > self.max_size:
+                return
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evict_size) = self._data.popitem(last=False)
+                self.size -= evict_size
+                self.stats["evictions"] += 1
+
+    def pop(self, key, default=None):
+        """移除值"""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self.size -= item[1]
+            return item[0]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def get_stats_text(self) -> str:
+        """统计信息文本"""
+        return "命中{}次 未命中{}次 淘汰{}次 占用{:.1f}/{:.1f}MB 共{}项".format(
+            self.stats["hits"],
+            self.stats["misses"],
+            self.stats["evictions"],
+            self.size / 1024 / 1024,
+            self.max_size / 1024 / 1024,
+            len(self._data),
+        )
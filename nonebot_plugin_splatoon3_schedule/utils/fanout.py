@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+from nonebot.log import logger
+
+
+class TokenBucket:
+    """令牌桶限速
+    rate 为每秒补充的令牌数，capacity 为桶容量(允许的瞬时突发数量)，rate<=0 时不限速"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """取一个令牌，令牌不足时等待"""
+        if self.rate <= 0:
+            return
+        # 排队取令牌，先到先得
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class FanOutReport:
+    """推送结果统计"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.targets = 0
+        self.success = 0
+        self.failed = 0
+        self.messages = 0
+        # 被 skip 跳过(如已投递过)的消息数
+        self.skipped = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        # 失败的目标及原因
+        self.errors = {}
+
+    def get_text(self) -> str:
+        throughput = self.messages / self.elapsed if self.elapsed > 0 else 0
+        return "{}: 目标{}个 成功{} 失败{} 消息{}条 跳过{}条 重试{}次 耗时{:.2f}s 吞吐{:.2f}条/s".format(
+            self.name,
+            self.targets,
+            self.success,
+            self.failed,
+            self.messages,
+            self.skipped,
+            self.retries,
+            self.elapsed,
+            throughput,
+        )
+
+
+async def fan_out(
+    name: str,
+    targets: list,
+    messages: list,
+    send,
+    limiter: TokenBucket = None,
+    concurrency: int = 8,
+    retry_times: int = 3,
+    retry_interval: float = 2,
+    retry_exceptions: tuple = (Exception,),
+    skip=None,
+) -> FanOutReport:
+    """并发向多个目标依次发送同一组消息
+    :param send: 发送单条消息的协程函数 send(target, msg)
+    :param skip: 判断是否跳过某条消息的函数 skip(target, msg)，跳过的消息不取令牌也不计入发送数
+    :param limiter: 令牌桶，每条消息(包括重试)发送前取一个令牌
+    :param concurrency: 同时发送的目标数
+    :param retry_exceptions: 需要重试的异常，重试间隔按 retry_interval 指数增长
+    单个目标内消息按顺序发送，某条消息重试耗尽后放弃该目标剩余消息，不影响其他目标
+    """
+    report = FanOutReport(name)
+    report.targets = len(targets)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    start = time.perf_counter()
+
+    async def send_with_retry(target, msg):
+        if skip is not None and skip(target, msg):
+            report.skipped += 1
+            return
+        retry = 0
+        while True:
+            if limiter is not None:
+                await limiter.acquire()
+            try:
+                await send(target, msg)
+                report.messages += 1
+                return
+            except retry_exceptions as e:
+                if retry >= retry_times:
+                    raise
+                delay = retry_interval * 2**retry
+                retry += 1
+                report.retries += 1
+                logger.info(f"{name} 目标{target} 发送失败，{delay}s后第{retry}次重试: {e}")
+                await asyncio.sleep(delay)
+
+    async def send_target(target):
+        async with semaphore:
+            try:
+                for msg in messages:
+                    await send_with_retry(target, msg)
+                report.success += 1
+            except Exception as e:
+                report.failed += 1
+                report.errors[target] = str(e)
+                logger.warning(f"{name} 目标{target} 发送失败: {e}")
+
+    await asyncio.gather(*(send_target(target) for target in targets))
+    report.elapsed = time.perf_counter() - start
+    return report
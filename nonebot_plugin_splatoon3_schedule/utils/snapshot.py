@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from nonebot.log import logger
+
+from .utils import DIR_RESOURCE, get_time_now_china, time_format_ymdh
+
+# 上游数据快照目录
+snapshot_folder = os.path.join(DIR_RESOURCE, "db", "snapshot")
+
+
+class SnapshotStore:
+    """上游json数据的磁盘快照
+    每份数据保存为一个json文件，包含数据本身、请求时间与过期时间，重启后无需访问网络即可载入上次的数据"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.folder, f"{name}.json")
+
+    def load(self, name: str) -> dict:
+        """读取快照  返回 {"data", "fetch_time", "expire_time"}，不存在或损坏时返回None"""
+        path = self.get_path(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if "data" not in snapshot:
+                return None
+            return snapshot
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取快照 {name} 失败: {e}")
+            return None
+
+    def save(self, name: str, data, expire_time: str = None, **extra):
+        """写入快照  先写临时文件再改名，进程中途退出也不会留下半个文件"""
+        snapshot = {
+            "data": data,
+            "fetch_time": get_time_now_china().strftime(time_format_ymdh + ":%M:%S"),
+            "expire_time": expire_time,
+            **extra,
+        }
+        os.makedirs(self.folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.get_path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def async_save(self, name: str, data, expire_time: str = None, **extra):
+        """在线程中写入快照，不阻塞事件循环  写入失败只记录日志，不影响本次请求"""
+        try:
+            await asyncio.to_thread(self.save, name, data, expire_time, **extra)
+        except Exception as e:
+            logger.warning(f"写入快照 {name} 失败: {e}")
+
+
+snapshot_store = SnapshotStore(snapshot_folder)
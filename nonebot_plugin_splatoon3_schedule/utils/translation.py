@@ -3,60 +3,54 @@ import json
 import random
 
 from nonebot.log import logger
-from .utils import get_time_ymd, cf_http_get, time_format_ymdh, get_time_now_china, get_expire_time
+from .utils import get_time_ymd, async_cf_http_get, time_format_ymdh, get_time_now_china, get_expire_time
+from .upstream import UpstreamData
 
 trans_res: dict = None
 trans_eng_res: dict = None
-trans_res_expire_ymd: str
-trans_eng_res_expire_ymd: str
 # 武器图片类型
 weapon_image_type = ["Main", "Sub", "Special", "Class", "Father_Class"]
 
 
-def check_expire_trans(_trans_res_expire_ymd):
-    """校验过期翻译 过期时间为两小时"""
-    expire_time = datetime.datetime.strptime(_trans_res_expire_ymd, time_format_ymdh)
-    time_now = get_time_now_china()
-    if time_now >= expire_time:
-        return True
-    return False
+def update_trans_cht(data):
+    global trans_res
+    trans_res = data
+
+
+def update_trans_eng(data):
+    global trans_eng_res
+    trans_eng_res = data
+
+
+# 翻译数据 按轮换整点过期
+trans_upstream = UpstreamData(
+    "locale_zh-CN", "https://splatoon3.ink/data/locale/zh-CN.json", on_update=update_trans_cht
+)
+trans_eng_upstream = UpstreamData(
+    "locale_en-GB", "https://splatoon3.ink/data/locale/en-GB.json", on_update=update_trans_eng
+)
 
 
-def get_trans_cht_data() -> dict:
+async def get_trans_cht_data() -> dict:
     """取中文 翻译数据"""
-    global trans_res
-    global trans_res_expire_ymd
-    if trans_res is None or check_expire_trans(trans_res_expire_ymd):
-        logger.info("重新请求:中文翻译文本")
-        result = cf_http_get("https://splatoon3.ink/data/locale/zh-CN.json").text
-        trans_res = json.loads(result)
-        # 刷新储存时 时间
-        trans_res_expire_ymd = get_expire_time()
-        return trans_res
-    else:
-        return trans_res
+    return await trans_upstream.get()
 
 
-def get_trans_eng_data() -> dict:
+async def get_trans_eng_data() -> dict:
     """取英文 文本数据"""
-    global trans_eng_res
-    global trans_eng_res_expire_ymd
-    if trans_eng_res is None or check_expire_trans(trans_eng_res_expire_ymd):
-        logger.info("重新请求:英文文本")
-        result = cf_http_get("https://splatoon3.ink/data/locale/en-GB.json").text
-        trans_eng_res = json.loads(result)
-        # 刷新储存时 时间
-        trans_eng_res_expire_ymd = get_expire_time()
-        return trans_eng_res
-    else:
-        return trans_eng_res
+    return await trans_eng_upstream.get()
+
+
+def get_trans_cht_cache() -> dict:
+    """取已缓存的中文 翻译数据，供绘图等同步函数使用，调用前需保证已 await get_trans_cht_data()"""
+    return trans_res
 
 
-def weapons_trans_eng_to_cht(eng_name):
+async def weapons_trans_eng_to_cht(eng_name):
     """装备由英文名翻译为中文"""
     # 获取两组语言数据
-    cht_data = get_trans_cht_data()
-    eng_data = get_trans_eng_data()
+    cht_data = await get_trans_cht_data()
+    eng_data = await get_trans_eng_data()
     cht_weapons = dict(cht_data["weapons"])
     eng_weapons = dict(eng_data["weapons"])
     key = ""
@@ -0,0 +1,223 @@
+import asyncio
+import datetime
+import json
+
+from nonebot.log import logger
+
+from .cache import SingleFlight
+from .snapshot import snapshot_store
+from .utils import async_cf_http_get, get_expire_time, get_time_now_china, time_format_ymdh
+from ..config import plugin_config
+
+# 全部上游数据  用于启动时统一载入快照与后台刷新
+upstream_registry = []
+# 快照中请求时间的格式
+fetch_time_format = time_format_ymdh + ":%M:%S"
+# 后台刷新的最小间隔，秒  上游故障或上游尚未更新(请求后数据仍过期)时，不会每个请求都触发刷新
+UPSTREAM_RETRY_INTERVAL = 60
+# 上游数据版本  任一上游数据被替换时加一，由上游数据派生的缓存据此判断是否失效
+upstream_data_version = 0
+
+
+class UpstreamData:
+    """上游json数据 及其刷新策略
+    未过期时直接返回内存中的数据；
+    已过期时立即返回旧数据，同时在后台重新请求(stale-while-revalidate)；
+    重新请求时带上 ETag/Last-Modified 校验信息，上游数据未改变(304)时直接沿用已有数据；
+    请求失败时继续返回旧数据，并标记为过期数据(stale-if-error)；
+    只有没有任何数据，或数据请求时间已超过 splatoon3_upstream_stale_cap 小时时，才等待请求结果"""
+
+    def __init__(self, name: str, url: str, parse=None, check_expire=None, on_update=None):
+        """
+        :param name: 名称，同时作为快照名称
+        :param parse: 对json解析结果的处理函数，返回需要保存的数据
+        :param check_expire: 判断数据是否过期的函数 check_expire(data)，缺省时按下一个轮换整点过期
+        :param on_update: 数据更新后的回调 on_update(data)，用于同步模块全局变量及派生索引
+        """
+        self.name = name
+        self.url = url
+        self.parse = parse
+        self.check_expire = check_expire
+        self.on_update = on_update
+        self.data = None
+        # 过期时间 ymdh 格式
+        self.expire_time: str = None
+        self.fetch_time: datetime.datetime = None
+        # 当前返回的是否为已过期的数据
+        self.stale = False
+        self.last_error: str = None
+        # http校验信息
+        self.etag: str = None
+        self.last_modified: str = None
+        # 上次完整响应的大小，304时记为节省的流量
+        self.content_size = 0
+        self.stats = {"hits": 0, "stale_hits": 0, "fetches": 0, "not_modified": 0, "errors": 0, "bytes_saved": 0}
+        self._flight = SingleFlight()
+        self._task: asyncio.Task = None
+        # 上次发起请求的时间，用于控制后台刷新间隔
+        self._attempt_time: datetime.datetime = None
+        upstream_registry.append(self)
+
+    def is_expired(self) -> bool:
+        if self.data is None:
+            return True
+        if self.check_expire is not None:
+            return self.check_expire(self.data)
+        return get_time_now_china() >= datetime.datetime.strptime(self.expire_time, time_format_ymdh)
+
+    def is_over_stale_cap(self) -> bool:
+        """数据是否旧到不能再使用"""
+        if self.fetch_time is None:
+            return True
+        stale_cap = datetime.timedelta(hours=plugin_config.splatoon3_upstream_stale_cap)
+        return get_time_now_china() - self.fetch_time > stale_cap
+
+    async def get(self):
+        """取数据"""
+        if self.data is None:
+            return await self.refresh()
+        if not self.is_expired():
+            self.stats["hits"] += 1
+            return self.data
+        if self.is_over_stale_cap():
+            logger.info(f"{self.name} 数据已超过可用时限，等待重新请求")
+            return await self.refresh()
+        self.stale = True
+        self.stats["stale_hits"] += 1
+        self.refresh_in_background()
+        return self.data
+
+    def refresh_in_background(self):
+        """在后台重新请求，同时只有一个后台任务"""
+        if self._attempt_time is not None:
+            if get_time_now_china() - self._attempt_time < datetime.timedelta(seconds=UPSTREAM_RETRY_INTERVAL):
+                return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"后台刷新 {self.name} 失败，继续使用旧数据: {e}")
+
+    async def refresh(self):
+        """重新请求  并发的请求合并为一次"""
+        return await self._flight.do(self.name, self._fetch)
+
+    async def _fetch(self):
+        logger.info(f"重新请求:{self.name}")
+        self.stats["fetches"] += 1
+        self._attempt_time = get_time_now_china()
+        headers = {}
+        # 已有数据时才发送条件请求，否则304也无数据可用
+        if self.data is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        try:
+            response = await async_cf_http_get(self.url, headers=headers or None)
+            if response.status_code == 304 and self.data is not None:
+                data = self.data
+                self.stats["not_modified"] += 1
+                self.stats["bytes_saved"] += self.content_size
+                logger.info(f"{self.name} 上游数据未改变，沿用已有数据")
+            else:
+                data = json.loads(response.text)
+                if self.parse is not None:
+                    data = self.parse(data)
+                self.etag = response.headers.get("ETag")
+                self.last_modified = response.headers.get("Last-Modified")
+                self.content_size = len(response.content)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.last_error = str(e)
+            if self.data is not None:
+                self.stale = True
+            raise
+        self.set_data(data, get_expire_time(), get_time_now_china())
+        await snapshot_store.async_save(
+            self.name,
+            data,
+            self.expire_time,
+            etag=self.etag,
+            last_modified=self.last_modified,
+            content_size=self.content_size,
+        )
+        return data
+
+    def set_data(self, data, expire_time: str, fetch_time: datetime.datetime):
+        global upstream_data_version
+        # 304 时沿用的是同一个对象，数据未改变，不增加版本
+        if data is not self.data:
+            upstream_data_version += 1
+        self.data = data
+        self.expire_time = expire_time
+        self.fetch_time = fetch_time
+        self.stale = False
+        self.last_error = None
+        if self.on_update is not None:
+            self.on_update(data)
+
+    def get_fetch_time_text(self) -> str:
+        return self.fetch_time.strftime(fetch_time_format) if self.fetch_time else "无"
+
+    def load_snapshot(self) -> bool:
+        """从快照载入数据，不访问网络"""
+        snapshot = snapshot_store.load(self.name)
+        if snapshot is None:
+            return False
+        try:
+            fetch_time = datetime.datetime.strptime(snapshot["fetch_time"], fetch_time_format)
+        except (KeyError, TypeError, ValueError):
+            fetch_time = None
+        self.etag = snapshot.get("etag")
+        self.last_modified = snapshot.get("last_modified")
+        self.content_size = snapshot.get("content_size", 0)
+        self.set_data(snapshot["data"], snapshot["expire_time"] or get_expire_time(), fetch_time)
+        return True
+
+    def get_stats_text(self) -> str:
+        state = "无数据" if self.data is None else ("过期" if self.stale or self.is_expired() else "有效")
+        text = "{}: {} 请求于{} 命中{}次 过期命中{}次 请求{}次 未改变{}次 节省{:.1f}KB 失败{}次".format(
+            self.name,
+            state,
+            self.get_fetch_time_text(),
+            self.stats["hits"],
+            self.stats["stale_hits"],
+            self.stats["fetches"],
+            self.stats["not_modified"],
+            self.stats["bytes_saved"] / 1024,
+            self.stats["errors"],
+        )
+        if self.last_error:
+            text += f" 最近错误:{self.last_error}"
+        return text
+
+
+def load_snapshot():
+    """启动时从快照载入全部上游数据，不访问网络  快照已过期时仍先载入，由后台刷新"""
+    names = [upstream.name for upstream in upstream_registry if upstream.load_snapshot()]
+    if names:
+        logger.info(f"已从快照载入上游数据: {','.join(names)}")
+
+
+async def refresh_upstream_data():
+    """刷新没有数据或已过期的上游数据"""
+    for upstream in upstream_registry:
+        if upstream.is_expired():
+            try:
+                await upstream.refresh()
+            except Exception as e:
+                logger.warning(f"后台刷新 {upstream.name} 失败: {e}")
+
+
+def get_upstream_data_version() -> int:
+    """取上游数据版本"""
+    return upstream_data_version
+
+
+def get_upstream_stats() -> str:
+    """上游数据 统计信息"""
+    return "\n".join(upstream.get_stats_text() for upstream in upstream_registry)
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import os
 
@@ -5,18 +6,32 @@ import cfscrape
 import httpx
 from httpx import Response
 
+from nonebot.log import logger
+
 from .dataClass import TimeUtil
 from ..config import plugin_config
 
 DIR_RESOURCE = f"{os.path.abspath(os.path.join(__file__, os.pardir, os.pardir))}/resource"
 time_format_ymdh = "%Y-%m-%dT%H"
 HTTP_TIME_OUT = 5.0  # 请求超时，秒
+HTTP_MAX_CONNECTIONS = 20  # 共享连接池 最大连接数
+HTTP_MAX_KEEPALIVE = 10  # 共享连接池 每个host保持的长连接数
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+}
+# cf 盾拦截时返回的状态码
+CF_BLOCK_STATUS = (403, 429, 503)
 proxy_address = plugin_config.splatoon3_proxy_address
 if proxy_address:
     proxies = "http://{}".format(proxy_address)
 else:
     proxies = None
 
+# 全局共享的 http client 与 cf scraper，避免每次请求都重新建立连接
+_http_client: httpx.AsyncClient = None
+_cf_scraper = None
+
 # 背景 rgb颜色
 dict_bg_rgb = {
     "Turf War": (24, 200, 26),
@@ -35,30 +50,72 @@ dict_bg_rgb = {
 }
 
 
-def cf_http_get(url: str):
-    """cf get"""
-    # 实例化一个create_scraper对象
-    scraper = cfscrape.create_scraper()
-    # 请求报错，可以加上时延
-    # scraper = cfscrape.create_scraper(delay = 6)
+def get_http_client() -> httpx.AsyncClient:
+    """取全局共享的 async http client (连接池按host复用连接)"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            proxies=proxies,
+            headers=HTTP_HEADERS,
+            timeout=HTTP_TIME_OUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """关闭全局共享的 async http client"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+
+def get_cf_scraper():
+    """取全局共享的 cf scraper (本身为requests.Session，可复用连接)"""
+    global _cf_scraper
+    if _cf_scraper is None:
+        # 实例化一个create_scraper对象
+        _cf_scraper = cfscrape.create_scraper()
+        # 请求报错，可以加上时延
+        # _cf_scraper = cfscrape.create_scraper(delay = 6)
+    return _cf_scraper
+
+
+def cf_http_get(url: str, headers: dict = None):
+    """cf get 同步请求，会阻塞当前线程，异步环境下请使用 async_cf_http_get"""
+    scraper = get_cf_scraper()
     if proxy_address:
         cf_proxies = {
             "http": "http://{}".format(proxy_address),
             "https": "http://{}".format(proxy_address),
         }
         # 获取网页内容 代理访问
-        res = scraper.get(url, proxies=cf_proxies)
+        res = scraper.get(url, proxies=cf_proxies, headers=headers)
     else:
         # 获取网页内容
-        res = scraper.get(url)
+        res = scraper.get(url, headers=headers)
     return res
 
 
-async def async_http_get(url: str) -> Response:
+async def async_cf_http_get(url: str, headers: dict = None):
+    """async cf get
+    优先使用共享连接池直接请求，被cf盾拦截时再将cfscrape请求放到线程中执行，不阻塞事件循环"""
+    try:
+        response = await get_http_client().get(url, headers=headers)
+        if response.status_code not in CF_BLOCK_STATUS:
+            return response
+        logger.info(f"请求被cf拦截，状态码{response.status_code}，改用cfscrape重试:{url}")
+    except httpx.HTTPError as e:
+        logger.warning(f"async请求失败，改用cfscrape重试:{url} {e}")
+    return await asyncio.to_thread(cf_http_get, url, headers)
+
+
+async def async_http_get(url: str, headers: dict = None) -> Response:
     """async http_get"""
-    async with httpx.AsyncClient(proxies=proxies) as client:
-        response = await client.get(url, timeout=HTTP_TIME_OUT)
-        return response
+    response = await get_http_client().get(url, headers=headers)
+    return response
 
 
 def http_get(url: str) -> Response:
@@ -91,6 +148,23 @@ def get_expire_time() -> str:
     return expire_time_str
 
 
+def get_expire_time_by_nodes(time_list: list, cap_hours: int = None) -> str:
+    """按日程节点的时间计算过期时间 字符串 精确度为 ymdh
+    取还未到来的最早时间点(如节点的endTime)；全部时间点都已过去(上游数据尚未更新)时，按下一个轮换整点计算
+    :param time_list: 上游json中的时间字符串，如 2023-01-01T00:00:00Z
+    :param cap_hours: 最长有效小时数
+    """
+    time_now = get_time_now_china()
+    future = [t for t in (time_converter(s) for s in time_list if s) if t > time_now]
+    if not future:
+        return get_expire_time()
+    expire_time = min(future)
+    if cap_hours is not None:
+        expire_time = min(expire_time, time_now + datetime.timedelta(hours=cap_hours))
+    # 截断到小时，非整点的时间点会提前过期，不会返回过时的图片
+    return expire_time.strftime(time_format_ymdh).strip()
+
+
 def time_converter(time_str) -> datetime:
     """时间转换 年-月-日 时:分:秒"""
     # convert time to UTC+8
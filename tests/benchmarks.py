@@ -0,0 +1,281 @@
+"""性能测试  均在临时目录下运行，不影响插件资源目录下的数据库与快照
+用法: python -m tests.benchmarks [测试名 ...]  不指定时运行全部测试"""
+import asyncio
+import contextlib
+import importlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import nonebot
+from nonebot.log import logger
+from PIL import Image
+
+
+@contextlib.contextmanager
+def use_image_db(work_dir: Path):
+    """绘图时读写临时目录下的图片数据库  测试后恢复原数据库并清空素材解码缓存"""
+    from nonebot_plugin_splatoon3_schedule.data.db_image import DBIMAGE
+
+    tools = importlib.import_module("nonebot_plugin_splatoon3_schedule.image.image_processer_tools")
+    db = DBIMAGE(Path(work_dir) / "db")
+    saved = tools.db_image
+    tools.db_image = db
+    try:
+        yield db
+    finally:
+        tools.db_image = saved
+        tools.clean_asset_cache()
+        db.close()
+
+
+def get_stage_image(seed: int) -> bytes:
+    """生成与地图素材尺寸相近的jpeg  带噪点，解码耗时接近真实图片"""
+    image = Image.merge("RGB", [Image.effect_noise((640, 360), 32 + seed * 8)] * 3)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def bench_bulk_write(work_dir: Path, count=2000) -> dict:
+    """素材库 逐条写入与批量写入的耗时"""
+    # 插件需在nonebot初始化后导入
+    from nonebot_plugin_splatoon3_schedule.data.db_image import DBIMAGE
+
+    records = [(f"image_{i}", os.urandom(20 * 1024), f"素材{i}", "武器") for i in range(count)]
+    result = {}
+    for mode in ("逐条", "批量"):
+        db = DBIMAGE(Path(work_dir) / mode)
+        try:
+            st = time.perf_counter()
+            if mode == "逐条":
+                for record in records:
+                    db.add_or_modify_IMAGE_DATA(*record)
+            else:
+                db.add_or_modify_IMAGE_DATA_bulk(records)
+            result[f"{mode}(ms)"] = (time.perf_counter() - st) * 1000
+            written = len(db.get_img_names())
+            if written != count:
+                raise RuntimeError(f"{mode}写入后素材数量为{written}，应为{count}")
+        finally:
+            db.close()
+    return result
+
+
+def bench_blob_store(work_dir: Path, count=500, times=5) -> dict:
+    """图片读取 数据库BLOB与文件库的占用大小与单张读取耗时"""
+    from nonebot_plugin_splatoon3_schedule.data.blob_store import BlobStore
+
+    work_dir = Path(work_dir)
+    images = [os.urandom(100 * 1024) for _ in range(count)]
+    # 旧方式 图片二进制储存在BLOB列中
+    db_path = work_dir / "blob.db"
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("CREATE TABLE IMAGE_DATA(id INTEGER PRIMARY KEY, image_data BLOB);")
+        conn.executemany("INSERT INTO IMAGE_DATA(id, image_data) VALUES (?, ?);", enumerate(images))
+        conn.commit()
+        st = time.perf_counter()
+        for _ in range(times):
+            for i in range(count):
+                conn.execute("select image_data from IMAGE_DATA where id=?;", (i,)).fetchone()
+        blob_cost = time.perf_counter() - st
+    finally:
+        conn.close()
+    # 新方式 数据库只储存哈希
+    store = BlobStore(work_dir / "blobs")
+    shas = [store.put(image) for image in images]
+    st = time.perf_counter()
+    for _ in range(times):
+        for sha in shas:
+            store.get(sha)
+    store_cost = time.perf_counter() - st
+    if store.get(shas[0]) != images[0]:
+        raise RuntimeError("文件库读取的内容与写入的不一致")
+    return {
+        "BLOB数据库(MB)": os.path.getsize(db_path) / 1024 / 1024,
+        "BLOB单张(ms)": blob_cost / times / count * 1000,
+        "文件库(MB)": store.get_size() / 1024 / 1024,
+        "文件库单张(ms)": store_cost / times / count * 1000,
+    }
+
+
+def bench_random_weapon(work_dir: Path, times=50) -> dict:
+    """随机武器 单次绘制耗时(武器图集 冷/热)  武器图片使用爬虫测试的fixtures"""
+    from nonebot_plugin_splatoon3_schedule.image.image_processer import get_random_weapon
+    from nonebot_plugin_splatoon3_schedule.image.image_processer_tools import weapon_tile_atlas
+    from nonebot_plugin_splatoon3_schedule.utils import WeaponData
+
+    images = Path(__file__).parent / "fixtures" / "weapon_crawl" / "images"
+    weapons = [
+        WeaponData(
+            f"weapon{i}",
+            "Splat Bomb",
+            "Trizooka",
+            200,
+            0,
+            "Shooter",
+            image=(images / "S3_Weapon_Main_Splattershot.png").read_bytes(),
+            sub_image=(images / "S3_Weapon_Sub_Splat_Bomb.png").read_bytes(),
+            special_image=(images / "S3_Weapon_Special_Trizooka.png").read_bytes(),
+            zh_name=f"武器{i}",
+        )
+        for i in range(8)
+    ]
+    weapon1, weapon2 = weapons[:4], weapons[4:]
+    # 图集为全局缓存，测试后恢复
+    saved = dict(weapon_tile_atlas)
+    try:
+        cold = 0
+        for _ in range(times):
+            weapon_tile_atlas.clear()
+            st = time.perf_counter()
+            get_random_weapon(weapon1, weapon2)
+            cold += time.perf_counter() - st
+        st = time.perf_counter()
+        for _ in range(times):
+            get_random_weapon(weapon1, weapon2)
+        hot = time.perf_counter() - st
+    finally:
+        weapon_tile_atlas.clear()
+        weapon_tile_atlas.update(saved)
+    return {"无图集(ms)": cold / times * 1000, "图集(ms)": hot / times * 1000}
+
+
+def bench_fetch_latency(work_dir: Path, miss_count=20, probe_count=200) -> dict:
+    """并发缓存未命中时的handler延迟(p99)  会访问 splatoon3.ink
+    清空日程与翻译的上游数据后同时发起多个请求，并用大量短任务测量事件循环的响应延迟"""
+    from nonebot_plugin_splatoon3_schedule.data.data_source import get_schedule_data, schedule_upstream
+    from nonebot_plugin_splatoon3_schedule.utils.snapshot import snapshot_store
+    from nonebot_plugin_splatoon3_schedule.utils.translation import get_trans_cht_data, trans_upstream
+
+    data_source = importlib.import_module("nonebot_plugin_splatoon3_schedule.data.data_source")
+    translation = importlib.import_module("nonebot_plugin_splatoon3_schedule.utils.translation")
+    upstreams = (schedule_upstream, trans_upstream)
+    # 上游数据、on_update 同步的模块全局变量与快照目录均为全局状态，测试后恢复
+    saved = [dict(vars(upstream)) for upstream in upstreams]
+    mirrors = [(data_source, "schedule_res"), (data_source, "schedule_index"), (translation, "trans_res")]
+    saved_mirrors = [getattr(module, name) for module, name in mirrors]
+    saved_folder = snapshot_store.folder
+    snapshot_store.folder = str(Path(work_dir) / "snapshot")
+    latencies = []
+
+    async def probe():
+        # 模拟普通handler，记录实际等待时间与预期等待时间的差值
+        st = time.perf_counter()
+        await asyncio.sleep(0.01)
+        latencies.append(time.perf_counter() - st - 0.01)
+
+    async def probes():
+        for _ in range(probe_count):
+            await asyncio.gather(*[probe() for _ in range(5)])
+
+    async def run():
+        st = time.perf_counter()
+        await asyncio.gather(
+            *[get_schedule_data() for _ in range(miss_count)],
+            *[get_trans_cht_data() for _ in range(miss_count)],
+            probes(),
+        )
+        return time.perf_counter() - st
+
+    try:
+        for upstream in upstreams:
+            # 没有数据与校验信息时，请求需要等待完整的网络请求
+            upstream.data = None
+            upstream.etag = None
+            upstream.last_modified = None
+            upstream.fetch_time = None
+        total = asyncio.run(run())
+    finally:
+        snapshot_store.folder = saved_folder
+        for upstream, state in zip(upstreams, saved):
+            vars(upstream).update(state)
+        for (module, name), value in zip(mirrors, saved_mirrors):
+            setattr(module, name, value)
+    latencies.sort()
+    return {
+        "总耗时(ms)": total * 1000,
+        "p50(ms)": latencies[len(latencies) // 2] * 1000,
+        "p99(ms)": latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000,
+        "max(ms)": latencies[-1] * 1000,
+    }
+
+
+def bench_stage_card(work_dir: Path, times=50) -> dict:
+    """单张地图卡片的绘制耗时(素材解码缓存 冷/热)
+    冷缓存时每张卡片都需要读取本地png与数据库地图素材并解码缩放，热缓存时直接复用缩放好的Image"""
+    from nonebot_plugin_splatoon3_schedule.image.image_processer_tools import get_stage_card, clean_asset_cache
+    from nonebot_plugin_splatoon3_schedule.utils import ImageInfo
+
+    stage1 = ImageInfo(name="Scorch Gorge", url="", zh_name="温泉花大峡谷", source_type="对战地图")
+    stage2 = ImageInfo(name="Eeltail Alley", url="", zh_name="鳗鲶区", source_type="对战地图")
+    args = (stage1, stage2, "蛮颓开放", "Ranked-Open", "LOFT")
+    with use_image_db(work_dir) as db:
+        records = [(img.name, get_stage_image(i), img.zh_name, img.source_type) for i, img in enumerate(args[:2])]
+        db.add_or_modify_IMAGE_DATA_bulk(records)
+        # 冷缓存
+        cold = 0
+        for _ in range(times):
+            clean_asset_cache()
+            st = time.perf_counter()
+            get_stage_card(*args)
+            cold += time.perf_counter() - st
+        # 热缓存
+        get_stage_card(*args)
+        st = time.perf_counter()
+        for _ in range(times):
+            get_stage_card(*args)
+        hot = time.perf_counter() - st
+    return {"冷缓存(ms)": cold / times * 1000, "热缓存(ms)": hot / times * 1000}
+
+
+def bench_all_stages(work_dir: Path, times=5, schedule=None) -> dict:
+    """全部图 渲染耗时(圆角蒙版缓存 冷/热)
+    冷缓存时每次 circle_corner 都需要重新绘制蒙版，热缓存时直接复用相同尺寸半径的蒙版
+    未传入日程数据时取当前日程，会访问 splatoon3.ink，地图素材下载到临时目录下的数据库"""
+    from nonebot_plugin_splatoon3_schedule.data import get_stage_info
+    from nonebot_plugin_splatoon3_schedule.image.image_processer import get_stages
+    from nonebot_plugin_splatoon3_schedule.image.image_processer_tools import corner_mask_cache
+
+    num_list = [0, 1, 2, 3, 4, 5]
+    if schedule is None:
+        schedule = asyncio.run(get_stage_info(num_list, None, None))[0]
+    with use_image_db(work_dir):
+        # 先渲染一次，排除素材与字体加载的影响
+        if get_stages(schedule, num_list) is None:
+            raise RuntimeError("日程中没有可绘制的对战")
+        cold = 0
+        for _ in range(times):
+            corner_mask_cache.clear()
+            st = time.perf_counter()
+            get_stages(schedule, num_list)
+            cold += time.perf_counter() - st
+        st = time.perf_counter()
+        for _ in range(times):
+            get_stages(schedule, num_list)
+        hot = time.perf_counter() - st
+    return {"无蒙版缓存(ms)": cold / times * 1000, "蒙版缓存(ms)": hot / times * 1000}
+
+
+benches = {
+    "bulk_write": bench_bulk_write,
+    "blob_store": bench_blob_store,
+    "random_weapon": bench_random_weapon,
+    "fetch_latency": bench_fetch_latency,
+    "stage_card": bench_stage_card,
+    "all_stages": bench_all_stages,
+}
+
+
+if __name__ == "__main__":
+    # 插件导入时需要已初始化的nonebot
+    nonebot.init(driver="~none")
+    for name in sys.argv[1:] or benches:
+        with tempfile.TemporaryDirectory() as work_dir:
+            result = benches[name](Path(work_dir))
+        logger.info("{} {}".format(name, " ".join(f"{k}:{v:.3f}" for k, v in result.items())))
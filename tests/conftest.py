@@ -0,0 +1,99 @@
+import datetime
+import importlib
+import io
+
+import nonebot
+import pytest
+from PIL import Image
+
+# 插件导入时需要已初始化的nonebot，测试中不需要真实的驱动器
+nonebot.init(driver="~none")
+
+from nonebot_plugin_splatoon3_schedule.config import plugin_config  # noqa: E402
+from nonebot_plugin_splatoon3_schedule.data.db_control import DBCONTROL  # noqa: E402
+from nonebot_plugin_splatoon3_schedule.data.db_image import DBIMAGE  # noqa: E402
+
+util = importlib.import_module("nonebot_plugin_splatoon3_schedule.util")
+image_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.image.image")
+tools_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.image.image_processer_tools")
+utils_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.utils.utils")
+
+
+@pytest.fixture
+def image_db(tmp_path):
+    """临时目录下的图片数据库，不影响插件资源目录下的数据库"""
+    db = DBIMAGE(tmp_path / "db")
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def control_db(tmp_path):
+    """临时目录下的控制数据库"""
+    db = DBCONTROL(tmp_path / "control")
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def local_relay(image_db, monkeypatch):
+    """使用本地中转上传并记录上传的图片，不需要接入kook bot"""
+    uploads = []
+
+    async def upload(img):
+        uploads.append(img)
+        return await util.local_relay_upload(img)
+
+    monkeypatch.setattr(plugin_config, "splatoon3_image_relay", "local")
+    monkeypatch.setattr(util, "relay_uploaders", {"local": upload})
+    monkeypatch.setattr(util, "db_image", image_db)
+    return uploads
+
+
+@pytest.fixture
+def tile_cache(monkeypatch):
+    """使用空的武器图集，绘制函数只记录绘制的武器名  返回 (图集, 绘制记录)"""
+    atlas = {}
+    drawn = []
+
+    def draw_weapon_tile(weapon, rgb, font_color):
+        drawn.append(weapon.name)
+        return Image.new("RGBA", (150, 230), tuple(rgb))
+
+    monkeypatch.setattr(tools_module, "weapon_tile_atlas", atlas)
+    monkeypatch.setattr(tools_module, "draw_weapon_tile", draw_weapon_tile)
+    return atlas, drawn
+
+
+class FakeRenderer:
+    """声明了输入数据的绘图函数  记录取输入数据与渲染的次数"""
+
+    def __init__(self, expire_hours=1):
+        self.expire_hours = expire_hours
+        self.input_calls = 0
+        self.render_calls = 0
+
+    async def get_input(self, *args):
+        self.input_calls += 1
+        return {"args": list(args)}
+
+    async def get_expire_time(self):
+        expire_time = utils_module.get_time_now_china() + datetime.timedelta(hours=self.expire_hours)
+        return expire_time.strftime(utils_module.time_format_ymdh)
+
+    async def render(self, *args):
+        self.render_calls += 1
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8), "orange").save(buffer, format="JPEG")
+        return buffer.getvalue()
+
+
+@pytest.fixture
+def fake_renderer(image_db, monkeypatch):
+    """注册到渲染缓存的绘图函数，渲染结果写入临时图片数据库"""
+    renderer = FakeRenderer()
+    monkeypatch.setattr(image_module, "db_image", image_db)
+    monkeypatch.setattr(image_module, "render_input_keys", {})
+    monkeypatch.setattr(image_module, "render_inputs", {renderer.render: (1, renderer.get_input)})
+    monkeypatch.setattr(image_module, "render_expire_getters", {renderer.render: renderer.get_expire_time})
+    return renderer
@@ -0,0 +1,86 @@
+import asyncio
+import datetime
+import importlib
+
+import httpx
+
+from tests import benchmarks
+
+upstream_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.utils.upstream")
+data_source = importlib.import_module("nonebot_plugin_splatoon3_schedule.data.data_source")
+translation = importlib.import_module("nonebot_plugin_splatoon3_schedule.utils.translation")
+tools_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.image.image_processer_tools")
+
+# 以少量数据运行性能测试，确保测试脚本与当前代码保持一致
+
+
+def test_bench_bulk_write(tmp_path):
+    result = benchmarks.bench_bulk_write(tmp_path, count=50)
+    assert set(result) == {"逐条(ms)", "批量(ms)"}
+
+
+def test_bench_blob_store(tmp_path):
+    result = benchmarks.bench_blob_store(tmp_path, count=20, times=1)
+    # 文件库不含数据库页的开销，占用不超过BLOB数据库
+    assert 0 < result["文件库(MB)"] <= result["BLOB数据库(MB)"]
+
+
+def test_bench_random_weapon(tmp_path):
+    result = benchmarks.bench_random_weapon(tmp_path, times=2)
+    assert set(result) == {"无图集(ms)", "图集(ms)"}
+
+
+def test_bench_fetch_latency(tmp_path, monkeypatch):
+    # 不访问网络  上游返回最小的日程与翻译数据
+    node = {"startTime": "2000-01-01T00:00:00Z", "endTime": "2000-01-01T02:00:00Z", "regularMatchSetting": None}
+    schedule = {"regularSchedules": {"nodes": [node]}, "bankaraSchedules": {"nodes": []}, "xSchedules": {"nodes": []}}
+    urls = []
+
+    async def async_cf_http_get(url, headers=None):
+        urls.append(url)
+        await asyncio.sleep(0.01)
+        payload = {"data": schedule} if url == data_source.schedule_upstream.url else {}
+        return httpx.Response(200, json=payload, request=httpx.Request("GET", url))
+
+    monkeypatch.setattr(upstream_module, "async_cf_http_get", async_cf_http_get)
+    saved = data_source.schedule_upstream.data
+    result = benchmarks.bench_fetch_latency(tmp_path, miss_count=3, probe_count=2)
+    assert set(result) == {"总耗时(ms)", "p50(ms)", "p99(ms)", "max(ms)"}
+    # 并发的未命中合并为每份数据一次请求，测试后恢复原有的上游数据
+    assert len(urls) == 2
+    assert data_source.schedule_upstream.data is saved
+    assert data_source.schedule_res is saved
+    assert (tmp_path / "snapshot" / "schedules.json").exists()
+
+
+def test_bench_stage_card(tmp_path):
+    result = benchmarks.bench_stage_card(tmp_path, times=2)
+    assert set(result) == {"冷缓存(ms)", "热缓存(ms)"}
+
+
+def get_vs_setting(rule):
+    stages = [{"id": f"{i}", "name": f"stage{i}", "image": {"url": f"https://fixtures.invalid/{i}.jpg"}} for i in "12"]
+    return {"vsStages": stages, "vsRule": {"rule": rule}}
+
+
+def test_bench_all_stages(tmp_path, monkeypatch):
+    # 不访问网络  6个未来时段的日程，地图素材"下载"为生成的图片并写入临时数据库
+    now = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    nodes = []
+    for i in range(6):
+        start, end = (now + datetime.timedelta(hours=2 * i + h) for h in (1, 3))
+        nodes.append({"startTime": f"{start:%Y-%m-%dT%H:%M:%SZ}", "endTime": f"{end:%Y-%m-%dT%H:%M:%SZ}"})
+    schedule = {
+        "regularSchedules": {"nodes": [dict(node, regularMatchSetting=get_vs_setting("TURF_WAR")) for node in nodes]},
+        "bankaraSchedules": {
+            "nodes": [
+                dict(node, bankaraMatchSettings=[get_vs_setting("LOFT"), get_vs_setting("AREA")]) for node in nodes
+            ]
+        },
+        "xSchedules": {"nodes": [dict(node, xMatchSetting=get_vs_setting("CLAM")) for node in nodes]},
+        "festSchedules": {"nodes": []},
+    }
+    monkeypatch.setattr(translation, "trans_res", {"stages": {}})
+    monkeypatch.setattr(tools_module, "get_cf_file_url", lambda url: benchmarks.get_stage_image(0))
+    result = benchmarks.bench_all_stages(tmp_path, times=1, schedule=schedule)
+    assert set(result) == {"无蒙版缓存(ms)", "蒙版缓存(ms)"}
@@ -0,0 +1,71 @@
+import asyncio
+import importlib
+import os
+import time
+
+from nonebot_plugin_splatoon3_schedule.config import plugin_config
+from nonebot_plugin_splatoon3_schedule.data.blob_store import BlobStore
+
+util = importlib.import_module("nonebot_plugin_splatoon3_schedule.util")
+
+
+def set_old(store: BlobStore, sha: str, seconds=3600):
+    """把文件修改时间调到 seconds 秒前，模拟早已写入的文件"""
+    old = time.time() - seconds
+    os.utime(store.get_path(sha), (old, old))
+
+
+def test_gc_deletes_old_orphans(tmp_path):
+    store = BlobStore(tmp_path)
+    keep, orphan = store.put(b"keep"), store.put(b"orphan")
+    set_old(store, keep)
+    set_old(store, orphan)
+    assert store.gc(lambda: {keep}) == 1
+    assert store.has(keep) and not store.has(orphan)
+
+
+def test_gc_keeps_recent_orphans(tmp_path):
+    # 刚写入还未提交记录的文件不会被回收
+    store = BlobStore(tmp_path)
+    sha = store.put(b"new")
+    assert store.gc(lambda: set()) == 0
+    assert store.has(sha)
+
+
+def test_gc_keeps_blob_reused_after_listing(tmp_path):
+    # gc 列出文件后，并发写入复用了等待回收的文件，之后记录提交
+    store = BlobStore(tmp_path)
+    sha = store.put(b"reused")
+    set_old(store, sha)
+
+    def get_referenced():
+        assert store.put(b"reused") == sha
+        # 记录此时还未提交，查询结果中没有该文件
+        return set()
+
+    assert store.gc(get_referenced) == 0
+    assert store.get(sha) == b"reused"
+
+
+def test_missing_weapon_blob_is_absent(image_db):
+    image_db.add_or_modify_weapon_images_bulk([("Splattershot", "Main", b"main"), ("Burst Bomb", "Sub", b"sub")])
+    sha = image_db.blobs.get_sha(b"main")
+    image_db.blobs.get_path(sha).unlink()
+
+    assert image_db.get_weapon_image("Splattershot", "Main") is None
+    assert image_db.get_all_weapon_images() == {("Burst Bomb", "Sub"): b"sub"}
+    # 文件丢失的图片不计入已存在，更新武器数据时会重新下载
+    assert image_db.get_weapon_image_keys() == {("Burst Bomb", "Sub")}
+
+
+def test_gc_job_removes_replaced_temp_images(image_db, monkeypatch):
+    # 未开启预渲染时，替换合成图片缓存留下的旧文件也会被定时任务清理
+    monkeypatch.setattr(plugin_config, "splatoon3_prerender_enable", False)
+    monkeypatch.setattr(util, "db_image", image_db)
+    image_db.add_or_modify_IMAGE_TEMP("图", b"old", "2000-01-01T00")
+    old = image_db.blobs.get_sha(b"old")
+    set_old(image_db.blobs, old)
+    image_db.add_or_modify_IMAGE_TEMP("图", b"new", "2000-01-01T00")
+    asyncio.run(util.gc_blobs_job())
+    assert not image_db.blobs.has(old)
+    assert image_db.get_img_temp("图")["image_data"] == b"new"
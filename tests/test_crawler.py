@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import importlib
+import json
+from pathlib import Path
+
+import httpx
+import pytest
+
+from nonebot_plugin_splatoon3_schedule.data.weapon_catalogue import WeaponCatalogue
+
+static_data_getter = importlib.import_module("nonebot_plugin_splatoon3_schedule.data.static_data_getter")
+catalogue_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.data.weapon_catalogue")
+
+# 保存的wiki页面  武器列表，各图片的 File 页面，以及图片文件
+fixtures = Path(__file__).parent / "fixtures" / "weapon_crawl"
+file_page_prefix = static_data_getter.base_url + "/File:"
+image_url_prefix = "https://fixtures.invalid/images/"
+
+
+class FixtureFetch:
+    """读取本地fixtures代替网络请求  支持 If-None-Match 条件请求，可指定请求失败的url"""
+
+    def __init__(self, fail_urls=()):
+        self.fail_urls = set(fail_urls)
+        self.urls = []
+
+    async def __call__(self, url, headers=None):
+        self.urls.append(url)
+        request = httpx.Request("GET", url)
+        if url in self.fail_urls:
+            raise httpx.ConnectError("fixture offline", request=request)
+        if url == static_data_getter.weapon_url:
+            path = fixtures / "weapon_list.html"
+        elif url.startswith(file_page_prefix):
+            path = fixtures / "File_{}.html".format(url[len(file_page_prefix) : -len(".png")])
+        elif url.startswith(image_url_prefix):
+            path = fixtures / "images" / url[len(image_url_prefix) :]
+        else:
+            return httpx.Response(404, request=request)
+        content = path.read_bytes()
+        etag = '"{}"'.format(hashlib.sha1(content).hexdigest())
+        if headers and headers.get("If-None-Match") == etag:
+            return httpx.Response(304, request=request)
+        return httpx.Response(200, content=content, headers={"ETag": etag}, request=request)
+
+
+@pytest.fixture
+def crawler(image_db, tmp_path, monkeypatch):
+    """爬虫写入临时数据库与临时暂存目录  返回 run(fetch, incremental)"""
+    monkeypatch.setattr(static_data_getter, "db_image", image_db)
+    monkeypatch.setattr(catalogue_module, "db_image", image_db)
+    monkeypatch.setattr(static_data_getter, "weapon_catalogue", WeaponCatalogue())
+    staging_path = tmp_path / "staging"
+
+    def run(fetch, incremental=False):
+        return asyncio.run(
+            static_data_getter.reload_weapon_info(incremental=incremental, fetch=fetch, staging_path=staging_path)
+        )
+
+    run.staging_path = staging_path
+    return run
+
+
+def test_crawl_writes_weapon_data(crawler, image_db):
+    report = crawler(FixtureFetch())
+    # 秩序dlc武器被排除
+    assert [w.name for w in image_db.get_all_weapon_data()] == ["Splattershot", "Splattershot Jr."]
+    # 两把武器各3张图片 + 共用的类型图片
+    images = image_db.get_all_weapon_images()
+    assert len(images) == 7
+    assert images[("Trizooka", "Special")] == (fixtures / "images" / "S3_Weapon_Special_Trizooka.png").read_bytes()
+    assert not crawler.staging_path.exists()
+    assert "新图片: 7张" in report
+
+
+def test_crawl_resumes_from_staging(crawler, image_db, monkeypatch):
+    monkeypatch.setattr(static_data_getter, "CRAWLER_RETRY_TIMES", 1)
+    trizooka = image_url_prefix + "S3_Weapon_Special_Trizooka.png"
+    report = crawler(FixtureFetch(fail_urls=[trizooka]))
+    assert "失败: 1张" in report
+    # 失败时保留暂存目录与完整清单，图片全部成功的武器才记录行哈希
+    manifest = json.loads((crawler.staging_path / "manifest.json").read_text(encoding="utf-8"))
+    assert len(manifest["items"]) == 6
+    assert set(image_db.get_all_weapon_sync()) == {"Splattershot Jr."}
+
+    fetch = FixtureFetch()
+    report = crawler(fetch, incremental=True)
+    # 只重新请求失败的图片，已暂存的图片从断点继续
+    assert fetch.urls == [static_data_getter.weapon_url, file_page_prefix + "S3_Weapon_Special_Trizooka.png", trizooka]
+    assert "断点续传: 3张" in report
+    assert len(image_db.get_all_weapon_images()) == 7
+    assert set(image_db.get_all_weapon_sync()) == {"Splattershot", "Splattershot Jr."}
+    assert not crawler.staging_path.exists()
+
+
+def test_crawl_incremental_not_modified(crawler):
+    crawler(FixtureFetch())
+    fetch = FixtureFetch()
+    report = crawler(fetch, incremental=True)
+    assert "武器列表未改变" in report
+    assert fetch.urls == [static_data_getter.weapon_url]
+
+
+def test_staging_flushes_manifest_in_batches(tmp_path):
+    async def save_all():
+        staging = static_data_getter.CrawlStaging(tmp_path, flush_size=3)
+        for i in range(4):
+            await staging.save(f"weapon{i}", "Main", b"image")
+        flushed = json.loads(staging.manifest_path.read_text(encoding="utf-8"))["items"]
+        await staging.flush()
+        return flushed
+
+    assert len(asyncio.run(save_all())) == 3
+    assert len(static_data_getter.CrawlStaging(tmp_path)) == 4
@@ -0,0 +1,34 @@
+import asyncio
+import importlib
+
+from nonebot_plugin_splatoon3_schedule.config import plugin_config
+
+util = importlib.import_module("nonebot_plugin_splatoon3_schedule.util")
+
+
+def test_prerender_waits_for_refreshed_schedule(image_db, monkeypatch):
+    # 轮换时上游数据还未更新  get_schedule_data 先返回旧数据，重新请求两次后才取到新数据
+    stale, fresh = {"expired": True}, {"expired": False}
+    refresh_results = [stale, fresh]
+    prefetched = []
+
+    async def get_schedule_data():
+        return stale
+
+    async def refresh():
+        return refresh_results.pop(0)
+
+    async def prefetch_schedule_images(schedule):
+        prefetched.append(schedule)
+
+    monkeypatch.setattr(plugin_config, "splatoon3_prerender_enable", True)
+    monkeypatch.setattr(util, "get_schedule_data", get_schedule_data)
+    monkeypatch.setattr(util.schedule_upstream, "refresh", refresh)
+    monkeypatch.setattr(util, "check_expire_schedule", lambda schedule: schedule["expired"])
+    monkeypatch.setattr(util, "prefetch_schedule_images", prefetch_schedule_images)
+    monkeypatch.setattr(util, "get_prerender_list", lambda: [])
+    monkeypatch.setattr(util, "db_image", image_db)
+
+    asyncio.run(util.prerender_job(retry_times=3, retry_interval=0))
+    assert prefetched == [fresh]
+    assert util.get_prerender_report().startswith("预渲染完成")
@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+import importlib
+
+import pytest
+from nonebot.adapters.kaiheila import Bot as Kook_Bot
+from nonebot.exception import NetworkError
+
+from nonebot_plugin_splatoon3_schedule.config import plugin_config
+from nonebot_plugin_splatoon3_schedule.utils import fan_out
+
+util = importlib.import_module("nonebot_plugin_splatoon3_schedule.util")
+
+# 当前时间  12点轮换开始后半小时，已过定时推送时间
+now = datetime.datetime(2026, 10, 18, 12, 30)
+rotation = "2026-10-18T12"
+kinds = [kind for kind, _, _ in util.push_messages]
+
+
+class FakeAdapter:
+    @staticmethod
+    def get_name():
+        return "Kaiheila"
+
+
+@pytest.fixture
+def push_bot(control_db, monkeypatch):
+    """不接入平台的kook bot  发送的频道消息记录在 bot.sent 中"""
+    bot = Kook_Bot.__new__(Kook_Bot)
+    bot.adapter = FakeAdapter()
+    bot.self_id = "bot"
+    bot.sent = []
+
+    async def get_save_temp_image(trigger_word, func, *args):
+        return trigger_word.encode("utf-8")
+
+    async def send_channel_msg(_bot, source_id, msg, raise_error=False):
+        bot.sent.append((source_id, msg.decode("utf-8")))
+
+    monkeypatch.setattr(util, "db_control", control_db)
+    monkeypatch.setattr(util, "get_save_temp_image", get_save_temp_image)
+    monkeypatch.setattr(util, "send_channel_msg", send_channel_msg)
+    monkeypatch.setattr(util, "get_time_now_china", lambda: now)
+    monkeypatch.setattr(util, "push_limiters", {})
+    monkeypatch.setattr(plugin_config, "splatoon3_push_rate", 0)
+    return bot
+
+
+def add_channels(control_db, *source_ids):
+    for source_id in source_ids:
+        control_db.add_or_modify_MESSAGE_CONTROL("Kaiheila", "bot", "channel", source_id, active_push=1)
+
+
+def get_status(control_db) -> dict:
+    journal = control_db.get_push_journal(rotation, "Kaiheila", "bot")
+    return {(row["msg_source_id"], row["msg_kind"]): row["status"] for row in journal}
+
+
+def test_fan_out_retries_and_gives_up_per_target():
+    attempts = {}
+
+    async def send(target, msg):
+        attempts[(target, msg)] = attempts.get((target, msg), 0) + 1
+        # b 的第一条消息一直失败，a 的第二条消息失败一次后成功
+        if target == "b" or (msg == 2 and attempts[(target, msg)] == 1):
+            raise NetworkError("offline")
+
+    report = asyncio.run(
+        fan_out("test", ["a", "b", "c"], [1, 2], send, retry_times=2, retry_interval=0, skip=lambda t, m: t == "c")
+    )
+    assert (report.success, report.failed, report.skipped) == (2, 1, 2)
+    assert attempts[("a", 2)] == 2
+    # 重试耗尽后放弃该目标的剩余消息
+    assert attempts[("b", 1)] == 3 and ("b", 2) not in attempts
+    assert set(report.errors) == {"b"}
+
+
+def test_push_journal_keeps_delivered_status(control_db):
+    control_db.add_push_journal(rotation, "Kaiheila", "bot", ["1"], kinds)
+    key = control_db.get_push_key(rotation, "Kaiheila", "bot", "1", kinds[0])
+    control_db.update_push_journal(key, "sent")
+    # 重复登记不会重置已投递的消息
+    control_db.add_push_journal(rotation, "Kaiheila", "bot", ["1", "2"], kinds)
+    status = get_status(control_db)
+    assert len(status) == 2 * len(kinds)
+    assert status[("1", kinds[0])] == "sent"
+    assert list(status.values()).count("sent") == 1
+
+
+def test_send_push_skips_delivered(push_bot, control_db):
+    control_db.add_push_journal(rotation, "Kaiheila", "bot", ["1"], kinds)
+    control_db.update_push_journal(control_db.get_push_key(rotation, "Kaiheila", "bot", "1", kinds[0]), "sent")
+    asyncio.run(util.send_push(push_bot, ["1", "2"]))
+    assert sorted(push_bot.sent) == sorted([("1", kind) for kind in kinds[1:]] + [("2", kind) for kind in kinds])
+    assert set(get_status(control_db).values()) == {"sent"}
+
+
+def test_resume_push_continues_journal(push_bot, control_db):
+    add_channels(control_db, "1")
+    control_db.add_push_journal(rotation, "Kaiheila", "bot", ["1"], kinds)
+    control_db.update_push_journal(control_db.get_push_key(rotation, "Kaiheila", "bot", "1", kinds[0]), "sent")
+    asyncio.run(util.resume_push(push_bot))
+    assert push_bot.sent == [("1", kind) for kind in kinds[1:]]
+
+
+def test_resume_push_sends_missed_rotation(push_bot, control_db):
+    # bot在推送时间断线，定时推送未执行，没有投递日志
+    add_channels(control_db, "1", "2")
+    asyncio.run(util.resume_push(push_bot))
+    assert sorted(push_bot.sent) == sorted((source_id, kind) for source_id in "12" for kind in kinds)
+    assert set(get_status(control_db).values()) == {"sent"}
+    # 已全部投递，再次接入时不会重发
+    asyncio.run(util.resume_push(push_bot))
+    assert len(push_bot.sent) == 2 * len(kinds)
+
+
+def test_resume_push_waits_for_push_time(push_bot, control_db, monkeypatch):
+    add_channels(control_db, "1")
+    monkeypatch.setattr(util, "get_time_now_china", lambda: datetime.datetime(2026, 10, 18, 12, 0, 30))
+    asyncio.run(util.resume_push(push_bot))
+    assert push_bot.sent == []
+    assert get_status(control_db) == {}
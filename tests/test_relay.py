@@ -0,0 +1,37 @@
+import asyncio
+import importlib
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from nonebot_plugin_splatoon3_schedule.data.db_image import DBIMAGE
+
+util = importlib.import_module("nonebot_plugin_splatoon3_schedule.util")
+
+
+def test_relay_url_reused(local_relay):
+    image = b"relay image"
+
+    async def get_urls():
+        # 并发请求同一张图片只上传一次，之后直接读取数据库中的链接
+        urls = await asyncio.gather(*[util.get_relay_url(image) for _ in range(3)])
+        return urls + [await util.get_relay_url(image)]
+
+    urls = asyncio.run(get_urls())
+    assert len(set(urls)) == 1
+    assert local_relay == [image]
+    assert Path(url2pathname(urlparse(urls[0]).path)).read_bytes() == image
+
+
+def test_relay_url_persisted(local_relay, image_db, monkeypatch):
+    image = b"relay image"
+    url = asyncio.run(util.get_relay_url(image))
+    image_db.close()
+    # 重启后仍可复用数据库中的链接
+    reopened = DBIMAGE(image_db.db_path)
+    try:
+        monkeypatch.setattr(util, "db_image", reopened)
+        assert asyncio.run(util.get_relay_url(image)) == url
+    finally:
+        reopened.close()
+    assert len(local_relay) == 1
@@ -0,0 +1,52 @@
+import asyncio
+import importlib
+
+image_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.image.image")
+upstream_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.utils.upstream")
+
+
+def test_input_key_memoized_until_upstream_replaced(fake_renderer, image_db, monkeypatch):
+    monkeypatch.setattr(upstream_module, "upstream_registry", [])
+    upstream = upstream_module.UpstreamData("test", "https://fixtures.invalid/test.json")
+    upstream.set_data({"n": 1}, "2000-01-01T00", None)
+
+    async def keys():
+        return [await image_module.get_render_input_key(fake_renderer.render, "塔楼") for _ in range(3)]
+
+    assert len(set(asyncio.run(keys()))) == 1
+    assert fake_renderer.input_calls == 1
+    # 304 沿用同一对象，不重新计算
+    upstream.set_data(upstream.data, "2000-01-01T00", None)
+    asyncio.run(keys())
+    assert fake_renderer.input_calls == 1
+    # 上游数据被替换后重新计算
+    upstream.set_data({"n": 2}, "2000-01-01T00", None)
+    asyncio.run(keys())
+    assert fake_renderer.input_calls == 2
+
+
+def test_input_key_recomputed_after_expire_time(fake_renderer):
+    # 过期时间截断到小时，已到达过期时间时每次都重新取输入数据
+    fake_renderer.expire_hours = 0
+
+    async def keys():
+        for _ in range(2):
+            await image_module.get_render_input_key(fake_renderer.render, "打工")
+
+    asyncio.run(keys())
+    assert fake_renderer.input_calls == 2
+
+
+def test_memory_hit_skips_db_thread(fake_renderer, image_db, monkeypatch):
+    image_data = asyncio.run(image_module.get_save_temp_image("塔楼", fake_renderer.render, "塔楼"))
+    assert fake_renderer.render_calls == 1
+
+    async def run_db(*args):
+        raise AssertionError("内存缓存命中时不应访问数据库")
+
+    monkeypatch.setattr(image_module, "run_db", run_db)
+    misses = image_db.temp_cache.stats["misses"]
+    assert asyncio.run(image_module.get_save_temp_image("塔楼", fake_renderer.render, "塔楼")) == image_data
+    assert fake_renderer.render_calls == 1
+    assert fake_renderer.input_calls == 1
+    assert image_db.temp_cache.stats["misses"] == misses
@@ -0,0 +1,51 @@
+import asyncio
+import datetime
+import importlib
+
+image_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.image.image")
+utils_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.utils.utils")
+
+
+def node_time(hours: int) -> str:
+    """距现在若干小时的上游时间字符串 (UTC)"""
+    now = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    return (now + datetime.timedelta(hours=hours)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def expected(hours: int) -> str:
+    return utils_module.time_converter(node_time(hours)).strftime(utils_module.time_format_ymdh)
+
+
+def test_coop_expires_when_big_run_starts(monkeypatch):
+    # 一般打工时段还有40小时结束，大型跑在10小时后开始，图片上的 已开始 标记在大型跑开始时改变
+    schedule = {
+        "coopGroupingSchedule": {
+            "regularSchedules": {"nodes": [{"startTime": node_time(-8), "endTime": node_time(40)}]},
+            "bigRunSchedules": {"nodes": [{"startTime": node_time(10), "endTime": node_time(58)}]},
+            "teamContestSchedules": {"nodes": []},
+        }
+    }
+
+    async def get_schedule_data():
+        return schedule
+
+    monkeypatch.setattr(image_module, "get_schedule_data", get_schedule_data)
+    assert asyncio.run(image_module.get_coop_expire_time()) == expected(10)
+
+
+def test_events_expire_when_period_starts(monkeypatch):
+    # 进行中的活动还有12小时结束，另一活动5小时后开始，该活动的 未开始 状态在开始时改变
+    schedule = {
+        "eventSchedules": {
+            "nodes": [
+                {"timePeriods": [{"startTime": node_time(-1), "endTime": node_time(12)}]},
+                {"timePeriods": [{"startTime": node_time(5), "endTime": node_time(7)}]},
+            ]
+        }
+    }
+
+    async def get_schedule_data():
+        return schedule
+
+    monkeypatch.setattr(image_module, "get_schedule_data", get_schedule_data)
+    assert asyncio.run(image_module.get_events_expire_time()) == expected(5)
@@ -0,0 +1,46 @@
+import importlib
+
+from PIL import Image
+
+from nonebot_plugin_splatoon3_schedule.utils import WeaponData
+
+tools_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.image.image_processer_tools")
+processer_module = importlib.import_module("nonebot_plugin_splatoon3_schedule.image.image_processer")
+
+
+def weapon(name):
+    return WeaponData(name, "", "", 0, 0, "")
+
+
+def test_weapon_tile_drawn_once(tile_cache):
+    _, drawn = tile_cache
+    for name in ("a", "b", "a", "b"):
+        tools_module.get_weapon_tile(weapon(name), (1, 2, 3), (255, 255, 255))
+    assert drawn == ["a", "b"]
+
+
+def test_weapon_tile_redrawn_after_catalogue_reload(tile_cache, monkeypatch):
+    _, drawn = tile_cache
+    catalogue = tools_module.weapon_catalogue
+    tools_module.get_weapon_tile(weapon("a"), (1, 2, 3), (255, 255, 255))
+    monkeypatch.setattr(catalogue, "version", catalogue.version + 1)
+    tools_module.get_weapon_tile(weapon("a"), (1, 2, 3), (255, 255, 255))
+    assert drawn == ["a", "a"]
+
+
+def test_build_weapon_atlas_holds_every_tile(tile_cache, monkeypatch):
+    atlas, drawn = tile_cache
+    catalogue = processer_module.weapon_catalogue
+    # 图集不受素材缓存容量限制，全部武器的图块都会被绘制并保留
+    monkeypatch.setattr(tools_module.asset_cache, "max_size", 0)
+    weapons = [weapon(str(i)) for i in range(300)]
+    monkeypatch.setattr(catalogue, "all_weapons", lambda: weapons)
+    atlas[(catalogue.version - 1, "old", (0, 0, 0), (0, 0, 0))] = Image.new("RGBA", (1, 1))
+    processer_module.build_weapon_atlas()
+    styles = len(processer_module.weapon_card_styles)
+    assert len(drawn) == len(atlas) == len(weapons) * styles
+    assert all(key[0] == catalogue.version for key in atlas)
+    # 生成后随机武器直接读取图集
+    for rgb, font_color in processer_module.weapon_card_styles:
+        tools_module.get_weapon_tile(weapons[-1], rgb, font_color)
+    assert len(drawn) == len(weapons) * styles